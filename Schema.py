@@ -1,4 +1,5 @@
-from pydantic import BaseModel, Field  
+from typing import Annotated
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, WrapValidator
 
 class Recommendation(BaseModel):
     source: str
@@ -13,3 +14,41 @@ class Recommendation(BaseModel):
     riskType:str
     metadata: dict | None = None
     postMitigationValue: float | None = None
+
+
+class RejectedItem:
+    """Placeholder left in a batch for an item that failed validation."""
+    __slots__ = ("errors",)
+
+    def __init__(self, errors: list[dict]):
+        self.errors = errors
+
+
+def _keep_errors(value, handler):
+    try:
+        return handler(value)
+    except ValidationError as e:
+        errors = e.errors(include_url=False, include_context=False)
+        return RejectedItem([{k: v for k, v in err.items() if k != "input"} for err in errors])
+
+
+# Validates a whole JSON array of recommendations straight from bytes in one
+# pydantic-core call. Invalid items come back as RejectedItem instead of
+# failing the batch.
+RecommendationBatch = TypeAdapter(list[Annotated[Recommendation, WrapValidator(_keep_errors)]])
+RecommendationList = TypeAdapter(list[Recommendation])
+
+
+def validate_recommendations_json(data: bytes) -> list:
+    """
+    Validates a JSON array of recommendations from raw bytes.
+    The all-valid case takes the plain list validator; only a batch with
+    invalid items is re-run through RecommendationBatch to isolate them.
+    Malformed JSON still raises ValidationError.
+    """
+    try:
+        return RecommendationList.validate_json(data)
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" or not err["loc"] for err in e.errors()):
+            raise
+        return RecommendationBatch.validate_json(data)
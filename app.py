@@ -1,9 +1,8 @@
-
+import os
 from flask import Flask
 from routes import bp as api_bp
 
-import threading
-from helper import auto_scheduler
+from leader import LEADER
 
 
 def create_app():
@@ -12,13 +11,11 @@ def create_app():
     return app
 
 
-def start_auto_scheduler():
-    """Launch scheduler in background thread."""
-   
-    thread = threading.Thread(target=auto_scheduler, daemon=True)
-    thread.start()
-
 if __name__ == "__main__":
+    # development server; use serve.py for multiple workers
     app = create_app()
-    start_auto_scheduler()
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    debug = os.getenv("FLASK_DEBUG", "0") == "1"
+    # with the debug reloader, only the serving child (WERKZEUG_RUN_MAIN) runs the background services
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        LEADER.start()
+    app.run(host="0.0.0.0", port=8080, debug=debug)
@@ -0,0 +1,462 @@
+# bench.py
+"""
+Offline benchmarks. Everything runs against a throwaway SQLite file and, for
+e2e, the local fake LLM server, so no SQL Server, network or API key is needed.
+
+    python bench.py run_query --rows 50000
+    python bench.py ingest --rows 20000
+    python bench.py payload --rows 1000
+    python bench.py logging --rows 20000
+    python bench.py e2e --rows 10000 --iterations 5 --latency 0.05
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+
+def _measure(fn, repeat: int = 3) -> tuple[float, int]:
+    """Returns (best wall time in seconds, peak traced memory in bytes)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def _report(title: str, results: dict[str, tuple[float, int]], rows: int) -> None:
+    print(f"\n{title} ({rows:,} rows)")
+    print(f"{'variant':<28}{'time (ms)':>12}{'rows/s':>14}{'peak (MiB)':>14}")
+    for name, (secs, peak) in results.items():
+        print(f"{name:<28}{secs * 1000:>12.1f}{rows / secs:>14,.0f}{peak / 2**20:>14.2f}")
+
+
+def _sqlite_engine(path: str):
+    """Points helper.ENGINE at a SQLite file that returns real date/datetime objects."""
+    os.environ["SQL_URL"] = f"sqlite:///{path}"
+    import helper
+    from sqlalchemy import create_engine, event
+
+    helper.ENGINE = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"detect_types": sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES},
+    )
+    event.listen(helper.ENGINE, "connect", helper._attach_dbo_schema)
+    return helper
+
+
+def _seed_query_rows(path: str, rows: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE bench_rows (
+            KriId TEXT, KriName TEXT, MetricValue REAL, AsOfDate DATE,
+            RiskType TEXT, WarningLimit REAL, KriStatus TEXT, BreachedKris INTEGER, LoadedAt TIMESTAMP
+        )
+    """)
+    rnd = random.Random(7)
+    start = date(2024, 1, 31)
+    conn.executemany(
+        "INSERT INTO bench_rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (f"KRI-{i % 500:04d}", f"Metric {i % 500}", rnd.random() * 100, start + timedelta(days=30 * (i // 500)),
+             rnd.choice(["Credit", "Liquidity", "Operational", "Market"]), 10.0,
+             rnd.choice(["Breached", "Warning", "Safe"]), rnd.randint(0, 1), datetime(2025, 1, 1, 12, 0))
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_run_query(helper, sql: str, params: dict | None = None) -> list[dict]:
+    """The original run_query: fetchall plus an isinstance check per cell."""
+    from sqlalchemy import text
+
+    with helper.ENGINE.begin() as conn:
+        res = conn.execute(text(sql), params or {})
+        cols = res.keys()
+        rows = []
+        for row in res.fetchall():
+            row_dict = {}
+            for col, val in zip(cols, row):
+                if isinstance(val, (date, datetime)):
+                    row_dict[col] = val.isoformat()
+                else:
+                    row_dict[col] = val
+            rows.append(row_dict)
+        return rows
+
+
+def bench_run_query(rows: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        _seed_query_rows(path, rows)
+        helper = _sqlite_engine(path)
+        sql = "SELECT * FROM bench_rows"
+
+        def consume_iter():
+            n = 0
+            for _ in helper.iter_query(sql):
+                n += 1
+            return n
+
+        results = {
+            "legacy run_query": _measure(lambda: legacy_run_query(helper, sql)),
+            "run_query": _measure(lambda: helper.run_query(sql)),
+            "iter_query (streamed)": _measure(consume_iter),
+            "run_query_columns": _measure(lambda: helper.run_query_columns(sql)),
+        }
+        _report("run_query variants", results, rows)
+        helper.ENGINE.dispose()
+
+
+def _create_recommendations_table(path: str) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS t_insightView_Recommendations (
+            Id INTEGER PRIMARY KEY, Source TEXT, RelatedEntityId TEXT, MetricName TEXT, MetricValue REAL,
+            RecommendationText TEXT, ActionType TEXT, RiskType TEXT, Confidence REAL,
+            ReferenceTimestamp TIMESTAMP, ObservedAt DATE, Metadata TEXT, PostMitigationValue REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS IX_Rec_Key ON t_insightView_Recommendations (RelatedEntityId, ObservedAt, Source)")
+    conn.commit()
+    conn.close()
+
+
+def _recommendation_items(rows: int) -> list[dict]:
+    rnd = random.Random(11)
+    return [
+        {
+            "source": "KRI",
+            "relatedEntityId": f"KRI-{i:06d}",
+            "metricName": f"Metric {i % 500}",
+            "metricValue": rnd.random() * 100,
+            "recommendationText": "Treasury should reinforce the liquidity buffer and report weekly. " * 4,
+            "actionType": rnd.choice(["EmailStakeholders", "Investigate", "NoAction"]),
+            "confidence": round(rnd.random(), 2),
+            "referenceTimestamp": "2025-06-01T09:00:00Z",
+            "observedAt": "2025-05-31",
+            "riskType": rnd.choice(["Credit", "Liquidity", "Operational"]),
+            "metadata": {"batch": i // 1000},
+            "postMitigationValue": None,
+        }
+        for i in range(rows)
+    ]
+
+
+def bench_ingest(rows: int) -> None:
+    """Legacy POST /recommendations against POST /recommendations/bulk (array and NDJSON)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        _create_recommendations_table(path)
+        helper = _sqlite_engine(path)
+        from Schema import Recommendation, RecommendationBatch, validate_recommendations_json
+        from app import create_app
+
+        items = _recommendation_items(rows)
+        as_array = json.dumps(items).encode()
+        as_ndjson = b"\n".join(json.dumps(it).encode() for it in items) + b"\n"
+        client = create_app().test_client()
+
+        def post(url, data, content_type):
+            r = client.post(url, data=data, content_type=content_type)
+            assert r.status_code == 201, r.get_data(as_text=True)[:200]
+
+        validation = {
+            "per-item Recommendation(**it)": _measure(lambda: [Recommendation(**it) for it in json.loads(as_array)]),
+            "batch from bytes (valid)": _measure(lambda: validate_recommendations_json(as_array)),
+            "batch from bytes (isolating)": _measure(lambda: RecommendationBatch.validate_json(as_array)),
+        }
+        _report("validation only", validation, rows)
+
+        endpoints = {
+            "POST /recommendations": _measure(lambda: post("/recommendations", as_array, "application/json"), 1),
+            "bulk, JSON array": _measure(lambda: post("/recommendations/bulk", as_array, "application/json"), 1),
+            "bulk, NDJSON": _measure(lambda: post("/recommendations/bulk", as_ndjson, "application/x-ndjson"), 1),
+        }
+        _report("endpoint, incl. SQLite upsert", endpoints, rows)
+        helper.ENGINE.dispose()
+
+
+def _window_rows(rows: int) -> list[dict]:
+    """Rows shaped like KriSnapshot.window_rows(), as sent to /gpt/run."""
+    rnd = random.Random(5)
+    out = []
+    for i in range(rows):
+        value = rnd.random() * 20
+        status = "Breached" if value > 15 else "Warning"
+        out.append({
+            "relatedEntityId": f"KRI-{i % 400:04d}",
+            "metricName": f"Non-performing loans ratio, PFI segment {i % 40}",
+            "metricValue": value,
+            "observedAt": "2025-05-31" if i % 2 else "2025-04-30",
+            "kriStandard": "Basel III / BoG CRD",
+            "riskType": rnd.choice(["Credit", "Liquidity", "Operational", "Market"]),
+            "riskW": 1.0,
+            "impactLevel": rnd.randint(1, 3),
+            "likelihoodBin": rnd.randint(1, 5),
+            "probabilityLevel": rnd.choice(["Low", "Medium", "High"]),
+            "warningLimit": 10.0,
+            "warningLimitOperator": ">",
+            "escalationLimit": 15.0,
+            "escalationLimitOperator": ">",
+            "thresholdLimit": None,
+            "thresholdOperator": None,
+            "exposureScore": rnd.random(),
+            "statusBand": status,
+            "breachLevel": 2 if status == "Breached" else 1,
+        })
+    return out
+
+
+def bench_payload(rows: int) -> None:
+    """Prompt tokens per KRI row: plain JSON rows against the compact columnar encoding."""
+    from payload_codec import encode_rows, payload_savings
+
+    data = _window_rows(rows)
+    print(f"\nGPT payload size ({rows:,} rows, estimated tokens)")
+    print(f"{'chunk size':<14}{'plain/row':>12}{'compact/row':>14}{'saved':>10}")
+    for chunk_size in (1, 5, 10, 25, 50):
+        before = after = 0
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i + chunk_size]
+            b, a = payload_savings("KRI", "year_2025", chunk, encode_rows("KRI", "year_2025", chunk))
+            before += b
+            after += a
+        print(f"{chunk_size:<14}{before / rows:>12.1f}{after / rows:>14.1f}{100 * (before - after) / before:>9.0f}%")
+
+
+class _SlowSink:
+    """stdout stand-in that takes `delay` seconds per write, like a busy log shipper."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, s: str) -> int:
+        time.sleep(self.delay)
+        return len(s)
+
+    def flush(self) -> None:
+        pass
+
+
+def bench_logging(rows: int, delay: float = 0.0002) -> None:
+    """Request-thread cost of one event per row: print against the queued logger, with a slow sink."""
+    import sys
+    real_stdout, sys.stdout = sys.stdout, _SlowSink(delay)
+    try:
+        from logs import get_logger, sampled
+        from metrics import LOG_ENQUEUE_SECONDS, LOG_RECORDS
+        log = get_logger("bench")
+
+        def printed():
+            for i in range(rows):
+                print(f"KRI-{i:05d} — metric: {i * 0.5} | status=Breached")
+
+        def queued():
+            for i in range(rows):
+                log.info("kri_row", relatedEntityId=f"KRI-{i:05d}", metricValue=i * 0.5, statusBand="Breached")
+
+        def sampled_rows():
+            for i in range(rows):
+                sampled(log).info("kri_row", relatedEntityId=f"KRI-{i:05d}", metricValue=i * 0.5, statusBand="Breached")
+
+        results = {"print (blocking)": _measure(printed, repeat=1), "log (queued)": _measure(queued, repeat=1),
+                   "log (sampled)": _measure(sampled_rows, repeat=1)}
+    finally:
+        sys.stdout = real_stdout
+    _report(f"Logging, one event per row, sink {delay * 1e6:.0f}us/write", results, rows)
+    print(f"records: queued={LOG_RECORDS.value(outcome='queued'):.0f} dropped={LOG_RECORDS.value(outcome='dropped'):.0f} "
+          f"sampled_out={LOG_RECORDS.value(outcome='sampled_out'):.0f}, "
+          f"enqueue time {LOG_ENQUEUE_SECONDS.value() * 1000:.1f} ms")
+
+
+KRI_SOURCE_DDL = """
+    CREATE TABLE t_insightView_KRI (
+        [KRI ID] TEXT, [KRI_Name] TEXT, [Adjusted Current Mth] REAL, [As of Date] TEXT,
+        [KRI Standard] TEXT, [Risk Type] TEXT, [RiskW] REAL, [ImpactBin_Col] INTEGER, [LikelihoodBin_Col] INTEGER,
+        [RiskLevel_Col] TEXT, [Warning Limit1] REAL, [Warning Limit1 Operator] TEXT,
+        [Escalaltion Limit 1 Num] REAL, [Escalation Limit1 Operator] TEXT, [Threshold_Value] REAL,
+        [Threshold_Operator] TEXT, [ExposureScoreCol] REAL, [KRI Status] TEXT, [Breached KRIs] INTEGER,
+        [TOP_KRIs] INTEGER
+    )
+"""
+
+
+def generate_kri(path: str, rows: int, months: int = 12, seed: int = 3) -> None:
+    """
+    Writes `rows` synthetic t_insightView_KRI rows (spread over `months`
+    month-ends) plus the empty tables the service reads and writes.
+    Limits/operators, status bands and TOP_KRIs follow the shapes of the real feed.
+    """
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute(KRI_SOURCE_DDL)
+    conn.execute("""
+        CREATE TABLE t_insightView_Email_Summaries (
+            Id INTEGER PRIMARY KEY, SummaryType TEXT, SummaryText TEXT, AsOfDate DATE, IsEmailed INTEGER
+        )
+    """)
+    conn.execute("CREATE TABLE t_PublishedDashboards (DashboardName TEXT, publishedAddress TEXT)")
+    conn.execute("INSERT INTO t_PublishedDashboards VALUES ('Key Risk Indicator Overview', 'https://example.invalid/kri')")
+    conn.commit()
+    conn.close()
+    _create_recommendations_table(path)
+
+    per_month = max(1, rows // months)
+    month_ends = [date(2024 + (m // 12), m % 12 + 1, 1) - timedelta(days=1) for m in range(1, months + 1)]
+    risk_types = ["Credit", "Liquidity", "Operational", "Market", "Compliance", "ESG"]
+
+    def make():
+        n = 0
+        for as_of in month_ends:
+            for k in range(per_month):
+                if n >= rows:
+                    return
+                n += 1
+                warning, escalation = 10.0, 15.0
+                value = rnd.random() * 20
+                status = "Breached" if value > escalation else "Warning" if value > warning else "Safe"
+                yield (
+                    f"KRI-{k:05d}", f"Key risk indicator {k} ({risk_types[k % 6]})", round(value, 4),
+                    as_of.isoformat(), "Basel III / BoG CRD", risk_types[k % 6], 1.0,
+                    rnd.randint(1, 3), rnd.randint(1, 5), rnd.choice(["Low", "Medium", "High"]),
+                    warning, rnd.choice([">", "greater than"]), escalation, ">", None, None,
+                    round(rnd.random(), 4), status, 0 if status == "Safe" else 1, 1 if k % 2 == 0 else 0,
+                )
+
+    conn = sqlite3.connect(path)
+    conn.executemany(f"INSERT INTO t_insightView_KRI VALUES ({', '.join('?' * 20)})", make())
+    conn.commit()
+    conn.close()
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _drive(client, method: str, url: str, iterations: int, body=None, content_type=None, count_rows=None) -> dict:
+    """
+    One cold call, `iterations` timed calls, then one call under tracemalloc for peak memory.
+    `count_rows(response)` turns a response into rows handled, for throughput.
+    """
+    def call():
+        r = client.open(url, method=method, data=body, content_type=content_type)
+        assert r.status_code < 400, f"{method} {url} → {r.status_code}: {r.get_data(as_text=True)[:300]}"
+        return r
+
+    start = time.perf_counter()
+    call()
+    cold = time.perf_counter() - start
+
+    latencies, rows = [], 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        r = call()
+        latencies.append(time.perf_counter() - start)
+        rows += count_rows(r) if count_rows else 0
+
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(latencies)
+    return {
+        "cold": cold, "p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95),
+        "rps": iterations / total if total else 0.0, "rows_s": rows / total if total else 0.0, "peak": peak,
+    }
+
+
+def bench_e2e(rows: int, iterations: int = 5, latency: float = 0.05, tps: float = 0.0) -> None:
+    """
+    Drives /data/sql, /recommendations, /gpt/run and /gpt/summary in-process
+    against synthetic KRI data in SQLite and the fake LLM server. No network
+    beyond 127.0.0.1, no API key.
+    """
+    import resource
+    import fake_llm
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "kri.db")
+        start = time.perf_counter()
+        generate_kri(path, rows)
+        print(f"Generated {rows:,} KRI rows in {time.perf_counter() - start:.1f}s")
+
+        llm = fake_llm.start(latency=latency, tps=tps)
+        # must be in place before the service modules are imported
+        os.environ.update({
+            "SQL_URL": f"sqlite:///{path}",
+            "KRI_SOURCE_TABLE": "dbo.t_insightView_KRI",
+            "OPENAI_BASE": llm.base_url,
+            "OPENAI_API_KEY": "bench",
+            "LLM_CACHE_ENABLED": "0",
+            "JOBS_DB_PATH": os.path.join(tmp, "jobs.sqlite3"),
+            "RUN_JOURNAL_PATH": os.path.join(tmp, "run_journal.sqlite3"),
+            "LLM_CACHE_PATH": os.path.join(tmp, "llm_cache.sqlite3"),
+            "LEADER_LOCK_PATH": os.path.join(tmp, "leader.lock"),
+            "SCHEDULER_STATE_PATH": os.path.join(tmp, "scheduler_state.json"),
+            # the log writer holds the real stdout; only problems should end up next to the table
+            "LOG_LEVEL": "WARNING",
+        })
+        from app import create_app
+
+        client = create_app().test_client()
+        items = json.dumps(_recommendation_items(200)).encode()
+
+        results = {}
+        results["GET /data/sql"] = _drive(client, "GET", "/data/sql", iterations,
+                                       count_rows=lambda r: len(r.get_json()["data"]["rows"]))
+        results["POST /recommendations"] = _drive(client, "POST", "/recommendations", iterations, items,
+                                                  "application/json", count_rows=lambda r: 200)
+        results["POST /gpt/run?full=1"] = _drive(client, "POST", "/gpt/run?full=1", max(1, iterations // 2),
+                                                 count_rows=lambda r: r.get_json()["generated"])
+        results["POST /gpt/summary"] = _drive(client, "POST", "/gpt/summary", max(1, iterations // 2),
+                                              count_rows=lambda r: 1)
+
+        print(f"\nEnd-to-end ({rows:,} KRI rows, fake LLM latency {latency}s"
+              f"{f', {tps:.0f} tok/s' if tps else ''}, {iterations} iterations)")
+        print(f"{'endpoint':<26}{'cold (ms)':>11}{'p50 (ms)':>10}{'p95 (ms)':>10}{'req/s':>9}{'rows/s':>11}{'peak (MiB)':>12}")
+        for name, r in results.items():
+            print(f"{name:<26}{r['cold'] * 1000:>11.1f}{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}"
+                  f"{r['rps']:>9.2f}{r['rows_s']:>11,.0f}{r['peak'] / 2**20:>12.2f}")
+        print(f"fake LLM: {llm.counters}")
+        print(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+        llm.shutdown()
+
+
+BENCHMARKS = {
+    "run_query": bench_run_query,
+    "ingest": bench_ingest,
+    "payload": bench_payload,
+    "logging": bench_logging,
+    "e2e": bench_e2e,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=5, help="e2e: timed calls per endpoint")
+    parser.add_argument("--latency", type=float, default=0.05, help="e2e: fake LLM seconds per completion")
+    parser.add_argument("--tps", type=float, default=0.0, help="e2e: fake LLM completion tokens per second")
+    args = parser.parse_args()
+    if args.benchmark == "e2e":
+        bench_e2e(args.rows, args.iterations, args.latency, args.tps)
+    else:
+        BENCHMARKS[args.benchmark](args.rows)
@@ -0,0 +1,59 @@
+# compression.py
+"""
+Content-Encoding negotiation and incremental compression for streamed
+responses. gzip always works; br is offered when the optional `brotli`
+package is installed.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """Picks br or gzip from an Accept-Encoding header (q=0 means refused)."""
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    for encoding in (("br", "gzip") if brotli else ("gzip",)):
+        if offered.get(encoding, offered.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def _compressor(encoding: str):
+    if encoding == "br":
+        c = brotli.Compressor(quality=5)
+        return c.process, c.finish
+    c = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    return c.compress, c.flush
+
+
+def compress_stream(chunks, encoding: str | None):
+    """
+    Compresses an iterable of str/bytes chunks on the fly; the compressor
+    emits output as its window fills, so memory stays flat for any body size.
+    """
+    for chunk in _compress(chunks, encoding):
+        if chunk:
+            yield chunk
+
+
+def _compress(chunks, encoding: str | None):
+    if not encoding:
+        for chunk in chunks:
+            yield chunk.encode() if isinstance(chunk, str) else chunk
+        return
+    process, finish = _compressor(encoding)
+    for chunk in chunks:
+        yield process(chunk.encode() if isinstance(chunk, str) else chunk)
+    yield finish()
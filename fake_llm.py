@@ -0,0 +1,228 @@
+# fake_llm.py
+"""
+Local stand-in for an OpenAI-compatible /v1/chat/completions endpoint, for
+load and retry testing without an API key.
+
+    python fake_llm.py --port 8089 --rpm 60 --tpm 40000 --latency 0.3 --tps 400
+    OPENAI_BASE=http://127.0.0.1:8089/v1 python app.py
+
+KRI recommendation payloads ({"source", "window", "rows"}, plain or in the
+compact columnar form) get one recommendation per row, anything else (e.g.
+the summary request) gets a short text summary. stream=true answers as SSE chunks.
+The server enforces its own per-minute request/token limits and answers with
+429 plus Retry-After and x-ratelimit-* headers like the real API; --fail-rate
+injects random 503s, --drop-rate leaves rows out of the answer and
+--corrupt-rate breaks the JSON of some completions.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RateWindow:
+    """Fixed one-minute window counters for requests and tokens."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm, self.tpm = rpm, tpm
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self.requests = self.tokens = 0
+
+    def take(self, tokens: int) -> tuple[bool, dict]:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._start >= 60:
+                self._start, self.requests, self.tokens = now, 0, 0
+            reset = 60 - (now - self._start)
+            over = (self.rpm and self.requests + 1 > self.rpm) or (self.tpm and self.tokens + tokens > self.tpm)
+            if not over:
+                self.requests += 1
+                self.tokens += tokens
+            headers = {
+                "x-ratelimit-limit-requests": str(self.rpm or 0),
+                "x-ratelimit-limit-tokens": str(self.tpm or 0),
+                "x-ratelimit-remaining-requests": str(max(0, self.rpm - self.requests) if self.rpm else 1),
+                "x-ratelimit-remaining-tokens": str(max(0, self.tpm - self.tokens) if self.tpm else 1),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                "x-ratelimit-reset-tokens": f"{reset:.3f}s",
+            }
+            if over:
+                headers["Retry-After"] = f"{max(1, int(reset + 0.999))}"
+            return not over, headers
+
+
+def damage(content: str, drop_rate: float, corrupt_rate: float) -> str:
+    """Drops recommendations and/or breaks the JSON, like a model having a bad day."""
+    if drop_rate and content.startswith("{"):
+        data = json.loads(content)
+        data["recommendations"] = [r for r in data["recommendations"] if random.random() >= drop_rate]
+        content = json.dumps(data)
+    if corrupt_rate and content.startswith("{") and random.random() < corrupt_rate:
+        # a stray character inside one object: that object is lost, the rest must survive
+        i = content.find('"recommendationText"')
+        if i > 0:
+            content = content[:i] + "~" + content[i:]
+    return content
+
+
+def fake_completion(body: dict) -> str:
+    user = next((m["content"] for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "")
+    try:
+        payload = json.loads(user)
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict) and isinstance(payload.get("columns"), list):
+        cols = payload["columns"]
+        recs = []
+        for r in payload.get("rows", []):
+            row = {**payload.get("constants", {}), **dict(zip(cols, r))}
+            recs.append({
+                "row": row["row"],
+                "recommendationText": f"Review {row.get('metricName')} with the risk owner and agree corrective actions.",
+                "actionType": "Investigate",
+                "confidence": 0.8,
+                "metadata": {"fake": True},
+            })
+        return json.dumps({"recommendations": recs})
+    rows = payload.get("rows") if isinstance(payload, dict) else None
+    if isinstance(rows, list) and rows and isinstance(rows[0], dict) and "relatedEntityId" in rows[0]:
+        recs = [
+            {
+                "source": payload.get("source", "KRI"),
+                "relatedEntityId": row.get("relatedEntityId"),
+                "metricName": row.get("metricName"),
+                "metricValue": row.get("metricValue"),
+                "recommendationText": f"Review {row.get('metricName')} with the risk owner and agree corrective actions.",
+                "actionType": "Investigate",
+                "confidence": 0.8,
+                "riskType": row.get("riskType"),
+                "observedAt": row.get("observedAt"),
+                "metadata": {"fake": True},
+            }
+            for row in rows
+        ]
+        return json.dumps({"recommendations": recs})
+    return "<p>Executive summary (fake): KRI exposure is stable month on month.</p>"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeLLMServer"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status: int, body: bytes, headers: dict, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, b'{"error": {"message": "not found"}}', {})
+            return
+        body = json.loads(raw or b"{}")
+        prompt_tokens = max(1, len(json.dumps(body.get("messages", []), ensure_ascii=False)) // 4)
+        srv = self.server
+        srv.count("received")
+        ok, headers = srv.limits.take(prompt_tokens)
+        if not ok:
+            srv.count("rate_limited")
+            self._send(429, b'{"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}}', headers)
+            return
+        if srv.fail_rate and random.random() < srv.fail_rate:
+            srv.count("failed")
+            self._send(503, b'{"error": {"message": "overloaded"}}', headers)
+            return
+
+        content = damage(fake_completion(body), srv.drop_rate, srv.corrupt_rate)
+        completion_tokens = max(1, len(content) // 4)
+        time.sleep(srv.latency + (completion_tokens / srv.tps if srv.tps else 0))
+        srv.count("served")
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            for i in range(0, len(content), 40):
+                chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + 40]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+                self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+        out = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+        self._send(200, json.dumps(out).encode(), headers)
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, rpm: int = 0, tpm: int = 0, latency: float = 0.0, tps: float = 0.0,
+                 fail_rate: float = 0.0, drop_rate: float = 0.0, corrupt_rate: float = 0.0, verbose: bool = False):
+        super().__init__(addr, Handler)
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.limits = RateWindow(rpm, tpm)
+        self.latency = latency
+        self.tps = tps
+        self.fail_rate = fail_rate
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.counters = {"received": 0, "served": 0, "rate_limited": 0, "failed": 0}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start(port: int = 0, **kwargs) -> FakeLLMServer:
+    """Starts a server on a background thread (port 0 picks a free one)."""
+    server = FakeLLMServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-llm").start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute, 0 = unlimited")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute, 0 = unlimited")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per completion")
+    parser.add_argument("--tps", type=float, default=0.0, help="completion tokens generated per second, 0 = instant")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of recommendations left out")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="share of completions with broken JSON")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    srv = FakeLLMServer(("127.0.0.1", args.port), rpm=args.rpm, tpm=args.tpm, latency=args.latency,
+                        tps=args.tps, fail_rate=args.fail_rate, drop_rate=args.drop_rate,
+                        corrupt_rate=args.corrupt_rate, verbose=args.verbose)
+    print(f"Fake LLM listening on {srv.base_url}")
+    srv.serve_forever()
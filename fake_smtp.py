@@ -0,0 +1,128 @@
+# fake_smtp.py
+"""
+Local SMTP stand-in for exercising the email outbox without Office 365.
+
+    python fake_smtp.py --port 8025 --fail-rate 0.2
+    SMTP_SERVER=127.0.0.1 SMTP_PORT=8025 SMTP_STARTTLS=0 python app.py
+
+Speaks enough ESMTP for smtplib (EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, RSET, NOOP, QUIT); any credentials are accepted and STARTTLS is not
+offered. Messages are kept in memory (and printed with --verbose);
+--fail-rate answers DATA with a transient 451, --delay slows every reply
+down to mimic a slow handshake.
+"""
+import argparse
+import random
+import socketserver
+import threading
+import time
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    server: "FakeSMTPServer"
+
+    def reply(self, line: str) -> None:
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.wfile.write(f"{line}\r\n".encode())
+        self.wfile.flush()
+
+    def handle(self):
+        srv = self.server
+        srv.count("connections")
+        self.reply("220 fake-smtp ESMTP ready")
+        sender, rcpts = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            verb = line.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 SIZE 35882577"
+                           if verb == "EHLO" else "250 fake-smtp")
+            elif verb == "AUTH":
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].upper() == "LOGIN":
+                    if len(parts) == 2:
+                        self.reply("334 VXNlcm5hbWU6")
+                        self.rfile.readline()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                srv.count("logins")
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                sender, rcpts = line[10:].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                rcpts.append(line[8:].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                if srv.fail_rate and random.random() < srv.fail_rate:
+                    srv.count("failed")
+                    self.reply("451 4.3.0 Temporary failure, try again later")
+                else:
+                    srv.store(sender, rcpts, b"".join(data))
+                    self.reply("250 OK queued")
+                sender, rcpts = None, []
+            elif verb == "RSET":
+                sender, rcpts = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr, fail_rate: float = 0.0, delay: float = 0.0, verbose: bool = False):
+        super().__init__(addr, SMTPHandler)
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.verbose = verbose
+        self.messages: list[dict] = []
+        self._lock = threading.Lock()
+        self.counters = {"connections": 0, "logins": 0, "delivered": 0, "failed": 0}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def store(self, sender: str, rcpts: list[str], data: bytes) -> None:
+        with self._lock:
+            self.messages.append({"from": sender, "to": rcpts, "data": data})
+            self.counters["delivered"] += 1
+        if self.verbose:
+            print(f"--- message from {sender} to {', '.join(rcpts)} ({len(data)} bytes)")
+
+
+def start(port: int = 0, **kwargs) -> FakeSMTPServer:
+    """Starts a server on a background thread (port 0 picks a free one)."""
+    server = FakeSMTPServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-smtp").start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of messages answered with 451")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before every reply")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    srv = FakeSMTPServer(("127.0.0.1", args.port), fail_rate=args.fail_rate, delay=args.delay, verbose=args.verbose)
+    print(f"Fake SMTP listening on 127.0.0.1:{args.port}")
+    srv.serve_forever()
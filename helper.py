@@ -1,15 +1,22 @@
 # helper.py
-import os, json, requests
+import os, json, re
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, make_url, text
 from datetime import date, datetime
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from urllib.parse import quote_plus
-import threading
-import time
-import requests
+import queue
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydantic import ValidationError
+from Schema import Recommendation
+from llm_cache import CACHE, cache_key
+from llm_client import LLM
+from logs import carry, get_logger, sampled
+from metrics import CACHE_LOOKUPS, DB_ROWS, instrument_engine
+from payload_codec import COMPACT_FORMAT_RULES, dumps_compact, encode_chunk, expand_recommendation
 load_dotenv()
 
 SQL_SERVER   = os.getenv("SQL_SERVER", "192.168.10.204")
@@ -17,10 +24,20 @@ SQL_DB       = os.getenv("SQL_DB", "NPL")
 SQL_USERNAME = os.getenv("SQL_USERNAME", "awc_sql")
 SQL_PASSWORD = os.getenv("SQL_PASSWORD", "AwC@2023")
 SQL_DRIVER   = os.getenv("SQL_ODBC_DRIVER", "ODBC Driver 18 for SQL Server")
+SQL_URL      = os.getenv("SQL_URL", "")  # e.g. sqlite:///local.db for a local stand-in (a file, not :memory:)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY","")
 OPENAI_BASE    = os.getenv("OPENAI_BASE","https://api.openai.com/v1")
 OPENAI_MODEL   = os.getenv("OPENAI_MODEL","gpt-4o-mini")
 OWNER_ALLOW    = {d.strip().lower() for d in os.getenv("OWNER_ALLOW_DOMAINS","awcghana.com").split(",")}
+GPT_CHUNK_SIZE  = int(os.getenv("GPT_CHUNK_SIZE", "10"))
+GPT_MAX_WORKERS = int(os.getenv("GPT_MAX_WORKERS", "4"))
+# follow-up calls for rows a completion skipped or answered with an invalid object
+GPT_REPAIR_RETRIES = int(os.getenv("GPT_REPAIR_RETRIES", "2"))
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "500"))
+RECOMMENDATION_BATCH_SIZE = int(os.getenv("RECOMMENDATION_BATCH_SIZE", "500"))
+GPT_COMPACT_PAYLOAD = os.getenv("GPT_COMPACT_PAYLOAD", "1").lower() not in ("0", "false", "no")
+
+log = get_logger(__name__)
 
 odbc_str = (
     f"DRIVER={{{SQL_DRIVER}}};"
@@ -32,7 +49,22 @@ odbc_str = (
     "TrustServerCertificate=Yes;"
 )
 
-ENGINE = create_engine(f"mssql+pyodbc:///?odbc_connect={quote_plus(odbc_str)}", fast_executemany=True)
+if SQL_URL:
+    _url = make_url(SQL_URL)
+    if _url.get_backend_name() == "sqlite" and (_url.database in (None, "", ":memory:") or _url.query.get("mode") == "memory"):
+        # ATTACH ':memory:' would give `dbo` (and every pooled connection) its own empty database
+        raise ValueError(f"SQL_URL {SQL_URL!r} is an in-memory SQLite database; use a file, e.g. sqlite:///local.db")
+    ENGINE = create_engine(SQL_URL)
+else:
+    ENGINE = create_engine(f"mssql+pyodbc:///?odbc_connect={quote_plus(odbc_str)}", fast_executemany=True)
+
+instrument_engine(ENGINE)
+
+if ENGINE.dialect.name == "sqlite":
+    @event.listens_for(ENGINE, "connect")
+    def _attach_dbo_schema(dbapi_conn, _):
+        # expose the same file as schema `dbo`, so dbo.<table> names resolve on SQLite
+        dbapi_conn.execute("ATTACH DATABASE ? AS dbo", (ENGINE.url.database,))
 
 summary_prompt = """
 You are a Senior Risk Analyst at the Development Bank of Ghana (DBG), a wholesale development finance institution that channels funding to MSMEs through Participating Financial Institutions (PFIs).
@@ -80,6 +112,42 @@ Example opening:
 Your goal is to produce a **polished, regulatory-aligned, and forward-looking** summary that integrates both current risk positions and potential high-severity exposures, reflecting DBG’s professional reporting standards.
 """
 
+TREND_INPUT_RULES = """
+Trend input format (replaces the "Input data" description above):
+The user message is {"source", "window", "asOfDate", "profile", "riskTypes", "kris"}, pre-aggregated over the window:
+- profile: totals of breached/warning KRIs this month and last month, and `direction` (improving, stable or worsening by breach count).
+- riskTypes: per Risk Type this month — kris, breached, prevBreached, warning, prevWarning, breached3m (3-month average),
+  breachedAvgWindow (average over the window), avgExposure, prevExposure, months of history.
+- kris: only KRIs that are Breached/Warning now or last month, or high severity (highSeverity = 1) —
+  kriStatus, prevStatus, value, prevValue, delta, avg3m, avgWindow, flaggedMonths (months flagged in the window).
+Use these figures for the month-over-month comparison; do not assume data for months that are not covered.
+"""
+
+# Monthly summary for the other dashboard domains (Finance, ESG, Treasury, ...); {domain} is filled in.
+domain_summary_prompt = """
+You are a Senior Analyst at the Development Bank of Ghana (DBG), a wholesale development finance institution that channels funding to MSMEs through Participating Financial Institutions (PFIs).
+
+You are preparing the **Monthly Executive {domain} Summary Report** for DBG Management.
+
+Input data:
+You will receive a compact JSON object {{"source", "window", "rows"}} with the {domain} figures for the reporting month.
+Each row carries an `asOfDate` (reporting date); other field names describe the measures they hold.
+
+Your task:
+Write a concise, data-driven, professional report (approximately four to six paragraphs) that:
+1. Clearly states the **reporting month and year** based on the `asOfDate` field.
+2. Summarizes the overall {domain} position and whether it is improving, stable, or worsening.
+3. Highlights the most material movements, concentrations, or exceptions in the data.
+4. Explains their implications for DBG, its PFIs, and its Basel III and Bank of Ghana obligations.
+5. Concludes with **forward-looking insights** and proposed management focus areas for the existing DBG teams.
+
+Formatting:
+- Write in formal report prose — no bullet points, no lists, no markdown, no headings.
+- Use only figures present in the input; do not invent numbers.
+- Include the reporting date in the opening line, e.g., “As of May 2025, DBG’s {domain} position...”
+- Output plain text only.
+"""
+
 
 SYSTEM_PROMPT = """
 You are a seasoned Risk Analyst consultant for the Development Bank of Ghana (DBG), 
@@ -143,23 +211,108 @@ Output fields per recommendation:
 - metadata (object, {} if none)  
 - postMitigationValue (float or null)  
 """
+COMPACT_SYSTEM_PROMPT = SYSTEM_PROMPT + COMPACT_FORMAT_RULES
+
+
+def recommendation_prompt() -> str:
+    """System prompt used for recommendation requests (and part of the cache key)."""
+    return COMPACT_SYSTEM_PROMPT if GPT_COMPACT_PAYLOAD else SYSTEM_PROMPT
+
+
+def recommendation_payload(source: str, window: str, rows: list[dict]) -> dict:
+    if GPT_COMPACT_PAYLOAD:
+        return encode_chunk(source, window, rows)
+    return {"source": source, "window": window, "rows": rows}
+
 
+def expand_recommendations(recs, rows: list[dict], source: str) -> list:
+    """Maps compact answers (row index + generated fields) back to full recommendations."""
+    if not isinstance(recs, list):
+        return []
+    if not GPT_COMPACT_PAYLOAD:
+        return recs
+    return [expand_recommendation(rec, rows, source) for rec in recs]
+
+
+def _iter_batches(res, batch_size: int):
+    """
+    Yields (columns, date_column_indexes, rows) per fetchmany batch.
+    Date/datetime columns are detected once per column (on its first non-null
+    value) instead of type-checking every cell.
+    """
+    cols = tuple(res.keys())
+    undecided = set(range(len(cols)))
+    date_idx: list[int] = []
+    while True:
+        batch = res.fetchmany(batch_size)
+        if not batch:
+            return
+        DB_ROWS.inc(len(batch))
+        if undecided:
+            for j in list(undecided):
+                sample = next((row[j] for row in batch if row[j] is not None), None)
+                if sample is None:
+                    continue
+                undecided.discard(j)
+                if isinstance(sample, (date, datetime)):
+                    date_idx.append(j)
+        yield cols, date_idx, batch
+
+
+def _iter_result(res, batch_size: int):
+    """Yields result rows as dicts; only the date columns are converted to ISO strings."""
+    for cols, date_idx, batch in _iter_batches(res, batch_size):
+        date_cols = [cols[j] for j in date_idx]
+        for row in batch:
+            row_dict = dict(zip(cols, row))
+            for col in date_cols:
+                val = row_dict[col]
+                if val is not None:
+                    row_dict[col] = val.isoformat()
+            yield row_dict
 
 
 def run_query(sql: str, params: dict | None = None) -> list[dict]:
     with ENGINE.begin() as conn:
         res = conn.execute(text(sql), params or {})
-        cols = res.keys()
-        rows = []
-        for row in res.fetchall():
-            row_dict = {}
-            for col, val in zip(cols, row):
-                if isinstance(val, (date, datetime)):
-                    row_dict[col] = val.isoformat()
-                else:
-                    row_dict[col] = val
-            rows.append(row_dict)
-        return rows
+        return list(_iter_result(res, QUERY_BATCH_SIZE))
+
+
+def iter_query(sql: str, params: dict | None = None, batch_size: int = QUERY_BATCH_SIZE):
+    """
+    Generator variant of run_query: rows are fetched with fetchmany and yielded
+    one at a time, so memory stays flat regardless of the result size.
+    The connection is held until the generator is exhausted or closed.
+    """
+    with ENGINE.connect() as conn:
+        if ENGINE.dialect.name != "sqlite" and ENGINE.dialect.supports_server_side_cursors:
+            conn = conn.execution_options(stream_results=True)
+        res = conn.execute(text(sql), params or {})
+        yield from _iter_result(res, batch_size)
+
+
+def run_query_columns(sql: str, params: dict | None = None, batch_size: int = QUERY_BATCH_SIZE) -> dict[str, list]:
+    """
+    Column-oriented variant of run_query: returns {column: values}.
+    Columns holding only ints or only floats (no NULLs) are packed into
+    array.array, which is far smaller than a list of Python numbers.
+    """
+    with ENGINE.connect() as conn:
+        res = conn.execute(text(sql), params or {})
+        data: dict[str, list] = {c: [] for c in res.keys()}
+        for cols, date_idx, batch in _iter_batches(res, batch_size):
+            for j, values in enumerate(zip(*batch)):
+                if j in date_idx:
+                    values = [v.isoformat() if v is not None else None for v in values]
+                data[cols[j]].extend(values)
+
+    for c, values in data.items():
+        kinds = {type(v) for v in values}
+        if kinds == {float}:
+            data[c] = array("d", values)
+        elif kinds == {int}:
+            data[c] = array("q", values)
+    return data
 
 
 def normalize_record(r: dict) -> dict:
@@ -182,7 +335,7 @@ def normalize_record(r: dict) -> dict:
             try:
                 rec["observedAt"] = date.fromisoformat(str(rec["observedAt"]))
             except Exception:
-                print(f"[WARN] Could not parse observedAt: {rec['observedAt']}, defaulting to today")
+                sampled(log).warning("observed_at_unparsed", value=str(rec["observedAt"]), fallback="today")
                 rec["observedAt"] = date.today()
 
     # Metadata → JSON string
@@ -193,37 +346,89 @@ def normalize_record(r: dict) -> dict:
 def is_latest_kri_processed() -> bool:
     """
     Returns True if the latest KRI 'As of Date' already exists in Recommendations.
+    The KRI side is read from the staging table, which is synced first.
+    """
+    from kri_stage import STAGE
+
+    STAGE.sync()
+    kri_latest = STAGE.watermark()
+    result = run_query("SELECT MAX(ObservedAt) AS rec_latest FROM dbo.t_insightView_Recommendations;")
+    rec_latest = result[0]["rec_latest"] if result else None
+    log.info("latest_kri_checked", kri_latest=kri_latest, rec_latest=rec_latest)
+    if kri_latest is None:
+        return True
+    return kri_latest.isoformat() <= str(rec_latest or "1900-01-01")[:10]
+
+
+
+def recommendation_key(entity_id, observed_at, value) -> tuple:
+    """
+    Identity of a generated recommendation: (KRI ID, As of Date, value).
+    Dates are compared on their ISO day and values rounded to 6 places, so
+    a row read from t_insightView_KRI lines up with the stored recommendation.
+    """
+    try:
+        value = round(float(value), 6) if value is not None else None
+    except (TypeError, ValueError):
+        value = str(value)
+    return str(entity_id).strip(), str(observed_at or "")[:10], value
+
+
+def processed_recommendation_keys(start: str | date, end: str | date) -> set[tuple]:
+    """
+    Returns the recommendation keys already stored for ObservedAt in [start, end].
     """
     sql = """
-    ;WITH kri_max AS (
-        SELECT MAX(TRY_CONVERT(date, [As of Date])) AS kri_latest
-        FROM [NPL].[dbo].[t_insightView_KRI]
-    ),
-    rec_check AS (
-        SELECT MAX(TRY_CONVERT(date, ObservedAt)) AS rec_latest
-        FROM [NPL].[dbo].[t_insightView_Recommendations]
-    )
-    SELECT
-        CASE
-            WHEN kri_latest <= ISNULL(rec_latest, '1900-01-01') THEN 1
-            ELSE 0
-        END AS is_processed,
-        kri_latest, rec_latest
-    FROM kri_max CROSS JOIN rec_check;
-    """
-    result = run_query(sql)
-    if result:
-        row = result[0]
-        print(f"Latest KRI date: {row['kri_latest']}, Latest Recommendation: {row['rec_latest']}")
-        return row["is_processed"] == 1
-    return False
+        SELECT RelatedEntityId, ObservedAt, MetricValue
+        FROM dbo.t_insightView_Recommendations
+        WHERE ObservedAt BETWEEN :start AND :end;
+    """
+    rows = run_query(sql, {"start": str(start)[:10], "end": str(end)[:10]})
+    return {recommendation_key(r["RelatedEntityId"], r["ObservedAt"], r["MetricValue"]) for r in rows}
+
+
+def filter_unprocessed(rows: list[dict]) -> list[dict]:
+    """
+    Delta engine for /gpt/run: keeps only the KRI rows whose
+    (relatedEntityId, observedAt, metricValue) has no recommendation yet.
+    A late correction to one KRI's value therefore re-generates just that row.
+    """
+    if not rows:
+        return []
+    dates = [str(r["observedAt"])[:10] for r in rows if r.get("observedAt")]
+    if not dates:
+        return rows
+    done = processed_recommendation_keys(min(dates), max(dates))
+    return [
+        r for r in rows
+        if recommendation_key(r["relatedEntityId"], r["observedAt"], r["metricValue"]) not in done
+    ]
+
+
+
+def build_summary_message(subject: str, body: str, recipients: list[str], sender: str | None,
+                          is_html: bool = True) -> MIMEMultipart:
+    """
+    multipart/alternative message: a plain-text part (tags stripped) and,
+    for HTML bodies, the body wrapped in minimal HTML for safe rendering.
+    """
+    msg = MIMEMultipart("alternative")
+    msg["From"] = sender or ""
+    msg["To"] = ", ".join(recipients)
+    msg["Subject"] = subject
 
+    plain = re.sub(r"<[^>]+>", "", body) if is_html else body
+    msg.attach(MIMEText(plain, "plain", "utf-8"))
+    if is_html:
+        msg.attach(MIMEText(f"<html><body>{body}</body></html>", "html", "utf-8"))
+    return msg
 
 
 def send_summary_email(subject: str, body: str, recipients: list[str],is_html: bool = True) -> bool:
     """
-    Sends an email using Office 365 SMTP settings.
+    Sends an email using Office 365 SMTP settings, on a connection of its own.
     Returns True if successful, False otherwise.
+    Summaries go through the outbox (outbox.enqueue_email) instead.
     """
     try:
         SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.office365.com")
@@ -231,144 +436,136 @@ def send_summary_email(subject: str, body: str, recipients: list[str],is_html: b
         SMTP_EMAIL = os.getenv("SMTP_EMAIL")
         SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 
-        msg = MIMEMultipart()
-        msg["From"] = SMTP_EMAIL
-        msg["To"] = ", ".join(recipients)
-        msg["Subject"] = subject
-
-        
-        msg.attach(MIMEText("plain"))
-        if is_html:
-            # wrap in minimal HTML for safe rendering
-            html_body = f"<html><body>{body}</body></html>"
-            msg.attach(MIMEText(html_body, "html"))
+        msg = build_summary_message(subject, body, recipients, SMTP_EMAIL, is_html)
 
         with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
             server.starttls()
             server.login(SMTP_EMAIL, SMTP_PASSWORD)
             server.send_message(msg)
 
-        print(f"📧 Email sent to: {', '.join(recipients)}")
+        log.info("email_sent", recipients=len(recipients), subject=subject)
         return True
 
     except Exception as e:
-        print(f"[EMAIL ERROR] {e}")
+        log.error("email_failed", recipients=len(recipients), subject=subject, error=str(e))
         return False
 
-def get_published_address(summary_type: str) -> tuple[str, str] | None:
-    """
-    Returns (DashboardName, publishedAddress) for the given summary type.
-    Uses the t_PublishedDashboards table.
-    """
-    mapping = {
-        "KRI": "Key Risk Indicator Overview",
-        "Finance": "Financial Overview",
-        "ESG": "ESG Dashboard",
-        "Treasury": "Treasury Performance Dashboard"
-    }
+# summary type → dashboard in t_PublishedDashboards
+PUBLISHED_DASHBOARDS = {
+    "KRI": "Key Risk Indicator Overview",
+    "Finance": "Financial Overview",
+    "ESG": "ESG Dashboard",
+    "Treasury": "Treasury Performance Dashboard",
+}
 
-    dashboard_name = mapping.get(summary_type.capitalize())
-    if not dashboard_name:
-        return None
 
-    sql = """
-        SELECT TOP 1 DashboardName, publishedAddress
-        FROM [NPL].[dbo].[t_PublishedDashboards]
-        WHERE DashboardName = :dashboard_name;
+def get_published_addresses(summary_types: list[str]) -> dict[str, tuple[str, str]]:
     """
-    rows = run_query(sql, {"dashboard_name": dashboard_name})
-    if rows:
-        return rows[0]["DashboardName"], rows[0]["publishedAddress"]
-    return None
-
-def auto_scheduler():
+    Returns {summary_type: (DashboardName, publishedAddress)} for all the given
+    summary types in one query; types without a published dashboard are absent.
     """
-    Scheduler that runs every Monday at 12:00 PM.
-    If the latest KRI date is already processed → sleep.
-    If not → trigger GPT generation and summary in app.py.
+    # case-insensitive: "KRI".capitalize() is "Kri", which never matched
+    wanted = {
+        t: name for t in summary_types
+        for k, name in PUBLISHED_DASHBOARDS.items() if k.lower() == t.lower()
+    }
+    if not wanted:
+        return {}
+    names = sorted(set(wanted.values()))
+    params = {f"name{i}": n for i, n in enumerate(names)}
+    sql = f"""
+        SELECT DashboardName, publishedAddress
+        FROM dbo.t_PublishedDashboards
+        WHERE DashboardName IN ({", ".join(f":{p}" for p in params)});
     """
-    last_run_date = None
-    while True:
-        now = datetime.now()
-
-        if now.weekday() == 0 and now.hour >= 12:  # Monday = 0
-            if last_run_date != now.date():
-                print("⏰ Monday 12:00 → Checking if new KRI data exists")
-
-                if is_latest_kri_processed():
-                    print("✅ Latest KRI data already has recommendations → Going back to sleep.")
-                else:
-                    print("🧠 New KRI data detected — triggering GPT generation and summary")
-
-                    try:
-                        # Run recommendations first
-                        requests.post("http://127.0.0.1:8080/gpt/run", timeout=600)
-                        print("✅ Recommendations generated successfully")
-
-                        # Then generate summary
-                        requests.post("http://127.0.0.1:8080/gpt/summary", timeout=300)
-                        print("✅ Monthly summary generated successfully")
-
-                    except Exception as e:
-                        print(f"[GPT RUN ERROR] {e}")
-
-                last_run_date = now.date()
-                print("Sleeping for 7 days (until next Monday)...")
-                time.sleep(7 * 24 * 3600)
-
-            else:
-                time.sleep(3600)
-        elif now.weekday() == 0 and now.hour < 12:
-            print("Monday but before 12:00 → Sleeping 1 hour")
-            time.sleep(3600)
-        else:
-            print("Not Monday → Sleeping 1 day")
-            time.sleep(86400)
+    found = {}
+    for r in run_query(sql, params):
+        found.setdefault(r["DashboardName"], (r["DashboardName"], r["publishedAddress"]))
+    return {t: found[name] for t, name in wanted.items() if name in found}
 
 
+def get_published_address(summary_type: str) -> tuple[str, str] | None:
+    """
+    Returns (DashboardName, publishedAddress) for the given summary type.
+    Uses the t_PublishedDashboards table.
+    """
+    return get_published_addresses([summary_type]).get(summary_type)
+
+
+_REC_COLUMNS = (
+    ("Source", "source"),
+    ("RelatedEntityId", "relatedEntityId"),
+    ("MetricName", "metricName"),
+    ("MetricValue", "metricValue"),
+    ("RecommendationText", "recommendationText"),
+    ("ActionType", "actionType"),
+    ("RiskType", "riskType"),
+    ("Confidence", "confidence"),
+    ("ReferenceTimestamp", "referenceTimestamp"),
+    ("ObservedAt", "observedAt"),
+    ("Metadata", "metadata"),
+    ("PostMitigationValue", "postMitigationValue"),
+)
+_REC_COLS = ", ".join(col for col, _ in _REC_COLUMNS)
+_REC_PARAMS = ", ".join(f":{key}" for _, key in _REC_COLUMNS)
+
+# SQL Server: bulk-load each batch into a session temp table, then one MERGE
+# keyed on (RelatedEntityId, ObservedAt, Source) so reruns update in place.
+_MSSQL_STAGE_SQL = f"""
+    IF OBJECT_ID('tempdb..#rec_stage') IS NULL
+        SELECT TOP 0 {_REC_COLS} INTO #rec_stage FROM dbo.t_insightView_Recommendations;
+    ELSE
+        TRUNCATE TABLE #rec_stage;
+"""
+_MSSQL_LOAD_SQL = f"INSERT INTO #rec_stage ({_REC_COLS}) VALUES ({_REC_PARAMS});"
+_MSSQL_MERGE_SQL = f"""
+    MERGE dbo.t_insightView_Recommendations AS t
+    USING #rec_stage AS s
+        ON  t.RelatedEntityId = s.RelatedEntityId
+        AND t.ObservedAt      = s.ObservedAt
+        AND t.Source          = s.Source
+    WHEN MATCHED THEN UPDATE SET
+        {", ".join(f"t.{col} = s.{col}" for col, _ in _REC_COLUMNS[2:])}
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT ({_REC_COLS}) VALUES ({", ".join(f"s.{col}" for col, _ in _REC_COLUMNS)});
+"""
+# Other dialects (the SQLite stand-in): delete-then-insert inside the batch transaction.
+_GENERIC_DELETE_SQL = """
+    DELETE FROM dbo.t_insightView_Recommendations
+    WHERE RelatedEntityId = :relatedEntityId AND ObservedAt = :observedAt AND Source = :source;
+"""
+_GENERIC_INSERT_SQL = f"INSERT INTO dbo.t_insightView_Recommendations ({_REC_COLS}) VALUES ({_REC_PARAMS});"
 
 
-def insert_recommendations(recs: list[dict]) -> int:
+def insert_recommendations(recs: list[dict], batch_size: int = RECOMMENDATION_BATCH_SIZE) -> int:
     """
-    Insert a batch of recommendations into dbo.Recommendations.
-    Expects each dict in `recs` to have keys that match the placeholders.
+    Upserts recommendations into dbo.t_insightView_Recommendations.
+    Expects raw (not yet normalized) dicts keyed like Schema.Recommendation;
+    each record is normalized exactly once here. Records are deduplicated on
+    (relatedEntityId, observedAt, source), last one wins, and written in
+    transactions of `batch_size` rows, so rerunning a month is idempotent.
+    Returns the number of rows written.
     """
     if not recs:
         return 0
-    clean_recs = [normalize_record(r) for r in recs]
-    sql = text("""
-    INSERT INTO dbo.t_insightView_Recommendations (
-        Source,
-        RelatedEntityId,
-        MetricName,
-        MetricValue,
-        RecommendationText,
-        ActionType,
-        RiskType,
-        Confidence,
-        ReferenceTimestamp,
-        ObservedAt,
-        Metadata,
-        PostMitigationValue
-    )
-    VALUES (
-        :source,
-        :relatedEntityId,
-        :metricName,
-        :metricValue,
-        :recommendationText,
-        :actionType,
-        :riskType,               
-        :confidence,
-        :referenceTimestamp,
-        :observedAt,
-        :metadata,
-        :postMitigationValue
-    )
-""")
-
-    with ENGINE.begin() as conn:
-        conn.execute(sql, clean_recs)
+    deduped: dict[tuple, dict] = {}
+    for r in recs:
+        rec = normalize_record(r)
+        row = {key: rec.get(key) for _, key in _REC_COLUMNS}
+        deduped[(row["relatedEntityId"], row["observedAt"], row["source"])] = row
+    clean_recs = list(deduped.values())
+    batch_size = batch_size if batch_size > 0 else len(clean_recs)
+
+    for i in range(0, len(clean_recs), batch_size):
+        batch = clean_recs[i:i + batch_size]
+        with ENGINE.begin() as conn:
+            if ENGINE.dialect.name == "mssql":
+                conn.execute(text(_MSSQL_STAGE_SQL))
+                conn.execute(text(_MSSQL_LOAD_SQL), batch)
+                conn.execute(text(_MSSQL_MERGE_SQL))
+            else:
+                conn.execute(text(_GENERIC_DELETE_SQL), batch)
+                conn.execute(text(_GENERIC_INSERT_SQL), batch)
 
     return len(clean_recs)
 
@@ -390,36 +587,41 @@ def insert_summary(summary_text: str, summary_type: str, as_of_date: str | date)
             "asOfDate": as_of_date
         })
 
-    print(f"Summary saved → Type: {summary_type}, Date: {as_of_date}")
+    log.info("summary_saved", summary_type=summary_type, as_of=as_of_date)
     return 1
 
 
 def owner_ok(email: str) -> bool:
     return email.split("@")[-1].lower() in OWNER_ALLOW
 
+def _chat_body(compact_payload: dict) -> dict:
+    if "messages" in compact_payload:
+        return {"model": OPENAI_MODEL, **compact_payload, "temperature": 0.1}
+    if "columns" in compact_payload:
+        system, user = COMPACT_SYSTEM_PROMPT, dumps_compact(compact_payload)
+    else:
+        system, user = SYSTEM_PROMPT, json.dumps(compact_payload, ensure_ascii=False)
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user}
+        ],
+        "temperature": 0.1
+    }
+
 def call_gpt(compact_payload: dict) -> any:
     """
     Handles both recommendation JSON requests and text summaries.
     If the compact_payload has `messages`, treat it as a direct GPT request (used for summaries).
-    Otherwise, use SYSTEM_PROMPT + KRI JSON logic.
+    Otherwise, use SYSTEM_PROMPT + KRI JSON logic; the answer goes through
+    parse_recommendations, so a damaged completion still yields its intact objects.
+    Goes through the shared LLM client (pooled connections, rate limits, retries).
     """
-    url = f"{OPENAI_BASE}/chat/completions"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-
-    if "messages" in compact_payload:
-        body = {"model": OPENAI_MODEL, **compact_payload, "temperature": 0.1}
-    else:
-        body = {
-            "model": OPENAI_MODEL,
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": json.dumps(compact_payload, ensure_ascii=False)}
-            ],
-            "temperature": 0.1
-        }
-    r = requests.post(url, headers=headers, json=body, timeout=300)
-    r.raise_for_status()
-    content = r.json()["choices"][0]["message"]["content"].strip()
+    data = LLM.chat(_chat_body(compact_payload))
+    content = data["choices"][0]["message"]["content"].strip()
+    if "messages" not in compact_payload:
+        return parse_recommendations(content)
     if content.startswith("[") or content.startswith("{"):
         try:
             parsed = json.loads(content)
@@ -430,4 +632,347 @@ def call_gpt(compact_payload: dict) -> any:
         return content
 
 
+def parse_recommendations(content: str) -> list:
+    """
+    Recommendation objects from a completion. Valid JSON (optionally in a code
+    fence) is read as is; anything else is salvaged object by object with
+    JsonArrayStream, so one stray character costs one object, not the batch.
+    """
+    body = re.sub(r"^```[a-zA-Z]*\s*|\s*```$", "", content.strip())
+    try:
+        parsed = json.loads(body)
+        if isinstance(parsed, dict):
+            parsed = parsed.get("recommendations", [])
+        if isinstance(parsed, list):
+            return parsed
+    except ValueError:
+        pass
+    recovered = JsonArrayStream().feed(content)
+    log.warning("gpt_parse_salvaged", recovered=len(recovered))
+    return recovered
+
+
+class JsonArrayStream:
+    """
+    Incremental parser for a JSON array of objects arriving in pieces.
+    feed() returns every object that became complete with the new text.
+    Only direct children of the first array are emitted, so both `[{...}, ...]`
+    and `{"recommendations": [{...}, ...]}` work, and surrounding prose or code
+    fences are ignored. A truncated stream keeps everything completed so far.
+    """
+
+    def __init__(self):
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._array_depth: int | None = None
+        self._capturing = False
+        self._buf: list[str] = []
+
+    def feed(self, text: str) -> list[dict]:
+        out = []
+        for ch in text:
+            if self._capturing:
+                self._buf.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                # quotes outside any container belong to prose, not JSON
+                self._in_string = bool(self._stack)
+            elif ch == "[" or ch == "{":
+                self._stack.append(ch)
+                if ch == "[" and self._array_depth is None:
+                    self._array_depth = len(self._stack)
+                elif ch == "{" and self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._capturing = True
+                    self._buf = ["{"]
+            elif (ch == "]" or ch == "}") and self._stack:
+                self._stack.pop()
+                if ch == "}" and self._capturing and len(self._stack) == self._array_depth:
+                    self._capturing = False
+                    try:
+                        obj = json.loads("".join(self._buf))
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        out.append(obj)
+                    self._buf = []
+        return out
+
+
+def stream_gpt(compact_payload: dict):
+    """
+    Streams a chat completion and yields the content deltas as they arrive.
+    """
+    body = _chat_body(compact_payload)
+    with LLM.chat_stream(body) as r:
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if event.get("usage"):
+                LLM.record_usage(body, event["usage"])
+            choices = event.get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                yield delta
+
+
+def stream_recommendation_objects(compact_payload: dict):
+    """
+    Yields recommendation dicts from a streamed completion as soon as each one closes.
+    """
+    parser = JsonArrayStream()
+    for delta in stream_gpt(compact_payload):
+        yield from parser.feed(delta)
+
+
+def chunk_rows(rows: list[dict], chunk_size: int) -> list[list[dict]]:
+    """
+    Splits rows into consecutive chunks of at most `chunk_size` rows.
+    A chunk_size <= 0 keeps everything in a single chunk.
+    """
+    if chunk_size <= 0 or len(rows) <= chunk_size:
+        return [rows] if rows else []
+    return [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+
+def _is_valid(rec: dict) -> bool:
+    try:
+        Recommendation(**rec)
+        return True
+    except (ValidationError, TypeError):
+        return False
+
+
+def reconcile_recommendations(rows: list[dict], recs: list) -> tuple[list[dict], list[dict], list[dict]]:
+    """
+    Checks a completion against its input rows.
+    Returns (valid recommendations matched to a row, rows still without one,
+    invalid recommendations that did match a row). Objects for rows that were
+    never sent are dropped.
+    """
+    matched, leftovers = match_recommendations(rows, [r for r in recs if isinstance(r, dict)])
+    if leftovers:
+        log.warning("gpt_repair_unmatched", ignored=len(leftovers))
+    valid, missing, invalid = [], [], []
+    for i, row in enumerate(rows):
+        rec = matched.get(i)
+        if rec is not None and _is_valid(rec):
+            valid.append(rec)
+        else:
+            missing.append(row)
+            if rec is not None:
+                invalid.append(rec)
+    return valid, missing, invalid
+
+
+def generate_chunk(rows: list[dict], source: str = "KRI", window: str = "year_2025",
+                   retries: int = GPT_REPAIR_RETRIES) -> list[dict]:
+    """
+    One chunk through call_gpt, reconciled against its rows. Rows that come
+    back missing or invalid are re-requested on their own, up to `retries`
+    follow-up calls, so a bad completion costs a small call rather than a
+    rerun. Invalid objects from the last attempt are returned as well, so
+    they surface as validation errors.
+    """
+    done, pending, invalid = [], rows, []
+    for attempt in range(retries + 1):
+        if attempt:
+            log.info("gpt_repair_retry", rows=len(pending), attempt=attempt, retries=retries)
+        try:
+            recs = expand_recommendations(call_gpt(recommendation_payload(source, window, pending)), pending, source)
+        except Exception as e:
+            if not attempt:
+                raise
+            log.error("gpt_repair_failed", rows=len(pending), error=str(e))
+            break
+        valid, pending, invalid = reconcile_recommendations(pending, recs)
+        done.extend(valid)
+        if not pending:
+            return done
+    log.warning("gpt_repair_gave_up", rows=len(pending))
+    return done + invalid
+
+
+def call_gpt_fanout(rows: list[dict], source: str = "KRI", window: str = "year_2025",
+                    chunk_size: int = GPT_CHUNK_SIZE, max_workers: int = GPT_MAX_WORKERS,
+                    on_chunk=None) -> list[dict]:
+    """
+    Sends KRI rows to the chat endpoint in chunks, running the chunks in parallel
+    on a bounded thread pool. Results are merged back in input (chunk) order, so
+    the output matches what a single call_gpt over all rows would return.
+    With GPT_COMPACT_PAYLOAD each chunk goes out in the columnar encoding and the
+    answers are expanded back to full recommendations from their row index.
+    Rows a chunk's completion skipped or got wrong are re-requested
+    (generate_chunk). A failed chunk is logged and contributes no recommendations.
+    `on_chunk(recs)` is called with each chunk's result as soon as it is in.
+    """
+    chunks = chunk_rows(rows, chunk_size)
+    if not chunks:
+        return []
+
+    results: list[list[dict]] = [[] for _ in chunks]
+    workers = max(1, min(max_workers, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gpt-chunk") as pool:
+        futures = {pool.submit(carry(generate_chunk), chunk, source, window): i for i, chunk in enumerate(chunks)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+                if on_chunk:
+                    on_chunk(results[i])
+            except Exception as e:
+                log.error("gpt_chunk_failed", chunk=i + 1, chunks=len(chunks), rows=len(chunks[i]), error=str(e))
+
+    return [rec for chunk in results for rec in chunk]
+
 
+def _match_key(rec: dict) -> tuple[str, str]:
+    return str(rec.get("relatedEntityId")), str(rec.get("observedAt") or "")[:10]
+
+
+def match_recommendations(rows: list[dict], recs: list[dict]) -> tuple[dict[int, dict], list[dict]]:
+    """
+    Pairs each recommendation with the input row it was generated for.
+    Matches on (relatedEntityId, observedAt date) first, then on relatedEntityId alone.
+    Returns ({row_index: rec}, unmatched_recs).
+    """
+    by_key: dict[tuple[str, str], list[int]] = {}
+    by_id: dict[str, list[int]] = {}
+    for i, row in enumerate(rows):
+        by_key.setdefault(_match_key(row), []).append(i)
+        by_id.setdefault(str(row.get("relatedEntityId")), []).append(i)
+
+    matched, leftovers = {}, []
+    for rec in recs:
+        if not isinstance(rec, dict):
+            continue
+        candidates = by_key.get(_match_key(rec), []) + by_id.get(str(rec.get("relatedEntityId")), [])
+        idx = next((i for i in candidates if i not in matched), None)
+        if idx is None:
+            leftovers.append(rec)
+        else:
+            matched[idx] = rec
+    return matched, leftovers
+
+
+def generate_recommendations(rows: list[dict], source: str = "KRI", window: str = "year_2025",
+                             chunk_size: int = GPT_CHUNK_SIZE, max_workers: int = GPT_MAX_WORKERS,
+                             on_chunk=None) -> list[dict]:
+    """
+    Cache-aware front end for call_gpt_fanout.
+    Rows whose content address is already cached are answered from disk; only the
+    misses are sent to the LLM. Fresh recommendations that validate against
+    Recommendation are written back to the cache. Output follows input row order,
+    with any recommendation that could not be matched to a row appended at the end.
+    """
+    keys = [cache_key(OPENAI_MODEL, recommendation_prompt(), row) for row in rows]
+    answers: dict[int, dict] = {}
+    for i, key in enumerate(keys):
+        hit = CACHE.get(key)
+        if hit is not None:
+            answers[i] = hit
+
+    miss_idx = [i for i in range(len(rows)) if i not in answers]
+    leftovers: list[dict] = []
+    if miss_idx:
+        miss_rows = [rows[i] for i in miss_idx]
+        fresh = call_gpt_fanout(miss_rows, source=source, window=window,
+                                chunk_size=chunk_size, max_workers=max_workers, on_chunk=on_chunk)
+        matched, leftovers = match_recommendations(miss_rows, fresh)
+        for j, rec in matched.items():
+            i = miss_idx[j]
+            answers[i] = rec
+            try:
+                Recommendation(**rec)
+            except (ValidationError, TypeError):
+                continue
+            CACHE.put(keys[i], rec)
+
+    CACHE_LOOKUPS.inc(len(rows) - len(miss_idx), result="hit")
+    CACHE_LOOKUPS.inc(len(miss_idx), result="miss")
+    log.info("llm_cache_lookup", hits=len(rows) - len(miss_idx), misses=len(miss_idx), rows=len(rows))
+    return [answers[i] for i in range(len(rows)) if i in answers] + leftovers
+
+
+def stream_recommendations(rows: list[dict], source: str = "KRI", window: str = "year_2025",
+                           chunk_size: int = GPT_CHUNK_SIZE, max_workers: int = GPT_MAX_WORKERS):
+    """
+    Streaming counterpart of generate_recommendations.
+    Yields ("recommendation", rec) events: cached rows first, then objects from
+    the parallel chunk streams in completion order. A chunk that fails yields
+    ("error", message) after whatever it had already finished; every chunk
+    ends with ("chunk_done", n). Closing the generator (client gone) cancels the
+    chunks not started yet and stops the running ones at their next object,
+    without waiting for them.
+    """
+    keys = [cache_key(OPENAI_MODEL, recommendation_prompt(), row) for row in rows]
+    miss_idx = []
+    for i, key in enumerate(keys):
+        hit = CACHE.get(key)
+        if hit is None:
+            miss_idx.append(i)
+        else:
+            yield "recommendation", hit
+    CACHE_LOOKUPS.inc(len(rows) - len(miss_idx), result="hit")
+    CACHE_LOOKUPS.inc(len(miss_idx), result="miss")
+    if not miss_idx:
+        return
+
+    chunks = chunk_rows(miss_idx, chunk_size)
+    events: queue.Queue = queue.Queue()
+    closed = False
+
+    def worker(n: int, idx: list[int]):
+        chunk = [rows[i] for i in idx]
+        got = []
+        try:
+            for rec in stream_recommendation_objects(recommendation_payload(source, window, chunk)):
+                if closed:
+                    return
+                rec = expand_recommendations([rec], chunk, source)[0]
+                got.append(rec)
+                events.put(("recommendation", rec))
+        except Exception as e:
+            events.put(("error", f"chunk {n + 1}/{len(chunks)} ({len(chunk)} rows): {e}"))
+        try:
+            # rows the stream skipped, garbled or never reached (cut off) get a non-streamed follow-up
+            _, missing, _ = reconcile_recommendations(chunk, got)
+            if missing and GPT_REPAIR_RETRIES > 0 and not closed:
+                log.info("gpt_repair_retry", chunk=n + 1, rows=len(missing))
+                for rec in generate_chunk(missing, source, window, GPT_REPAIR_RETRIES - 1):
+                    got.append(rec)
+                    events.put(("recommendation", rec))
+        except Exception as e:
+            events.put(("error", f"chunk {n + 1}/{len(chunks)} repair: {e}"))
+        finally:
+            matched, _ = match_recommendations(chunk, [rec for rec in got if _is_valid(rec)])
+            for j, rec in matched.items():
+                CACHE.put(keys[idx[j]], rec)
+            events.put(("chunk_done", n))
+
+    workers = max(1, min(max_workers, len(chunks)))
+    # not a with-block: its exit would wait for every running chunk after a disconnect
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gpt-stream")
+    try:
+        for n, idx in enumerate(chunks):
+            pool.submit(carry(worker), n, idx)
+        remaining = len(chunks)
+        while remaining:
+            kind, payload = events.get()
+            if kind == "chunk_done":
+                remaining -= 1
+            yield kind, payload
+    finally:
+        closed = True
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,219 @@
+# jobs.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import pipeline
+from metrics import JOBS_RUNNING, JOBS_TOTAL
+from logs import bind, carry, get_logger
+load_dotenv()
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(".cache", "jobs.sqlite3"))
+JOB_WORKERS  = int(os.getenv("JOB_WORKERS", "2"))
+# how often the leader re-checks for jobs orphaned by workers that died
+JOB_SWEEP_SECONDS = float(os.getenv("JOB_SWEEP_SECONDS", "60"))
+
+log = get_logger(__name__)
+
+
+class _LiveTimings(dict):
+    """Stage timings dict that persists itself every time a stage finishes."""
+
+    def __init__(self, on_change):
+        super().__init__()
+        self._on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._on_change(dict(self))
+
+
+class JobQueue:
+    """
+    In-process background jobs for the long-running GPT endpoints.
+
+    Job state lives in a local SQLite file so that any worker process can
+    answer status polls, and results survive the request that submitted them.
+    Jobs execute on a bounded thread pool; each registered kind is a callable
+    taking (params, timings) and returning a JSON-serialisable result.
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._handlers: dict = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pool = None
+        self._ready = False
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS jobs (
+                            id          TEXT PRIMARY KEY,
+                            kind        TEXT NOT NULL,
+                            status      TEXT NOT NULL,
+                            params      TEXT,
+                            stages      TEXT,
+                            result      TEXT,
+                            error       TEXT,
+                            owner       TEXT,
+                            created_at  REAL NOT NULL,
+                            started_at  REAL,
+                            finished_at REAL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_created ON jobs (created_at)")
+                    self._ready = True
+        return conn
+
+    def register(self, kind: str, handler) -> None:
+        self._handlers[kind] = handler
+
+    def kinds(self) -> set[str]:
+        return set(self._handlers)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            return self._pool
+
+    def submit(self, kind: str, params: dict | None = None) -> str:
+        """Queues a job and returns its ID immediately."""
+        if kind not in self._handlers:
+            raise KeyError(f"unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        params = params or {}
+        self._db().execute(
+            "INSERT INTO jobs (id, kind, status, params, owner, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, json.dumps(params, default=str), _OWNER, time.time()),
+        )
+        # the job logs under the submitting request's request_id as well as its own job_id
+        self._executor().submit(carry(self._run), job_id, kind, params)
+        log.info("job_queued", kind=kind, job_id=job_id)
+        return job_id
+
+    def _run(self, job_id: str, kind: str, params: dict) -> None:
+        bind(job_id=job_id, job_kind=kind)
+        db = self._db()
+        db.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+        timings = _LiveTimings(
+            lambda stages: self._db().execute("UPDATE jobs SET stages = ? WHERE id = ?", (json.dumps(stages), job_id))
+        )
+        JOBS_RUNNING.inc(kind=kind)
+        try:
+            result = self._handlers[kind](params, timings)
+            db.execute(
+                "UPDATE jobs SET status = 'succeeded', result = ?, stages = ?, finished_at = ? WHERE id = ?",
+                (json.dumps(result, ensure_ascii=False, default=str), json.dumps(dict(timings)), time.time(), job_id),
+            )
+            JOBS_TOTAL.inc(kind=kind, status="succeeded")
+            log.info("job_succeeded")
+        except Exception as e:
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, stages = ?, finished_at = ? WHERE id = ?",
+                (f"{e}\n{traceback.format_exc()}", json.dumps(dict(timings)), time.time(), job_id),
+            )
+            JOBS_TOTAL.inc(kind=kind, status="failed")
+            log.exception("job_failed", error=str(e))
+        finally:
+            JOBS_RUNNING.dec(kind=kind)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, with_result: bool = True) -> dict:
+        job = {
+            "jobId": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "params": json.loads(row["params"] or "{}"),
+            "stages": json.loads(row["stages"] or "{}"),
+            "error": row["error"],
+            "createdAt": row["created_at"],
+            "startedAt": row["started_at"],
+            "finishedAt": row["finished_at"],
+            "durationSeconds": round(row["finished_at"] - row["started_at"], 3)
+            if row["finished_at"] and row["started_at"] else None,
+        }
+        if with_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit: int = 50, status: str | None = None) -> list[dict]:
+        sql = "SELECT * FROM jobs"
+        args: tuple = ()
+        if status:
+            sql += " WHERE status = ?"
+            args = (status,)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        rows = self._db().execute(sql, args + (limit,)).fetchall()
+        return [self._to_dict(r, with_result=False) for r in rows]
+
+    def mark_interrupted(self) -> int:
+        """
+        Flags jobs left queued/running by a process that no longer exists as
+        interrupted. Jobs owned by live worker processes are left alone.
+        Runs on every worker start and every JOB_SWEEP_SECONDS in the leader.
+        """
+        db = self._db()
+        rows = db.execute("SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        dead = [(time.time(), r["id"]) for r in rows if not _owner_alive(r["owner"])]
+        db.executemany("UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE id = ?", dead)
+        if dead:
+            log.warning("jobs_interrupted", jobs=len(dead))
+        return len(dead)
+
+
+# pid plus a per-process token: a restarted container can reuse the same pid
+_OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _owner_alive(owner: str | None) -> bool:
+    if not owner:
+        return False
+    if owner == _OWNER:
+        return True
+    pid = int(owner.split(":", 1)[0])
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+JOBS = JobQueue()
+JOBS.register("gpt_run", lambda params, timings: pipeline.run_recommendations(
+    full=bool(params.get("full", False)),
+    chunk_size=int(params.get("chunk_size", pipeline.GPT_CHUNK_SIZE)),
+    max_workers=int(params.get("max_workers", pipeline.GPT_MAX_WORKERS)),
+    timings=timings,
+))
+JOBS.register("gpt_summary", lambda params, timings: (
+    pipeline.run_summaries(params["domains"], timings=timings) if params.get("domains")
+    else pipeline.run_summary(params.get("domain", "KRI"), timings=timings)))
+JOBS.register("monthly", lambda params, timings: pipeline.run_monthly(timings=timings))
@@ -0,0 +1,127 @@
+# journal.py
+"""
+Crash-safe run journal for /gpt/run and /gpt/summary.
+
+A run is identified by a key that a retry of the same work reproduces (e.g.
+"summary:KRI:2025-05-31"). Every committed step (an LLM chunk, the insert,
+the email) is written under the run ID as it finishes. A run that did not
+reach finish() is resumed by the next open() for the same key, and the
+steps it already recorded are skipped; a finished run is never resumed, so a
+deliberate rerun starts fresh. Step payloads of finished runs are dropped.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+from logs import get_logger
+
+load_dotenv()
+
+RUN_JOURNAL_ENABLED = os.getenv("RUN_JOURNAL_ENABLED", "1") == "1"
+RUN_JOURNAL_PATH    = os.getenv("RUN_JOURNAL_PATH", os.path.join(".cache", "run_journal.sqlite3"))
+
+log = get_logger(__name__)
+
+
+class RunJournal:
+    def __init__(self, path: str = RUN_JOURNAL_PATH, enabled: bool = RUN_JOURNAL_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ready = False
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS runs (
+                            id          TEXT PRIMARY KEY,
+                            key         TEXT NOT NULL,
+                            status      TEXT NOT NULL,
+                            attempts    INTEGER NOT NULL,
+                            created_at  REAL NOT NULL,
+                            updated_at  REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS ix_runs_key ON runs (key, status)")
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS steps (
+                            run_id  TEXT NOT NULL,
+                            step    TEXT NOT NULL,
+                            payload TEXT,
+                            at      REAL NOT NULL,
+                            PRIMARY KEY (run_id, step)
+                        )
+                    """)
+                    self._ready = True
+        return conn
+
+    def open(self, key: str) -> tuple[str | None, bool]:
+        """Returns (run_id, resumed): the unfinished run for `key`, or a new one."""
+        if not self.enabled:
+            return None, False
+        db = self._db()
+        now = time.time()
+        with self._lock:
+            row = db.execute(
+                "SELECT id FROM runs WHERE key = ? AND status = 'running' ORDER BY created_at DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+            if row:
+                db.execute("UPDATE runs SET attempts = attempts + 1, updated_at = ? WHERE id = ?", (now, row["id"]))
+                done = db.execute("SELECT COUNT(*) FROM steps WHERE run_id = ?", (row["id"],)).fetchone()[0]
+                log.info("run_resumed", run_id=row["id"], key=key, steps=done)
+                return row["id"], True
+            run_id = uuid.uuid4().hex[:12]
+            db.execute("INSERT INTO runs (id, key, status, attempts, created_at, updated_at) VALUES (?, ?, 'running', 1, ?, ?)",
+                       (run_id, key, now, now))
+        return run_id, False
+
+    def steps(self, run_id: str | None, prefix: str = "") -> dict[str, object]:
+        """Committed steps of a run (optionally only those starting with `prefix`)."""
+        if not run_id:
+            return {}
+        rows = self._db().execute(
+            "SELECT step, payload FROM steps WHERE run_id = ? AND step LIKE ? ORDER BY at",
+            (run_id, prefix + "%"),
+        ).fetchall()
+        return {r["step"]: json.loads(r["payload"]) for r in rows}
+
+    def record(self, run_id: str | None, step: str, payload=None) -> None:
+        if not run_id:
+            return
+        self._db().execute(
+            "INSERT OR REPLACE INTO steps (run_id, step, payload, at) VALUES (?, ?, ?, ?)",
+            (run_id, step, json.dumps(payload, default=str), time.time()),
+        )
+
+    def finish(self, run_id: str | None) -> None:
+        if not run_id:
+            return
+        db = self._db()
+        db.execute("UPDATE runs SET status = 'completed', updated_at = ? WHERE id = ?", (time.time(), run_id))
+        db.execute("DELETE FROM steps WHERE run_id = ?", (run_id,))
+
+    def runs(self, limit: int = 50) -> list[dict]:
+        rows = self._db().execute(
+            "SELECT r.*, (SELECT COUNT(*) FROM steps s WHERE s.run_id = r.id) AS steps "
+            "FROM runs r ORDER BY updated_at DESC LIMIT ?", (limit,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
+JOURNAL = RunJournal()
@@ -0,0 +1,157 @@
+# kri_snapshot.py
+import bisect
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import date
+from dotenv import load_dotenv
+from kri_stage import STAGE
+from logs import get_logger
+load_dotenv()
+
+KRI_WINDOW_MONTHS          = int(os.getenv("KRI_WINDOW_MONTHS", "2"))
+KRI_SNAPSHOT_PROBE_SECONDS = float(os.getenv("KRI_SNAPSHOT_PROBE_SECONDS", "30"))
+
+# Columns of the /data/sql and /gpt/run rows, in their original order.
+WINDOW_FIELDS = (
+    "relatedEntityId", "metricName", "metricValue", "observedAt", "kriStandard",
+    "riskType", "riskW", "impactLevel", "likelihoodBin", "probabilityLevel",
+    "warningLimit", "warningLimitOperator", "escalationLimit", "escalationLimitOperator",
+    "thresholdLimit", "thresholdOperator", "exposureScore", "statusBand",
+)
+
+log = get_logger(__name__)
+
+
+def _date_ordinal(value) -> int:
+    try:
+        return date.fromisoformat(str(value)[:10]).toordinal()
+    except ValueError:
+        return 0
+
+
+def window_key(row: dict) -> tuple:
+    """Ascending sort key for breachLevel DESC, observedAt DESC, relatedEntityId."""
+    return -row["breachLevel"], -_date_ordinal(row.get("observedAt")), str(row.get("relatedEntityId"))
+
+
+def _breach_level(status: str | None) -> int:
+    if status == "Breached":
+        return 2
+    if status == "Warning":
+        return 1
+    return 0
+
+
+class KriSnapshot:
+    """
+    In-memory copy of the KRI reporting window, shared by /data/sql, /gpt/run
+    and /gpt/summary.
+
+    The window (TOP_KRIs over the last KRI_WINDOW_MONTHS months) is loaded from
+    the KRI staging table in one query per distinct MAX(AsOfDate). Before
+    serving, a watermark probe checks whether that date moved; the probe itself
+    is skipped if the last one ran less than `probe_seconds` ago.
+    """
+
+    def __init__(self, months: int = KRI_WINDOW_MONTHS, probe_seconds: float = KRI_SNAPSHOT_PROBE_SECONDS):
+        self.months = months
+        self.probe_seconds = probe_seconds
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._probed_at = 0.0
+        self._window: list[dict] = []
+        self._index: tuple[str | None, list[dict], list[tuple]] = (None, [], [])
+        self._current: list[dict] = []
+        self.version = None
+        self._generation = None
+        self.loads = 0
+
+    def probe(self) -> str | None:
+        """Syncs the staging table, then returns its MAX(AsOfDate) as an ISO date."""
+        STAGE.sync()
+        watermark = STAGE.watermark()
+        return watermark.isoformat() if watermark else None
+
+    def refresh(self, force: bool = False) -> str | None:
+        """Reloads the window if the watermark moved or the stage was re-copied; returns the watermark in use."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self.loads and now - self._probed_at < self.probe_seconds:
+                return self._watermark
+            watermark = self.probe()
+            self._probed_at = now
+            if force or watermark != self._watermark or STAGE.generation != self._generation or not self.loads:
+                self._load(watermark)
+            return self._watermark
+
+    def _load(self, watermark: str | None) -> None:
+        self._generation = STAGE.generation
+        raw = STAGE.window_rows(watermark, self.months) if watermark else []
+
+        window = []
+        for r in raw:
+            if not r.get("breachedKris") or r["breachedKris"] <= 0:
+                continue
+            row = {f: r.get(f) for f in WINDOW_FIELDS}
+            row["breachLevel"] = _breach_level(r.get("statusBand"))
+            window.append((row, r.get("asOfDate") or ""))
+        # relatedEntityId breaks ties so pages (window_page) have a total order
+        window.sort(key=lambda x: str(x[0]["relatedEntityId"]))
+        window.sort(key=lambda x: x[1], reverse=True)
+        window.sort(key=lambda x: x[0]["breachLevel"], reverse=True)
+
+        current = [
+            {
+                "kriId": r["relatedEntityId"],
+                "kriName": r["metricName"],
+                "adjustedCurrentMth": r["metricValue"],
+                "riskType": r["riskType"],
+                "ImpactBin_Col": r["impactLevel"],
+                "LikelihoodBin_Col": r["likelihoodBin"],
+                "exposureScore": r["exposureScore"],
+                "kriStatus": r["statusBand"],
+                "asOfDate": r["asOfDate"],
+                "isBreached": 1 if r["statusBand"] == "Breached" else 0,
+                "isWarning": 1 if r["statusBand"] == "Warning" else 0,
+                "highImpactHighLikelihood": 1 if r["impactLevel"] == 3 and r["likelihoodBin"] == 5 else 0,
+            }
+            for r in raw if r.get("asOfDate") == watermark
+        ]
+        current.sort(key=lambda r: (r["riskType"] or "", r["kriName"] or ""))
+
+        self._window = [row for row, _ in window]
+        self._current = current
+        self._watermark = watermark
+        # same data → same version in every worker process (used for ETags)
+        digest = zlib.crc32(json.dumps(self._window, sort_keys=True, default=str).encode())
+        self.version = f"{watermark}-{digest:08x}"
+        self._index = (self.version, self._window, [window_key(row) for row in self._window])
+        self.loads += 1
+        log.info("kri_snapshot_loaded", as_of=watermark, window=len(self._window), current=len(current))
+
+    def window_rows(self) -> list[dict]:
+        """Breached/warning TOP_KRIs over the window, breachLevel DESC, As of Date DESC."""
+        self.refresh()
+        return list(self._window)
+
+    def window_page(self, after: tuple | None = None, limit: int = 0) -> tuple[list[dict], tuple | None, str | None]:
+        """
+        Keyset page of window_rows(): rows after the `after` key (see window_key),
+        at most `limit` of them (0 = all). Returns (rows, key of the last row if
+        more rows follow, version of the data). Does not refresh; call refresh() first.
+        """
+        version, window, keys = self._index  # one read, so a concurrent reload cannot mix versions
+        start = bisect.bisect_right(keys, tuple(after)) if after else 0
+        end = min(start + limit, len(window)) if limit > 0 else len(window)
+        return window[start:end], (keys[end - 1] if end < len(window) else None), version
+
+    def current_month_rows(self) -> list[dict]:
+        """All TOP_KRIs at the latest As of Date, ordered by Risk Type, KRI_Name."""
+        self.refresh()
+        return list(self._current)
+
+
+SNAPSHOT = KriSnapshot()
@@ -0,0 +1,380 @@
+# kri_stage.py
+import calendar
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+from dotenv import load_dotenv
+from sqlalchemy import Column, Date, DateTime, Float, Index, Integer, MetaData, String, Table, delete, func, insert, select, text
+from helper import ENGINE, run_query
+from logs import get_logger
+load_dotenv()
+
+KRI_SOURCE_TABLE       = os.getenv("KRI_SOURCE_TABLE", "[NPL].[dbo].[t_insightView_KRI]")
+KRI_STAGE_SYNC_SECONDS = float(os.getenv("KRI_STAGE_SYNC_SECONDS", "300"))
+KRI_STAGE_BATCH_SIZE   = int(os.getenv("KRI_STAGE_BATCH_SIZE", "1000"))
+
+metadata = MetaData()
+
+# Service-owned, typed copy of t_insightView_KRI. AsOfDate is a real DATE, so
+# window filters are index seeks instead of TRY_CONVERT scans.
+KRI_STAGE = Table(
+    "t_insightView_KRI_Stage", metadata,
+    Column("Id", Integer, primary_key=True, autoincrement=True),
+    Column("KriId", String(64), nullable=False),
+    Column("KriName", String(400)),
+    Column("MetricValue", Float),
+    Column("AsOfDate", Date, nullable=False),
+    Column("KriStandard", String(400)),
+    Column("RiskType", String(200)),
+    Column("RiskW", Float),
+    Column("ImpactBin", Integer),
+    Column("LikelihoodBin", Integer),
+    Column("RiskLevel", String(100)),
+    Column("WarningLimit", Float),
+    Column("WarningOperator", String(2)),
+    Column("EscalationLimit", Float),
+    Column("EscalationOperator", String(2)),
+    Column("ThresholdLimit", Float),
+    Column("ThresholdOperator", String(2)),
+    Column("ExposureScore", Float),
+    Column("KriStatus", String(32)),
+    Column("BreachedKris", Integer),
+    Column("TopKri", Integer, nullable=False),
+    Column("LoadedAt", DateTime, nullable=False),
+    schema="dbo",
+)
+Index("IX_KRI_Stage_AsOfDate_TopKri", KRI_STAGE.c.AsOfDate, KRI_STAGE.c.TopKri)
+
+_OPERATORS = {
+    "<": "<", "lt": "<", "less than": "<", "below": "<",
+    "<=": "<=", "=<": "<=", "≤": "<=", "lte": "<=", "less than or equal to": "<=",
+    ">": ">", "gt": ">", "greater than": ">", "above": ">",
+    ">=": ">=", "=>": ">=", "≥": ">=", "gte": ">=", "greater than or equal to": ">=",
+    "=": "=", "==": "=", "eq": "=", "equal to": "=",
+}
+
+log = get_logger(__name__)
+
+
+def parse_operator(value) -> str | None:
+    """Normalises a limit operator to one of <, <=, >, >=, = (None if unknown)."""
+    if value is None:
+        return None
+    return _OPERATORS.get(re.sub(r"\s+", " ", str(value)).strip().lower())
+
+
+def to_float(value) -> float | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "").replace("%", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value) -> int | None:
+    f = to_float(value)
+    return int(f) if f is not None else None
+
+
+def to_date(value) -> date | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def add_months(d: date, months: int) -> date:
+    """Calendar month arithmetic with end-of-month clamping, like DATEADD(MONTH, ...)."""
+    m = d.month - 1 + months
+    y = d.year + m // 12
+    m = m % 12 + 1
+    return date(y, m, min(d.day, calendar.monthrange(y, m)[1]))
+
+
+def _source_date_expr() -> str:
+    if ENGINE.dialect.name == "mssql":
+        return "TRY_CONVERT(date, [As of Date])"
+    return "date([As of Date])"
+
+
+def _stage_row(r: dict, loaded_at: datetime) -> dict | None:
+    as_of = to_date(r["AsOfDate"])
+    if as_of is None or r["KriId"] is None:
+        return None
+    return {
+        "KriId": str(r["KriId"]).strip(),
+        "KriName": r["KriName"],
+        "MetricValue": to_float(r["MetricValue"]),
+        "AsOfDate": as_of,
+        "KriStandard": r["KriStandard"],
+        "RiskType": r["RiskType"],
+        "RiskW": to_float(r["RiskW"]),
+        "ImpactBin": to_int(r["ImpactBin"]),
+        "LikelihoodBin": to_int(r["LikelihoodBin"]),
+        "RiskLevel": r["RiskLevel"],
+        "WarningLimit": to_float(r["WarningLimit"]),
+        "WarningOperator": parse_operator(r["WarningOperator"]),
+        "EscalationLimit": to_float(r["EscalationLimit"]),
+        "EscalationOperator": parse_operator(r["EscalationOperator"]),
+        "ThresholdLimit": to_float(r["ThresholdLimit"]),
+        "ThresholdOperator": parse_operator(r["ThresholdOperator"]),
+        "ExposureScore": to_float(r["ExposureScore"]),
+        "KriStatus": r["KriStatus"],
+        "BreachedKris": to_int(r["BreachedKris"]),
+        "TopKri": 1 if to_int(r["TopKri"]) == 1 else 0,
+        "LoadedAt": loaded_at,
+    }
+
+
+class KriStage:
+    """
+    Maintains t_insightView_KRI_Stage from the source KRI table.
+
+    sync() is the only code that reads the source table: it probes the source
+    fingerprint (source_fingerprint) and, when the source MAX(As of Date) is
+    ahead of the staged data or the fingerprint moved since the last copy,
+    re-copies every source row from the latest staged date onward (so
+    corrections published for the current month are picked up as well).
+    Syncs are throttled to one per `sync_seconds`; `generation` counts the
+    copies, so readers can tell that staged rows changed under the same date.
+    All other reads go through the staging table.
+    """
+
+    def __init__(self, sync_seconds: float = KRI_STAGE_SYNC_SECONDS, batch_size: int = KRI_STAGE_BATCH_SIZE):
+        self.sync_seconds = sync_seconds
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._ready = False
+        self._synced_at = 0.0
+        self._fingerprint = None
+        self.generation = 0
+
+    def ensure_table(self) -> None:
+        if not self._ready:
+            metadata.create_all(ENGINE, tables=[KRI_STAGE], checkfirst=True)
+            self._ready = True
+
+    def source_watermark(self) -> date | None:
+        rows = run_query(f"SELECT MAX({_source_date_expr()}) AS max_date FROM {KRI_SOURCE_TABLE};")
+        return to_date(rows[0]["max_date"]) if rows else None
+
+    def source_fingerprint(self) -> dict:
+        """
+        Cheap change marker for the source table: MAX(As of Date), row count and
+        a checksum (CHECKSUM_AGG over the rows on SQL Server, the sum of the
+        adjusted values elsewhere). Any republish or correction moves at least
+        one of the three.
+        """
+        date_expr = _source_date_expr()
+        checksum = ("CHECKSUM_AGG(BINARY_CHECKSUM(*))" if ENGINE.dialect.name == "mssql"
+                    else "SUM([Adjusted Current Mth])")
+        rows = run_query(f"""
+            SELECT MAX({date_expr}) AS max_date, COUNT(*) AS row_count, {checksum} AS checksum
+            FROM {KRI_SOURCE_TABLE};
+        """)
+        r = rows[0] if rows else {}
+        max_date = to_date(r.get("max_date"))
+        return {
+            "maxDate": max_date.isoformat() if max_date else None,
+            "rowCount": r.get("row_count") or 0,
+            "checksum": r.get("checksum"),
+        }
+
+    def watermark(self) -> date | None:
+        """MAX(AsOfDate) of the staged rows — a seek on the AsOfDate index."""
+        self.ensure_table()
+        with ENGINE.connect() as conn:
+            return to_date(conn.execute(select(func.max(KRI_STAGE.c.AsOfDate))).scalar())
+
+    def sync(self, force: bool = False, since: date | None = None) -> int:
+        """
+        Copies new or corrected source rows into the staging table; returns the
+        number of rows staged. `force` skips the throttle and the change check;
+        `since` re-copies from that date.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._synced_at and now - self._synced_at < self.sync_seconds:
+                return 0
+            self.ensure_table()
+            self._synced_at = now
+            staged = self.watermark()
+            fingerprint = self.source_fingerprint()
+            source = to_date(fingerprint["maxDate"])
+            if source is None:
+                return 0
+            unchanged = staged is not None and source <= staged and fingerprint == self._fingerprint
+            if not force and since is None and unchanged:
+                return 0
+            copied = self._copy(since or staged)
+            self._fingerprint = fingerprint
+            self.generation += 1
+            return copied
+
+    def _copy(self, since: date | None) -> int:
+        date_expr = _source_date_expr()
+        sql = f"""
+            SELECT
+                [KRI ID]                  AS KriId,
+                [KRI_Name]                AS KriName,
+                [Adjusted Current Mth]    AS MetricValue,
+                {date_expr}               AS AsOfDate,
+                [KRI Standard]            AS KriStandard,
+                [Risk Type]               AS RiskType,
+                [RiskW]                   AS RiskW,
+                [ImpactBin_Col]           AS ImpactBin,
+                [LikelihoodBin_Col]       AS LikelihoodBin,
+                [RiskLevel_Col]           AS RiskLevel,
+                [Warning Limit1]          AS WarningLimit,
+                [Warning Limit1 Operator] AS WarningOperator,
+                [Escalaltion Limit 1 Num] AS EscalationLimit,
+                [Escalation Limit1 Operator] AS EscalationOperator,
+                [Threshold_Value]         AS ThresholdLimit,
+                [Threshold_Operator]      AS ThresholdOperator,
+                [ExposureScoreCol]        AS ExposureScore,
+                [KRI Status]              AS KriStatus,
+                [Breached KRIs]           AS BreachedKris,
+                [TOP_KRIs]                AS TopKri
+            FROM {KRI_SOURCE_TABLE}
+            WHERE {date_expr} IS NOT NULL {"AND " + date_expr + " >= :since" if since else ""};
+        """
+        loaded_at = datetime.now()
+        with ENGINE.begin() as conn:
+            # drain the source first: one open result set per connection on SQL Server
+            res = conn.execute(text(sql), {"since": since} if since else {})
+            cols = list(res.keys())
+            source_rows = res.fetchall()
+            if since:
+                conn.execute(delete(KRI_STAGE).where(KRI_STAGE.c.AsOfDate >= since))
+            else:
+                conn.execute(delete(KRI_STAGE))
+            staged = [s for s in (_stage_row(dict(zip(cols, row)), loaded_at) for row in source_rows) if s]
+            for i in range(0, len(staged), self.batch_size):
+                conn.execute(insert(KRI_STAGE), staged[i:i + self.batch_size])
+            copied = len(staged)
+        log.info("kri_stage_synced", rows=copied, since=since)
+        return copied
+
+    def window_rows(self, max_date: date | str, months: int) -> list[dict]:
+        """TOP_KRIs with AsOfDate in [max_date - months, max_date], aliased like the API rows."""
+        end = to_date(max_date)
+        sql = """
+            SELECT
+                s.KriId              AS relatedEntityId,
+                s.KriName            AS metricName,
+                s.MetricValue        AS metricValue,
+                s.AsOfDate           AS observedAt,
+                s.AsOfDate           AS asOfDate,
+                s.KriStandard        AS kriStandard,
+                s.RiskType           AS riskType,
+                s.RiskW              AS riskW,
+                s.ImpactBin          AS impactLevel,
+                s.LikelihoodBin      AS likelihoodBin,
+                s.RiskLevel          AS probabilityLevel,
+                s.WarningLimit       AS warningLimit,
+                s.WarningOperator    AS warningLimitOperator,
+                s.EscalationLimit    AS escalationLimit,
+                s.EscalationOperator AS escalationLimitOperator,
+                s.ThresholdLimit     AS thresholdLimit,
+                s.ThresholdOperator  AS thresholdOperator,
+                s.ExposureScore      AS exposureScore,
+                s.KriStatus          AS statusBand,
+                s.BreachedKris       AS breachedKris
+            FROM dbo.t_insightView_KRI_Stage s
+            WHERE s.AsOfDate BETWEEN :start AND :end
+              AND s.TopKri = 1;
+        """
+        return run_query(sql, {"start": add_months(end, -months), "end": end})
+
+    def trend_rows(self, max_date: date | str, months: int) -> tuple[list[dict], list[dict]]:
+        """
+        Month-over-month features over the last `months` months of TOP_KRIs,
+        computed with window functions so only the latest month comes back:
+        (per-KRI rows that are flagged now, were flagged last month or are
+        high impact/likelihood; per-Risk Type breach counts and deltas).
+        """
+        end = to_date(max_date)
+        params = {"start": add_months(end, -months), "end": end}
+        kris = run_query(_HISTORY_CTE + """
+            , m AS (
+                SELECT
+                    KriId, KriName, RiskType, AsOfDate, MetricValue, KriStatus, ImpactBin, LikelihoodBin,
+                    LAG(MetricValue) OVER (PARTITION BY KriId ORDER BY AsOfDate) AS prevValue,
+                    LAG(KriStatus)   OVER (PARTITION BY KriId ORDER BY AsOfDate) AS prevStatus,
+                    AVG(1.0 * MetricValue) OVER (PARTITION BY KriId ORDER BY AsOfDate
+                                                 ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) AS avg3m,
+                    AVG(1.0 * MetricValue) OVER (PARTITION BY KriId) AS avgWindow,
+                    SUM(CASE WHEN KriStatus IN ('Breached', 'Warning') THEN 1 ELSE 0 END)
+                        OVER (PARTITION BY KriId) AS flaggedMonths,
+                    COUNT(*) OVER (PARTITION BY KriId) AS months
+                FROM h
+            )
+            SELECT
+                KriId AS kriId, KriName AS kriName, RiskType AS riskType, KriStatus AS kriStatus,
+                prevStatus, MetricValue AS value, prevValue, MetricValue - prevValue AS delta,
+                avg3m, avgWindow, flaggedMonths, months,
+                CASE WHEN ImpactBin >= 3 AND LikelihoodBin >= 5 THEN 1 ELSE 0 END AS highSeverity
+            FROM m
+            WHERE AsOfDate = :end
+              AND (KriStatus IN ('Breached', 'Warning') OR prevStatus IN ('Breached', 'Warning')
+                   OR (ImpactBin >= 3 AND LikelihoodBin >= 5))
+            ORDER BY riskType, kriName;
+        """, params)
+        risk_types = run_query(_HISTORY_CTE + """
+            , r AS (
+                SELECT
+                    RiskType, AsOfDate, COUNT(*) AS kris,
+                    SUM(CASE WHEN KriStatus = 'Breached' THEN 1 ELSE 0 END) AS breached,
+                    SUM(CASE WHEN KriStatus = 'Warning' THEN 1 ELSE 0 END) AS warning,
+                    AVG(1.0 * ExposureScore) AS avgExposure
+                FROM h
+                GROUP BY RiskType, AsOfDate
+            ), t AS (
+                SELECT
+                    RiskType, AsOfDate, kris, breached, warning, avgExposure,
+                    LAG(breached)    OVER (PARTITION BY RiskType ORDER BY AsOfDate) AS prevBreached,
+                    LAG(warning)     OVER (PARTITION BY RiskType ORDER BY AsOfDate) AS prevWarning,
+                    LAG(avgExposure) OVER (PARTITION BY RiskType ORDER BY AsOfDate) AS prevExposure,
+                    AVG(1.0 * breached) OVER (PARTITION BY RiskType ORDER BY AsOfDate
+                                              ROWS BETWEEN 2 PRECEDING AND CURRENT ROW) AS breached3m,
+                    AVG(1.0 * breached) OVER (PARTITION BY RiskType) AS breachedAvgWindow,
+                    COUNT(*) OVER (PARTITION BY RiskType) AS months
+                FROM r
+            )
+            SELECT
+                RiskType AS riskType, kris, breached, prevBreached, warning, prevWarning,
+                breached3m, breachedAvgWindow, avgExposure, prevExposure, months
+            FROM t
+            WHERE AsOfDate = :end
+            ORDER BY breached DESC, warning DESC, riskType;
+        """, params)
+        return kris, risk_types
+
+
+# TOP_KRIs over [start, end], one row per KRI and month (the latest load wins)
+_HISTORY_CTE = """
+    WITH h AS (
+        SELECT KriId, KriName, RiskType, AsOfDate, MetricValue, KriStatus, ExposureScore,
+               ImpactBin, LikelihoodBin
+        FROM (
+            SELECT s.*, ROW_NUMBER() OVER (PARTITION BY s.KriId, s.AsOfDate ORDER BY s.Id DESC) AS rn
+            FROM dbo.t_insightView_KRI_Stage s
+            WHERE s.TopKri = 1 AND s.AsOfDate BETWEEN :start AND :end
+        ) d
+        WHERE rn = 1
+    )
+"""
+
+
+STAGE = KriStage()
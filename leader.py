@@ -0,0 +1,147 @@
+# leader.py
+"""
+Single-leader election across the worker processes on one host.
+
+Every worker runs a LeaderElection; the one that takes an exclusive lock on
+LEADER_LOCK_PATH starts the scheduler and the email dispatcher, the others
+retry every LEADER_RETRY_SECONDS. The OS drops the lock when the leader
+process exits or is killed, so a standby takes over on its next retry.
+"""
+import os
+import threading
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from logs import get_logger
+
+load_dotenv()
+
+LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH", os.path.join(".cache", "leader.lock"))
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "5"))
+
+LEADER_GAUGE = REGISTRY.gauge(
+    "insightview_leader", "1 in the worker that runs the scheduler and email dispatcher.", ("pid",))
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+log = get_logger(__name__)
+
+
+class FileLock:
+    """Non-blocking exclusive lock on a file, held until release() or process exit."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = None
+
+    def acquire(self) -> bool:
+        if self._fh:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fh = open(self.path, "a+")
+        try:
+            if fcntl:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            fh.close()
+            return False
+        # owner pid, for whoever is looking at the file
+        fh.seek(0)
+        fh.truncate()
+        fh.write(f"{os.getpid()}\n")
+        fh.flush()
+        self._fh = fh
+        return True
+
+    def release(self) -> None:
+        if not self._fh:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            else:
+                self._fh.seek(0)
+                msvcrt.locking(self._fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._fh.close()
+            self._fh = None
+
+
+class LeaderElection:
+    """Runs the singleton background services in whichever worker holds the lock."""
+
+    def __init__(self, lock_path: str = LEADER_LOCK_PATH, retry_seconds: float = LEADER_RETRY_SECONDS):
+        self.lock = FileLock(lock_path)
+        self.retry_seconds = retry_seconds
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._services: list[threading.Thread] = []
+
+    def _lead(self) -> None:
+        from scheduler import SCHEDULER
+        from outbox import DISPATCHER
+
+        self.is_leader = True
+        LEADER_GAUGE.set(1, pid=os.getpid())
+        log.info("leader_elected", pid=os.getpid())
+        for name, target in (("scheduler", SCHEDULER.run), ("email-dispatcher", DISPATCHER.run)):
+            thread = threading.Thread(target=target, daemon=True, name=name)
+            thread.start()
+            self._services.append(thread)
+
+    def _campaign(self) -> None:
+        LEADER_GAUGE.set(0, pid=os.getpid())
+        while not self._stop.is_set():
+            try:
+                if self.lock.acquire():
+                    self._lead()
+                    break
+            except Exception as e:
+                log.exception("leader_campaign_failed", error=str(e))
+            self._stop.wait(self.retry_seconds)
+        self._sweep()
+
+    def _sweep(self) -> None:
+        """While leading: flags jobs of workers that died since (see JobQueue.mark_interrupted)."""
+        from jobs import JOB_SWEEP_SECONDS, JOBS
+
+        while self.is_leader and not self._stop.is_set():
+            try:
+                JOBS.mark_interrupted()
+            except Exception as e:
+                log.exception("job_sweep_failed", error=str(e))
+            self._stop.wait(JOB_SWEEP_SECONDS)
+
+    def start(self) -> None:
+        """Sweeps orphaned jobs, then starts campaigning in the background; returns immediately."""
+        from jobs import JOBS
+
+        JOBS.mark_interrupted()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._campaign, daemon=True, name="leader-election")
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stops the services (if leading) and hands the lock to the next worker."""
+        self._stop.set()
+        if self.is_leader:
+            from scheduler import SCHEDULER
+            from outbox import DISPATCHER
+
+            SCHEDULER.stop()
+            DISPATCHER.stop()
+            for thread in self._services:
+                thread.join(timeout)
+            self.is_leader = False
+            LEADER_GAUGE.set(0, pid=os.getpid())
+        self.lock.release()
+
+
+LEADER = LeaderElection()
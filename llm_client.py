@@ -0,0 +1,296 @@
+# llm_client.py
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from metrics import LLM_RETRIES, LLM_SECONDS, LLM_THROTTLED, LLM_TOKENS
+from logs import get_logger
+load_dotenv()
+
+OPENAI_API_KEY   = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE      = os.getenv("OPENAI_BASE", "https://api.openai.com/v1")
+LLM_POOL_SIZE    = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_TIMEOUT      = float(os.getenv("LLM_TIMEOUT", "300"))
+LLM_MAX_RETRIES  = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX  = float(os.getenv("LLM_BACKOFF_MAX", "60"))
+LLM_RPM          = float(os.getenv("LLM_RPM", "0"))  # requests per minute, 0 = unlimited
+LLM_TPM          = float(os.getenv("LLM_TPM", "0"))  # tokens per minute, 0 = unlimited
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # optional dependency (or no encoding files offline)
+    _ENCODING = None
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+log = get_logger(__name__)
+
+
+def parse_duration(value: str | None) -> float | None:
+    """
+    Seconds from a rate-limit reset header: "20ms", "1s", "6m0s", "1h2m3.5s"
+    or a bare number of seconds. None if it cannot be read.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts)
+
+
+def retry_after(headers, rate_limited: bool = True) -> float | None:
+    """
+    How long the server asked us to wait: Retry-After / retry-after-ms, and for
+    429s the x-ratelimit-reset-* headers. None if no hint is present.
+    """
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    ra = headers.get("Retry-After")
+    if ra:
+        secs = parse_duration(ra)
+        if secs is not None:
+            return secs
+        try:
+            return max(0.0, parsedate_to_datetime(ra).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    if not rate_limited:
+        return None
+    resets = [parse_duration(headers.get(h)) for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+_TOKEN_PIECE = re.compile(r"[A-Za-z]+|\d+|\s+|[^\sA-Za-z\d]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local estimate of how many BPE tokens `text` costs. Uses tiktoken when it
+    is installed; otherwise letters cost one token per 4 characters, digits one
+    per 3, and every punctuation mark one, which tracks cl100k/o200k within
+    ~10-15% on JSON payloads.
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    n = 0
+    for piece in _TOKEN_PIECE.findall(text):
+        c = piece[0]
+        if c.isalpha():
+            n += (len(piece) + 3) // 4
+        elif c.isdigit():
+            n += (len(piece) + 2) // 3
+        elif not c.isspace() or len(piece) > 1:
+            n += 1
+    return n
+
+
+def estimate_tokens(body: dict) -> int:
+    """Prompt size of a chat body, used to reserve TPM before a call."""
+    messages = body.get("messages")
+    if messages:
+        return max(1, sum(count_tokens(str(m.get("content") or "")) + 4 for m in messages))
+    return max(1, count_tokens(json.dumps(body, ensure_ascii=False)))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `per_minute` units per minute, holding
+    at most one minute's worth. acquire() blocks until the units are available;
+    a rate of 0 disables the limit (pause() still applies). Requests larger than the capacity are
+    clamped so they can still pass once the bucket is full.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Takes `amount` units, waiting as needed. Returns the seconds spent waiting."""
+        if self.rate <= 0 and not self._paused_until:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.rate <= 0 or self._tokens >= amount:
+                        self._tokens -= amount
+                        return waited
+                    wait = (amount - self._tokens) / self.rate
+                self._cond.wait(wait)
+                waited += time.monotonic() - now
+
+    def settle(self, delta: float) -> None:
+        """Corrects an earlier reservation once the real cost is known (may go into debt)."""
+        if self.rate <= 0 or not delta:
+            return
+        with self._cond:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens - delta)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Holds every caller back for `seconds` (server-side limit reached)."""
+        if seconds <= 0:
+            return
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class LLMClient:
+    """
+    Shared client for the OpenAI-compatible chat endpoint.
+
+    One keep-alive requests.Session with a connection pool sized for the GPT
+    fan-out, so chunks reuse TCP/TLS connections. Calls first pass an RPM and a
+    TPM token bucket; 429/5xx responses and connection errors are retried with
+    exponential backoff and jitter, honouring Retry-After and the
+    x-ratelimit-reset-* headers. A 429 also pauses the buckets, so concurrent
+    callers back off together instead of each hitting the limit.
+    """
+
+    def __init__(self, base_url: str = OPENAI_BASE, api_key: str = OPENAI_API_KEY,
+                 pool_size: int = LLM_POOL_SIZE, timeout: float = LLM_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX, rpm: float = LLM_RPM, tpm: float = LLM_TPM):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests_bucket = TokenBucket(rpm)
+        self.tokens_bucket = TokenBucket(tpm)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "throttled_seconds": 0.0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+
+    def _count(self, **inc) -> None:
+        with self._lock:
+            for k, v in inc.items():
+                self.stats[k] += v
+
+    def _backoff(self, attempt: int, hinted: float | None) -> float:
+        if hinted is not None:
+            return min(hinted, self.backoff_max) + random.uniform(0, 0.25)
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _observe_limits(self, headers) -> None:
+        """Pauses the buckets early when the server reports nothing left in the window."""
+        for kind, bucket in (("requests", self.requests_bucket), ("tokens", self.tokens_bucket)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.strip() == "0":
+                bucket.pause(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 0)
+
+    def post(self, path: str, body: dict, stream: bool = False) -> requests.Response:
+        """
+        POSTs `body` with rate limiting and retries; returns the successful response.
+        Raises requests.HTTPError for non-retryable statuses or once retries run out.
+        A streamed response is only retried before its body is read. TPM is
+        reserved once per call, so retries do not charge the prompt again.
+        """
+        url = f"{self.base_url}{path}"
+        model = body.get("model", "")
+        reserved = estimate_tokens(body)
+        attempt = 0
+        while True:
+            # a retry still waits out pauses and debt, but the prompt is already reserved
+            waited = self.requests_bucket.acquire(1) + self.tokens_bucket.acquire(reserved if attempt == 0 else 0)
+            self._count(requests=1, throttled_seconds=waited)
+            if waited:
+                LLM_THROTTLED.inc(waited)
+            start = time.perf_counter()
+            try:
+                r = self.session.post(url, json=body, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                LLM_SECONDS.observe(time.perf_counter() - start, model=model, status="error")
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, None)
+                LLM_RETRIES.inc(reason=type(e).__name__)
+                log.warning("llm_retry", reason=type(e).__name__, attempt=attempt + 1, max_retries=self.max_retries, delay=round(delay, 1))
+            else:
+                LLM_SECONDS.observe(time.perf_counter() - start, model=model, status=r.status_code)
+                self._observe_limits(r.headers)
+                if r.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    r.raise_for_status()
+                    return r
+                hinted = retry_after(r.headers, rate_limited=r.status_code == 429)
+                delay = self._backoff(attempt, hinted)
+                if r.status_code == 429:
+                    self._count(rate_limited=1)
+                    self.requests_bucket.pause(delay)
+                    self.tokens_bucket.pause(delay)
+                r.close()
+                LLM_RETRIES.inc(reason=r.status_code)
+                log.warning("llm_retry", reason=f"HTTP {r.status_code}", attempt=attempt + 1, max_retries=self.max_retries, delay=round(delay, 1))
+            self._count(retries=1)
+            attempt += 1
+            time.sleep(delay)
+
+    def chat(self, body: dict) -> dict:
+        """Non-streaming chat completion; reconciles the TPM reservation with the reported usage."""
+        r = self.post("/chat/completions", body)
+        data = r.json()
+        self.record_usage(body, data.get("usage"))
+        return data
+
+    def chat_stream(self, body: dict) -> requests.Response:
+        """
+        Streaming chat completion; the caller iterates (and closes) the response.
+        Usage is requested as a final chunk; pass it to record_usage().
+        """
+        return self.post("/chat/completions",
+                         {**body, "stream": True, "stream_options": {"include_usage": True}}, stream=True)
+
+    def record_usage(self, body: dict, usage: dict | None) -> None:
+        """Counts reported token usage and reconciles the TPM reservation made for `body`."""
+        if not usage:
+            return
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        self._count(prompt_tokens=prompt, completion_tokens=completion)
+        model = body.get("model", "")
+        LLM_TOKENS.inc(prompt, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion, model=model, kind="completion")
+        self.tokens_bucket.settle(usage.get("total_tokens", prompt + completion) - estimate_tokens(body))
+
+
+LLM = LLMClient()
@@ -0,0 +1,196 @@
+# logs.py
+"""
+Structured logging with structlog, written by a background thread.
+
+On the calling thread an event is only level-filtered, stamped with the bound
+context (request_id, job_id, ...) and put on a bounded queue (LOG_QUEUE_SIZE).
+Rendering (LOG_FORMAT json|console) and the write to stdout happen on the
+writer thread, so a slow sink never blocks a request. When the queue is full
+the record is dropped and counted instead of waited for. Per-row events go
+through sampled(), so only LOG_ROW_SAMPLE_RATE of them are built at all.
+
+The cost on the calling side is exported as insightview_log_enqueue_seconds_total
+next to insightview_log_records_total{outcome} and insightview_log_queue_depth.
+
+    from logs import get_logger
+    log = get_logger(__name__)
+    log.info("summary_saved", summary_type="KRI", as_of="2025-05-31")
+"""
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+import structlog
+from dotenv import load_dotenv
+from metrics import LOG_ENQUEUE_SECONDS, LOG_QUEUE_DEPTH, LOG_RECORDS, REGISTRY
+
+load_dotenv()
+
+LOG_LEVEL           = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT          = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE      = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_ROW_SAMPLE_RATE = float(os.getenv("LOG_ROW_SAMPLE_RATE", "0.01"))
+
+_STARTED = "_enqueue_started"
+
+
+def _start_clock(logger, method, event_dict):
+    event_dict[_STARTED] = time.perf_counter()
+    return event_dict
+
+
+def _capture_exc_info(logger, method, event_dict):
+    # the traceback is rendered on the writer thread, where sys.exc_info() is empty
+    if event_dict.get("exc_info") is True:
+        event_dict["exc_info"] = sys.exc_info()
+    return event_dict
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer without formatting them and never waits on a full queue."""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        started = record.msg.pop(_STARTED, None) if isinstance(record.msg, dict) else None
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS.inc(outcome="queued")
+        except queue.Full:
+            LOG_RECORDS.inc(outcome="dropped")
+        if started is not None:
+            LOG_ENQUEUE_SECONDS.inc(time.perf_counter() - started)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # a full queue must still be drained on shutdown, so wait for room here
+        self.queue.put(self._sentinel, timeout=5)
+
+
+def _renderer():
+    if LOG_FORMAT == "console":
+        return [structlog.dev.ConsoleRenderer(colors=False)]
+    return [structlog.processors.format_exc_info, structlog.processors.JSONRenderer(default=str)]
+
+
+_listener: _QueueListener | None = None
+_lock = threading.Lock()
+
+
+def configure() -> None:
+    """Routes structlog and stdlib logging through the queue; safe to call more than once."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        level = logging.getLevelName(LOG_LEVEL)
+        level = level if isinstance(level, int) else logging.INFO
+        records = queue.Queue(LOG_QUEUE_SIZE)
+
+        sink = logging.StreamHandler(sys.stdout)
+        sink.setFormatter(structlog.stdlib.ProcessorFormatter(
+            processors=[structlog.stdlib.ProcessorFormatter.remove_processors_meta, *_renderer()],
+            # werkzeug and other stdlib loggers
+            foreign_pre_chain=[
+                structlog.stdlib.add_log_level,
+                structlog.stdlib.add_logger_name,
+                structlog.processors.TimeStamper(fmt="iso", utc=True),
+            ],
+        ))
+        root = logging.getLogger()
+        root.handlers[:] = [_QueueHandler(records)]
+        root.setLevel(level)
+
+        structlog.configure(
+            processors=[
+                _start_clock,
+                structlog.contextvars.merge_contextvars,
+                structlog.stdlib.add_log_level,
+                structlog.stdlib.add_logger_name,
+                _capture_exc_info,
+                structlog.processors.TimeStamper(fmt="iso", utc=True),
+                structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+            ],
+            wrapper_class=structlog.make_filtering_bound_logger(level),
+            logger_factory=structlog.stdlib.LoggerFactory(),
+            cache_logger_on_first_use=True,
+        )
+
+        _listener = _QueueListener(records, sink)
+        _listener.start()
+        REGISTRY.register_collector(lambda: LOG_QUEUE_DEPTH.set(records.qsize()))
+        atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """Writes out whatever is still queued and stops the writer thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name: str | None = None):
+    configure()
+    return structlog.get_logger(name)
+
+
+class _Muted:
+    def _drop(self, *args, **kwargs):
+        return None
+
+    def __getattr__(self, name):
+        return self._drop
+
+
+_MUTED = _Muted()
+
+
+def sampled(logger, rate: float = LOG_ROW_SAMPLE_RATE):
+    """
+    For per-row events: returns `logger` for about `rate` of the calls (the
+    event then carries sample_rate) and a no-op logger otherwise.
+    """
+    if rate >= 1:
+        return logger
+    if random.random() < rate:
+        return logger.bind(sample_rate=rate)
+    LOG_RECORDS.inc(outcome="sampled_out")
+    return _MUTED
+
+
+def bind_request(request_id: str | None = None) -> str:
+    """Starts a fresh log context for a request; returns its correlation ID."""
+    if not request_id or len(request_id) > 128 or not request_id.isprintable():
+        request_id = uuid.uuid4().hex[:16]
+    structlog.contextvars.clear_contextvars()
+    structlog.contextvars.bind_contextvars(request_id=request_id)
+    return request_id
+
+
+def bind(**values) -> None:
+    """Adds values (e.g. job_id) to every event logged from the current context."""
+    structlog.contextvars.bind_contextvars(**values)
+
+
+def clear_request() -> None:
+    structlog.contextvars.clear_contextvars()
+
+
+def carry(fn):
+    """
+    Wraps `fn` so it runs with the caller's log context (request_id, job_id)
+    when a thread pool executes it.
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
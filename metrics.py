@@ -0,0 +1,238 @@
+# metrics.py
+"""
+Minimal in-process Prometheus instrumentation: counters, gauges and
+histograms with labels, rendered in the text exposition format (0.0.4) by
+render(). Updates are a dict lookup plus a lock-protected add, cheap enough to
+leave on in production. Gauges that are expensive or live elsewhere (pool
+stats, cache size) are read at scrape time through register_collector().
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds: 5ms .. 5min, covers DB statements as well as multi-chunk LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def lines(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def lines(self) -> list[str]:
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._values.items()]
+        out = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip((*self.buckets, math.inf), counts):
+                cumulative += c
+                le = 'le="' + _fmt(bound) + '"'
+                out.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, doc: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, doc, labels))
+
+    def gauge(self, name: str, doc: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, doc, labels))
+
+    def histogram(self, name: str, doc: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, doc, labels, buckets))
+
+    def register_collector(self, fn) -> None:
+        """`fn()` runs at scrape time (e.g. to set gauges); errors are skipped."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in list(self._collectors):
+            try:
+                fn()
+            except Exception as e:
+                from logs import get_logger  # logs imports this module
+                get_logger(__name__).warning("metrics_collector_failed", collector=getattr(fn, "__name__", str(fn)), error=str(e))
+        out = []
+        for metric in list(self._metrics.values()):
+            lines = metric.lines()
+            if lines:
+                out.extend(metric.header())
+                out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "insightview_stage_seconds", "Wall time of a pipeline stage.", ("pipeline", "stage"))
+STAGE_ROWS = REGISTRY.counter(
+    "insightview_stage_rows_total", "Rows handled by a pipeline stage (rate() gives rows/s).", ("pipeline", "stage"))
+HTTP_SECONDS = REGISTRY.histogram(
+    "insightview_http_request_seconds", "HTTP request latency.", ("method", "endpoint", "status"))
+DB_SECONDS = REGISTRY.histogram(
+    "insightview_db_statement_seconds", "SQL statement execution time.", ("operation",))
+DB_ROWS = REGISTRY.counter(
+    "insightview_db_rows_total", "Rows returned by run_query/iter_query/run_query_columns.")
+DB_POOL = REGISTRY.gauge(
+    "insightview_db_pool_connections", "SQLAlchemy pool connections by state.", ("state",))
+LLM_SECONDS = REGISTRY.histogram(
+    "insightview_llm_request_seconds", "Chat completion latency per HTTP attempt.", ("model", "status"))
+LLM_TOKENS = REGISTRY.counter(
+    "insightview_llm_tokens_total", "Tokens reported in the completion usage block.", ("model", "kind"))
+LLM_RETRIES = REGISTRY.counter(
+    "insightview_llm_retries_total", "Retried chat completion attempts.", ("reason",))
+LLM_THROTTLED = REGISTRY.counter(
+    "insightview_llm_throttled_seconds_total", "Time spent waiting on the client-side rate limiter.")
+CACHE_LOOKUPS = REGISTRY.counter(
+    "insightview_llm_cache_lookups_total", "Recommendation cache lookups.", ("result",))
+CACHE_SIZE = REGISTRY.gauge(
+    "insightview_llm_cache", "Recommendation cache size.", ("measure",))
+EMAILS = REGISTRY.counter(
+    "insightview_emails_total", "Outbox delivery attempts by result.", ("result",))
+OUTBOX_MESSAGES = REGISTRY.gauge(
+    "insightview_email_outbox_messages", "Messages in the email outbox by status.", ("status",))
+SMTP_SECONDS = REGISTRY.histogram(
+    "insightview_smtp_send_seconds", "Time to hand one message to the SMTP server.")
+JOBS_TOTAL = REGISTRY.counter(
+    "insightview_jobs_total", "Finished background jobs.", ("kind", "status"))
+JOBS_RUNNING = REGISTRY.gauge(
+    "insightview_jobs_running", "Background jobs currently executing.", ("kind",))
+LOG_RECORDS = REGISTRY.counter(
+    "insightview_log_records_total", "Log records by outcome (queued, dropped, sampled_out).", ("outcome",))
+LOG_ENQUEUE_SECONDS = REGISTRY.counter(
+    "insightview_log_enqueue_seconds_total", "Time calling threads spent handing log records to the writer.")
+LOG_QUEUE_DEPTH = REGISTRY.gauge(
+    "insightview_log_queue_depth", "Log records waiting for the background writer.")
+
+
+def instrument_engine(engine) -> None:
+    """Times every statement on `engine` and reports its pool at scrape time."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_metrics_start")
+        if starts:
+            op = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+            DB_SECONDS.observe(time.perf_counter() - starts.pop(), operation=op)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("_metrics_start"):
+            conn.info["_metrics_start"].pop()
+
+    def _pool_stats():
+        pool = engine.pool
+        for state, fn in (("size", "size"), ("checked_out", "checkedout"),
+                          ("checked_in", "checkedin"), ("overflow", "overflow")):
+            if hasattr(pool, fn):
+                DB_POOL.set(getattr(pool, fn)(), state=state)
+
+    REGISTRY.register_collector(_pool_stats)
@@ -0,0 +1,310 @@
+# outbox.py
+import json
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import Boolean, Column, Date, DateTime, Index, Integer, MetaData, String, Table, Text, and_, insert, select, text, update
+from helper import ENGINE, build_summary_message
+from metrics import EMAILS, OUTBOX_MESSAGES, REGISTRY, SMTP_SECONDS
+from logs import get_logger
+load_dotenv()
+
+SMTP_SERVER   = os.getenv("SMTP_SERVER", "smtp.office365.com")
+SMTP_PORT     = int(os.getenv("SMTP_PORT", "587"))
+SMTP_EMAIL    = os.getenv("SMTP_EMAIL")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1").lower() not in ("0", "false", "no")
+SMTP_TIMEOUT  = float(os.getenv("SMTP_TIMEOUT", "60"))
+
+OUTBOX_POLL_SECONDS   = float(os.getenv("OUTBOX_POLL_SECONDS", "30"))
+OUTBOX_BATCH_SIZE     = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_MAX_ATTEMPTS   = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "30"))
+OUTBOX_BACKOFF_MAX    = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+OUTBOX_IDLE_SECONDS   = float(os.getenv("OUTBOX_IDLE_SECONDS", "120"))
+
+metadata = MetaData()
+
+EMAIL_OUTBOX = Table(
+    "t_insightView_Email_Outbox", metadata,
+    Column("Id", Integer, primary_key=True, autoincrement=True),
+    Column("Subject", String(400), nullable=False),
+    Column("Body", Text, nullable=False),
+    Column("Recipients", Text, nullable=False),  # JSON list
+    Column("IsHtml", Boolean, nullable=False, default=True),
+    Column("SummaryType", String(50)),
+    Column("AsOfDate", Date),
+    Column("Status", String(16), nullable=False, default="pending"),  # pending | sending | sent | failed
+    Column("Attempts", Integer, nullable=False, default=0),
+    Column("NextAttemptAt", DateTime, nullable=False),
+    Column("LastError", String(1000)),
+    Column("CreatedAt", DateTime, nullable=False),
+    Column("SentAt", DateTime),
+    schema="dbo",
+)
+Index("IX_Email_Outbox_Status_Next", EMAIL_OUTBOX.c.Status, EMAIL_OUTBOX.c.NextAttemptAt)
+
+_ready = False
+_ready_lock = threading.Lock()
+
+log = get_logger(__name__)
+
+
+def ensure_table() -> None:
+    global _ready
+    if not _ready:
+        with _ready_lock:
+            if not _ready:
+                metadata.create_all(ENGINE, tables=[EMAIL_OUTBOX], checkfirst=True)
+                _ready = True
+
+
+def enqueue_email(subject: str, body: str, recipients: list[str], is_html: bool = True,
+                  summary_type: str | None = None, as_of_date=None) -> int:
+    """
+    Stores a message for the dispatcher and returns its outbox Id. With a
+    summary_type/as_of_date, delivery also sets IsEmailed = 1 on the summary.
+    """
+    ensure_table()
+    now = datetime.now()
+    with ENGINE.begin() as conn:
+        res = conn.execute(insert(EMAIL_OUTBOX), {
+            "Subject": subject,
+            "Body": body,
+            "Recipients": json.dumps(list(recipients)),
+            "IsHtml": is_html,
+            "SummaryType": summary_type,
+            "AsOfDate": datetime.fromisoformat(str(as_of_date)[:10]).date() if as_of_date else None,
+            "Status": "pending",
+            "Attempts": 0,
+            "NextAttemptAt": now,
+            "CreatedAt": now,
+        })
+        outbox_id = res.inserted_primary_key[0]
+    log.info("email_queued", outbox_id=outbox_id, subject=subject, recipients=len(recipients))
+    DISPATCHER.wake()
+    return outbox_id
+
+
+def outbox_stats() -> dict:
+    ensure_table()
+    with ENGINE.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT Status, COUNT(*) AS n FROM dbo.t_insightView_Email_Outbox GROUP BY Status;"
+        )).fetchall()
+    return {status: n for status, n in rows}
+
+
+def _outbox_gauges() -> None:
+    for status, n in outbox_stats().items():
+        OUTBOX_MESSAGES.set(n, status=status)
+
+
+REGISTRY.register_collector(_outbox_gauges)
+
+
+class SmtpConnection:
+    """
+    One authenticated SMTP session, opened lazily and reused across messages.
+    ensure() probes a session that sat unused for 10s+ with NOOP and reconnects
+    when the server has dropped it; the dispatcher closes it after an idle period.
+    """
+
+    def __init__(self, host: str = SMTP_SERVER, port: int = SMTP_PORT, user: str | None = SMTP_EMAIL,
+                 password: str | None = SMTP_PASSWORD, starttls: bool = SMTP_STARTTLS,
+                 timeout: float = SMTP_TIMEOUT):
+        self.host, self.port = host, port
+        self.user, self.password = user, password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp: smtplib.SMTP | None = None
+        self._used_at = 0.0
+        self.connects = 0
+
+    def ensure(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            if time.monotonic() - self._used_at < 10:
+                return self._smtp
+            try:
+                if self._smtp.noop()[0] == 250:
+                    self._used_at = time.monotonic()
+                    return self._smtp
+            except OSError:  # includes SMTPException
+                pass
+            self.close()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._used_at = time.monotonic()
+        self.connects += 1
+        return smtp
+
+    def send(self, msg) -> None:
+        self.ensure().send_message(msg)
+        self._used_at = time.monotonic()
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+
+class EmailDispatcher:
+    """
+    Background sender for t_insightView_Email_Outbox.
+
+    Due messages are claimed in batches of `batch_size` (pending → sending,
+    one conditional UPDATE per row so two dispatchers never send the same
+    message) and delivered over one kept-alive SMTP session. A delivered
+    summary email sets t_insightView_Email_Summaries.IsEmailed = 1. Failures
+    are retried with exponential backoff until `max_attempts`, then left as
+    'failed'. The loop wakes on enqueue_email() or every `poll_seconds`.
+    """
+
+    def __init__(self, connection: SmtpConnection | None = None, poll_seconds: float = OUTBOX_POLL_SECONDS,
+                 batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff_seconds: float = OUTBOX_BACKOFF_SECONDS, backoff_max: float = OUTBOX_BACKOFF_MAX,
+                 idle_seconds: float = OUTBOX_IDLE_SECONDS):
+        self.connection = connection or SmtpConnection()
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max = backoff_max
+        self.idle_seconds = idle_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._last_send = 0.0
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _claim(self) -> list[dict]:
+        now = datetime.now()
+        o = EMAIL_OUTBOX.c
+        with ENGINE.begin() as conn:
+            # 'sending' rows older than an hour belong to a dispatcher that died mid-batch
+            conn.execute(update(EMAIL_OUTBOX)
+                         .where(and_(o.Status == "sending", o.NextAttemptAt <= now - timedelta(hours=1)))
+                         .values(Status="pending"))
+            candidates = conn.execute(
+                select(EMAIL_OUTBOX)
+                .where(and_(o.Status == "pending", o.NextAttemptAt <= now))
+                .order_by(o.NextAttemptAt, o.Id)
+                .limit(self.batch_size)
+            ).mappings().all()
+        claimed = []
+        for row in candidates:
+            with ENGINE.begin() as conn:
+                res = conn.execute(update(EMAIL_OUTBOX)
+                                   .where(and_(o.Id == row["Id"], o.Status == "pending"))
+                                   .values(Status="sending", NextAttemptAt=now))
+            if res.rowcount == 1:
+                claimed.append(dict(row))
+        return claimed
+
+    def _delivered(self, row: dict) -> None:
+        o = EMAIL_OUTBOX.c
+        with ENGINE.begin() as conn:
+            conn.execute(update(EMAIL_OUTBOX).where(o.Id == row["Id"])
+                         .values(Status="sent", SentAt=datetime.now(), Attempts=row["Attempts"] + 1, LastError=None))
+            if row["SummaryType"] and row["AsOfDate"]:
+                conn.execute(text("""
+                    UPDATE dbo.t_insightView_Email_Summaries
+                    SET IsEmailed = 1
+                    WHERE SummaryType = :summaryType AND AsOfDate = :asOfDate;
+                """), {"summaryType": row["SummaryType"], "asOfDate": row["AsOfDate"]})
+        EMAILS.inc(result="sent")
+        log.info("email_sent", outbox_id=row["Id"], recipients=len(json.loads(row["Recipients"])))
+
+    def _failed(self, row: dict, error: Exception) -> None:
+        attempts = row["Attempts"] + 1
+        final = attempts >= self.max_attempts
+        delay = min(self.backoff_max, self.backoff_seconds * 2 ** (attempts - 1))
+        o = EMAIL_OUTBOX.c
+        with ENGINE.begin() as conn:
+            conn.execute(update(EMAIL_OUTBOX).where(o.Id == row["Id"]).values(
+                Status="failed" if final else "pending",
+                Attempts=attempts,
+                NextAttemptAt=datetime.now() + timedelta(seconds=delay),
+                LastError=str(error)[:1000],
+            ))
+        EMAILS.inc(result="failed" if final else "retry")
+        if final:
+            log.error("email_failed", outbox_id=row["Id"], attempts=attempts, error=error)
+        else:
+            log.warning("email_retry", outbox_id=row["Id"], attempts=attempts, error=error, delay=round(delay))
+
+    def dispatch_once(self) -> int:
+        """Sends every due message (batch by batch); returns the number delivered."""
+        ensure_table()
+        sent = 0
+        while True:
+            batch = self._claim()
+            if not batch:
+                return sent
+            for i, row in enumerate(batch):
+                msg = build_summary_message(row["Subject"], row["Body"], json.loads(row["Recipients"]),
+                                            self.connection.user, bool(row["IsHtml"]))
+                try:
+                    self.connection.ensure()
+                except Exception as e:
+                    # cannot connect/log in: count it against this message, put the rest back
+                    self._failed(row, e)
+                    for rest in batch[i + 1:]:
+                        self._release(rest)
+                    return sent
+                try:
+                    with SMTP_SECONDS.time():
+                        try:
+                            self.connection.send(msg)
+                        except smtplib.SMTPServerDisconnected:
+                            self.connection.close()
+                            self.connection.send(msg)
+                except (smtplib.SMTPException, OSError) as e:
+                    self._failed(row, e)
+                    continue
+                self._delivered(row)
+                self._last_send = time.monotonic()
+                sent += 1
+
+    def _release(self, row: dict) -> None:
+        o = EMAIL_OUTBOX.c
+        with ENGINE.begin() as conn:
+            conn.execute(update(EMAIL_OUTBOX).where(o.Id == row["Id"]).values(Status="pending"))
+
+    def run(self) -> None:
+        log.info("email_dispatcher_started", host=self.connection.host, port=self.connection.port)
+        while not self._stop.is_set():
+            try:
+                self.dispatch_once()
+            except Exception as e:
+                log.exception("email_dispatch_failed", error=str(e))
+            if self._last_send and time.monotonic() - self._last_send > self.idle_seconds:
+                self.connection.close()
+                self._last_send = 0.0
+            self._wake.wait(min(self.poll_seconds, self.idle_seconds))
+            self._wake.clear()
+        self.connection.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+
+DISPATCHER = EmailDispatcher()
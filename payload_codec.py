@@ -0,0 +1,107 @@
+# payload_codec.py
+import json
+from llm_client import count_tokens
+from logs import get_logger
+
+# Fields the service copies back from the input row; the model does not need to repeat them.
+CARRIED_FIELDS = ("relatedEntityId", "metricName", "metricValue", "observedAt", "riskType")
+
+COMPACT_FORMAT_RULES = """
+Compact input/output format (overrides the carry-over rules above):
+- The user message is {"source", "window", "columns", "constants", "rows"}.
+  "columns" names the positions of every row array; position 0 is "row", the row index.
+  "constants" holds fields that have the same value for every row. Fields missing from both are null.
+- For every row, output one object with "row" (the row index, unchanged) and the generated fields only:
+  recommendationText, actionType, confidence, referenceTimestamp, metadata, postMitigationValue.
+- Do not repeat relatedEntityId, metricName, metricValue, observedAt, riskType or source; they are filled in from the row.
+- Output {"recommendations": [...]} with exactly one object per input row.
+"""
+
+log = get_logger(__name__)
+
+
+def _compact_value(v):
+    # the model only reads these; exact values are restored from the row on the way back
+    if isinstance(v, float):
+        return float(f"{v:.6g}")
+    return v
+
+
+def encode_rows(source: str, window: str, rows: list[dict]) -> dict:
+    """
+    Columnar form of {"source", "window", "rows": [dict, ...]}: the column names
+    are sent once and every row becomes a positional array led by its index.
+    Columns that are null on every row are dropped, columns with a single
+    value move to "constants", and floats are trimmed to 6 significant digits.
+    """
+    columns: list[str] = []
+    for row in rows:
+        for k in row:
+            if k not in columns:
+                columns.append(k)
+
+    varying, constants = [], {}
+    for col in columns:
+        values = [row.get(col) for row in rows]
+        first = values[0]
+        if all(v is None for v in values):
+            continue
+        if len(rows) > 1 and all(v == first and type(v) is type(first) for v in values):
+            constants[col] = first
+        else:
+            varying.append(col)
+
+    return {
+        "source": source,
+        "window": window,
+        "columns": ["row", *varying],
+        "constants": {k: _compact_value(v) for k, v in constants.items()},
+        "rows": [[i, *(_compact_value(row.get(col)) for col in varying)] for i, row in enumerate(rows)],
+    }
+
+
+def decode_rows(payload: dict) -> list[dict]:
+    """Inverse of encode_rows (dropped all-null columns come back as absent keys)."""
+    cols = payload["columns"][1:]
+    return [{**payload.get("constants", {}), **dict(zip(cols, r[1:]))} for r in payload["rows"]]
+
+
+def expand_recommendation(rec: dict, rows: list[dict], source: str) -> dict:
+    """
+    Rebuilds a full recommendation from a compact answer: the carried fields
+    come from rows[rec["row"]]. Answers without a usable row index are returned
+    unchanged, so the usual relatedEntityId matching still applies to them.
+    """
+    if not isinstance(rec, dict):
+        return rec
+    idx = rec.get("row")
+    if isinstance(idx, str) and idx.isdigit():
+        idx = int(idx)
+    if not isinstance(idx, int) or isinstance(idx, bool) or not 0 <= idx < len(rows):
+        return rec
+    row = rows[idx]
+    out = {k: v for k, v in rec.items() if k != "row"}
+    out["source"] = out.get("source") or source
+    for field in CARRIED_FIELDS:
+        out[field] = row.get(field)
+    return out
+
+
+def payload_savings(source: str, window: str, rows: list[dict], compact: dict) -> tuple[int, int]:
+    """Estimated prompt tokens of the plain payload vs the compact one."""
+    plain = json.dumps({"source": source, "window": window, "rows": rows}, ensure_ascii=False, default=str)
+    return count_tokens(plain), count_tokens(dumps_compact(compact))
+
+
+def encode_chunk(source: str, window: str, rows: list[dict]) -> dict:
+    """encode_rows plus a log line with the before/after prompt token estimate."""
+    compact = encode_rows(source, window, rows)
+    before, after = payload_savings(source, window, rows, compact)
+    saved = 100 * (before - after) / before if before else 0
+    log.info("gpt_payload", rows=len(rows), tokens_before=before, tokens_after=after,
+             saved_pct=round(saved), tokens_per_row=round(after / max(len(rows), 1)))
+    return compact
+
+
+def dumps_compact(payload: dict) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str)
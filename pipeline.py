@@ -0,0 +1,460 @@
+# pipeline.py
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from Schema import Recommendation
+from kri_snapshot import SNAPSHOT
+from kri_stage import STAGE
+from helper import (GPT_CHUNK_SIZE, GPT_MAX_WORKERS, PUBLISHED_DASHBOARDS, RECOMMENDATION_BATCH_SIZE,
+                    filter_unprocessed,
+                    get_published_address, get_published_addresses, insert_recommendations, call_gpt,
+                    generate_recommendations, stream_recommendations, insert_summary, run_query,
+                    match_recommendations,
+                    summary_prompt, domain_summary_prompt, TREND_INPUT_RULES)
+from outbox import enqueue_email
+from rules import apply_scores, triage
+from reuse import REUSE
+from journal import JOURNAL
+from metrics import STAGE_ROWS, STAGE_SECONDS
+from logs import carry, get_logger
+
+# domains summarised by run_summaries() / the monthly run
+SUMMARY_DOMAINS     = [d.strip() for d in os.getenv("SUMMARY_DOMAINS", "KRI").split(",") if d.strip()]
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+# KRI summary input: month-over-month aggregates over this many months instead of raw rows
+SUMMARY_TRENDS       = os.getenv("SUMMARY_TRENDS", "1") == "1"
+SUMMARY_TREND_MONTHS = int(os.getenv("SUMMARY_TREND_MONTHS", "6"))
+
+SUMMARY_RECIPIENTS = [
+    "g.agyeabour@awcghana.com",
+    "m.williams@awcghana.com",
+    "patrick@awcghana.com",
+    "s.namoafo@awcghana.com",
+    "b.oagyemang@awcghana.com",
+]
+
+log = get_logger(__name__)
+
+
+@contextmanager
+def stage(timings: dict | None, name: str, pipeline: str = "run"):
+    """
+    Records the wall time of a pipeline stage (in seconds) into `timings` and
+    the insightview_stage_seconds histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, pipeline=pipeline, stage=name)
+        if timings is not None:
+            timings[name] = round(elapsed, 4)
+
+
+def to_record(r: Recommendation, rows: list[dict]) -> dict:
+    return {
+        "source": r.source,
+        "relatedEntityId": r.relatedEntityId,
+        "metricName": r.metricName,
+        "metricValue": r.metricValue,
+        "recommendationText": r.recommendationText,
+        "actionType": r.actionType,
+        "confidence": r.confidence,
+        "riskType": r.riskType,
+        "referenceTimestamp": r.referenceTimestamp,
+        "observedAt": getattr(r, "observedAt", None) \
+      or next((row["observedAt"] for row in rows if row["relatedEntityId"] == r.relatedEntityId), None),
+
+        "metadata": r.metadata or {},
+        "postMitigationValue": getattr(r, "postMitigationValue", None)
+    }
+
+
+def pending_rows(full: bool = False) -> tuple[list[dict], list[dict]]:
+    """
+    Returns (window_rows, rows_to_generate). Only rows without a recommendation
+    for the same (KRI, As of Date, value) are generated unless `full` is set.
+    """
+    window_rows = SNAPSHOT.window_rows()
+    rows = window_rows if full else filter_unprocessed(window_rows)
+    return window_rows, rows
+
+
+def run_recommendations(full: bool = False, chunk_size: int = GPT_CHUNK_SIZE,
+                        max_workers: int = GPT_MAX_WORKERS, timings: dict | None = None) -> dict:
+    """
+    Generates, validates and stores recommendations for the KRI window.
+    Rows the rule engine can settle (inside all limits) get a NoAction
+    recommendation without a model call, rows close to an earlier
+    recommendation reuse its text, cached rows are answered from disk;
+    the rest fan out to the chat endpoint in parallel chunks (chunk_size=0
+    sends all misses in a single request).
+    Every finished chunk is journaled, so a run that dies before the insert
+    resumes on the next call for the same KRI month without repeating them.
+    """
+    with stage(timings, "snapshot"):
+        window_rows, rows = pending_rows(full)
+    STAGE_ROWS.inc(len(window_rows), pipeline="run", stage="snapshot")
+    run_id, resumed = JOURNAL.open(f"recommendations:{SNAPSHOT.refresh()}:{'full' if full else 'delta'}")
+    chunk_steps = JOURNAL.steps(run_id, "chunk:")
+    with stage(timings, "rules"):
+        resolved, llm_rows, scores = triage(rows)
+    STAGE_ROWS.inc(len(rows), pipeline="run", stage="rules")
+    with stage(timings, "reuse"):
+        reused, llm_rows = REUSE.match(llm_rows, scores)
+    STAGE_ROWS.inc(len(reused), pipeline="run", stage="reuse")
+    with stage(timings, "llm"):
+        journaled, _ = match_recommendations(llm_rows, [rec for recs in chunk_steps.values() for rec in recs])
+        llm_rows = [row for i, row in enumerate(llm_rows) if i not in journaled]
+        step_no = itertools.count(len(chunk_steps))
+        recs = generate_recommendations(
+            llm_rows, source="KRI", window="year_2025", chunk_size=chunk_size, max_workers=max_workers,
+            on_chunk=lambda chunk: JOURNAL.record(run_id, f"chunk:{next(step_no)}", chunk))
+        recs = resolved + [apply_scores(rec, scores) for rec in reused + list(journaled.values()) + recs]
+    STAGE_ROWS.inc(len(llm_rows), pipeline="run", stage="llm")
+
+    validated, errors = [], []
+    with stage(timings, "validate"):
+        for it in recs:
+            try:
+                validated.append(to_record(Recommendation(**it), rows))
+            except Exception as e:
+                errors.append({"item": it, "error": str(e)})
+    STAGE_ROWS.inc(len(recs), pipeline="run", stage="validate")
+    with stage(timings, "insert"):
+        count = insert_recommendations(validated) if validated else 0
+    STAGE_ROWS.inc(count, pipeline="run", stage="insert")
+    JOURNAL.finish(run_id)
+    return {"runId": run_id, "resumed": resumed, "window": len(window_rows), "skipped": len(window_rows) - len(rows),
+            "ruleResolved": len(resolved), "reused": len(reused), "fromJournal": len(journaled),
+            "generated": len(recs), "inserted": count, "errors": errors, "recommendations": validated}
+
+
+def stream_run(full: bool = False, chunk_size: int = GPT_CHUNK_SIZE, max_workers: int = GPT_MAX_WORKERS):
+    """
+    Event stream for /gpt/run?stream=1.
+    Every recommendation is validated and emitted as soon as it is complete;
+    inserts are batched (RECOMMENDATION_BATCH_SIZE rows, or whatever is
+    buffered when an LLM chunk finishes) and reported as "inserted" events.
+    The buffer is also flushed when the stream ends or the client goes away,
+    so a cut-off completion still keeps the rows that were finished.
+    """
+    window_rows, rows = pending_rows(full)
+    resolved, llm_rows, scores = triage(rows)
+    reused, llm_rows = REUSE.match(llm_rows, scores)
+    yield {"event": "start", "window": len(window_rows), "skipped": len(window_rows) - len(rows),
+           "ruleResolved": len(resolved), "reused": len(reused), "pending": len(llm_rows)}
+    generated = inserted = failed = 0
+    batch: list[dict] = []
+
+    def events():
+        for rec in resolved:
+            yield "recommendation", rec
+        for rec in reused:
+            yield "recommendation", apply_scores(rec, scores)
+        yield "chunk_done", None
+        for kind, item in stream_recommendations(llm_rows, source="KRI", window="year_2025",
+                                                 chunk_size=chunk_size, max_workers=max_workers):
+            yield kind, apply_scores(item, scores) if kind == "recommendation" else item
+
+    def flush() -> dict | None:
+        nonlocal inserted, failed
+        if not batch:
+            return None
+        recs = batch[:]
+        batch.clear()
+        try:
+            n = insert_recommendations(recs)
+        except Exception as e:
+            failed += len(recs)
+            return {"event": "error", "rows": len(recs), "error": str(e)}
+        inserted += n
+        return {"event": "inserted", "rows": n, "total": inserted}
+
+    try:
+        for kind, item in events():
+            if kind == "chunk_done":
+                if (event := flush()):
+                    yield event
+                continue
+            if kind == "error":
+                yield {"event": "error", "error": item}
+                continue
+            generated += 1
+            try:
+                rec = to_record(Recommendation(**item), rows)
+            except Exception as e:
+                failed += 1
+                yield {"event": "error", "item": item, "error": str(e)}
+                continue
+            batch.append(rec)
+            yield {"event": "recommendation", "recommendation": rec}
+            if len(batch) >= RECOMMENDATION_BATCH_SIZE and (event := flush()):
+                yield event
+        if (event := flush()):
+            yield event
+    finally:
+        # client disconnected mid-stream: keep what was already validated
+        flush()
+        STAGE_ROWS.inc(inserted, pipeline="stream", stage="insert")
+    yield {"event": "done", "generated": generated, "inserted": inserted, "errors": failed}
+
+
+def summary_email_body(summary_text: str, link_info: tuple[str, str] | None) -> str:
+    email_body = summary_text
+    if link_info:
+        dashboard_name, dashboard_link = link_info
+        email_body += f"""
+            <br><br>
+            <div style="text-align:center; margin-top:25px;">
+                <a href="{dashboard_link}"
+                style="background-color:#0078D4; color:#fff; padding:12px 24px;
+                        text-decoration:none; border-radius:6px; font-weight:bold;
+                        font-family:Segoe UI, sans-serif;">
+                    🔗 View {dashboard_name}
+                </a>
+            </div>
+            <p style="text-align:center; font-size:12px; color:#555; margin-top:10px;">
+                If the button above doesn’t work, copy and paste this link:<br>
+                <a href="{dashboard_link}" style="color:#0078D4;">{dashboard_link}</a>
+            </p>
+        """
+    else:
+            email_body += """
+            <br><br>
+            <p style="text-align:center; color:#999;">
+                Dashboard link currently unavailable.
+            </p>
+        """
+    return email_body
+
+
+def _round(row: dict) -> dict:
+    return {k: round(v, 4) if isinstance(v, float) else v for k, v in row.items() if v is not None}
+
+
+def kri_trend_input(months: int = SUMMARY_TREND_MONTHS) -> dict:
+    """
+    KRI summary input built from SQL window aggregates (KriStage.trend_rows):
+    size grows with the number of flagged KRIs and risk types, not with history.
+    """
+    watermark = SNAPSHOT.refresh()
+    if not watermark:
+        return {}
+    kris, risk_types = STAGE.trend_rows(watermark, months)
+    now = {"breached": sum(r["breached"] or 0 for r in risk_types),
+           "warning": sum(r["warning"] or 0 for r in risk_types)}
+    prev = {"breached": sum(r["prevBreached"] or 0 for r in risk_types),
+            "warning": sum(r["prevWarning"] or 0 for r in risk_types)}
+    has_prev = any(r["prevBreached"] is not None for r in risk_types)
+    direction = ("worsening" if now["breached"] > prev["breached"] else
+                 "improving" if now["breached"] < prev["breached"] else "stable") if has_prev else "unknown"
+    return {
+        "window": f"last_{months}_months",
+        "asOfDate": watermark,
+        "profile": {"breached": now["breached"], "prevBreached": prev["breached"] if has_prev else None,
+                    "warning": now["warning"], "prevWarning": prev["warning"] if has_prev else None,
+                    "direction": direction},
+        "riskTypes": [_round(r) for r in risk_types],
+        "kris": [_round(r) for r in kris],
+    }
+
+
+# domain → (input loader, system prompt); other domains need SUMMARY_SQL_<DOMAIN>, a query
+# returning the month's rows (e.g. SUMMARY_SQL_ESG="SELECT ... AS asOfDate FROM dbo.t_ESG ...").
+# A loader returns either rows (each with an asOfDate) or a ready payload dict with an asOfDate.
+SUMMARY_SOURCES: dict[str, tuple] = {
+    "KRI": ((kri_trend_input, summary_prompt + TREND_INPUT_RULES) if SUMMARY_TRENDS
+            else (SNAPSHOT.current_month_rows, summary_prompt)),
+}
+
+
+def register_summary_source(domain: str, rows, prompt: str | None = None) -> None:
+    """`rows()` returns the month's rows for `domain`, each with an asOfDate."""
+    SUMMARY_SOURCES[domain] = (rows, prompt or domain_summary_prompt.format(domain=domain))
+
+
+def canonical_domain(domain: str) -> str:
+    known = {d.lower(): d for d in (*SUMMARY_SOURCES, *PUBLISHED_DASHBOARDS)}
+    return known.get(domain.strip().lower(), domain.strip())
+
+
+def has_summary_source(domain: str) -> bool:
+    return domain in SUMMARY_SOURCES or bool(os.getenv(f"SUMMARY_SQL_{domain.upper()}", "").strip())
+
+
+def configured_domains() -> list[str]:
+    """Domains with a summary source: the registered ones plus every SUMMARY_SQL_<DOMAIN> that is set."""
+    found = list(SUMMARY_SOURCES)
+    for key, value in os.environ.items():
+        if key.startswith("SUMMARY_SQL_") and value.strip():
+            found.append(canonical_domain(key[len("SUMMARY_SQL_"):]))
+    return list(dict.fromkeys(found))
+
+
+def resolve_domains(domains: list[str] | str | None = None) -> list[str]:
+    """
+    Normalises a domain selection: None → the configured SUMMARY_DOMAINS,
+    "all" → configured_domains(), otherwise a list or comma-separated string.
+    Raises ValueError naming every explicitly requested domain that has no
+    summary source.
+    """
+    if domains is None:
+        domains = [canonical_domain(d) for d in SUMMARY_DOMAINS]
+        skipped = [d for d in domains if not has_summary_source(d)]
+        if skipped:
+            log.warning("summary_domains_unconfigured", domains=skipped)
+        return [d for d in domains if d not in skipped]
+    if isinstance(domains, str):
+        if domains.strip().lower() == "all":
+            return configured_domains()
+        domains = domains.split(",")
+    domains = list(dict.fromkeys(canonical_domain(d) for d in domains if d.strip()))
+    missing = [d for d in domains if not has_summary_source(d)]
+    if missing:
+        raise ValueError("no data source for the " + ", ".join(missing) + " summary (set "
+                         + ", ".join(f"SUMMARY_SQL_{d.upper()}" for d in missing) + ")")
+    return domains
+
+
+def summary_source(domain: str) -> tuple:
+    if domain in SUMMARY_SOURCES:
+        return SUMMARY_SOURCES[domain]
+    sql = os.getenv(f"SUMMARY_SQL_{domain.upper()}")
+    if not sql:
+        raise ValueError(f"no data source for the {domain} summary (set SUMMARY_SQL_{domain.upper()})")
+    return (lambda: run_query(sql)), domain_summary_prompt.format(domain=domain)
+
+
+def run_summary(domain: str = "KRI", timings: dict | None = None, links: dict | None = None) -> dict:
+    """
+    Generates and stores the monthly executive summary for one domain and
+    queues its email. `links` is a prefetched get_published_addresses() result.
+    """
+    domain = canonical_domain(domain)
+    rows_fn, prompt = summary_source(domain)
+    with stage(timings, "snapshot", "summary"):
+        data = rows_fn()
+    if not data:
+        raise ValueError(f"no {domain} rows to summarise")
+    if isinstance(data, dict):
+        compact = {"source": domain, **data}
+        as_of_date = str(data["asOfDate"])[:10]
+        rows = data.get("kris") or data.get("rows") or []
+    else:
+        rows = data
+        compact = {"source": domain, "window": "current_month", "rows": rows}
+        as_of_date = max(str(r.get("asOfDate") or "")[:10] for r in rows)
+    STAGE_ROWS.inc(len(rows), pipeline="summary", stage="snapshot")
+    summary_payload = {
+        "messages": [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": json.dumps(compact, ensure_ascii=False, default=str)}
+        ]
+    }
+
+    # a retry after a crash picks up the text, row and email that were already done
+    run_id, resumed = JOURNAL.open(f"summary:{domain}:{as_of_date}")
+    done = JOURNAL.steps(run_id)
+
+    with stage(timings, "llm", "summary"):
+        if "llm" in done:
+            summary_text = done["llm"]
+        else:
+            summary_text = call_gpt(summary_payload)
+            JOURNAL.record(run_id, "llm", summary_text)
+    with stage(timings, "insert", "summary"):
+        if "insert" not in done:
+            insert_summary(summary_text, domain, as_of_date)
+            JOURNAL.record(run_id, "insert")
+    with stage(timings, "dashboard", "summary"):
+        link_info = links.get(domain) if links is not None else get_published_address(domain)
+
+    email_body = summary_email_body(summary_text, link_info)
+    subject = f"DBG {domain} Summary – {as_of_date}"
+
+    # delivery (and IsEmailed = 1) happens on the outbox dispatcher, off the request path
+    with stage(timings, "email", "summary"):
+        if "email" in done:
+            outbox_id = done["email"]
+        else:
+            outbox_id = enqueue_email(subject, email_body, SUMMARY_RECIPIENTS, is_html=True,
+                                      summary_type=domain, as_of_date=as_of_date)
+            JOURNAL.record(run_id, "email", outbox_id)
+    JOURNAL.finish(run_id)
+
+    return {
+        "runId": run_id,
+        "resumed": resumed,
+        "domain": domain,
+        "summary_saved": True,
+        "emailed": False,
+        "emailQueued": True,
+        "outboxId": outbox_id,
+        "asOfDate": as_of_date,
+        "summary": summary_text
+    }
+
+
+def run_summaries(domains: list[str] | str | None = None, timings: dict | None = None,
+                  max_workers: int = SUMMARY_MAX_WORKERS) -> dict:
+    """
+    Runs run_summary for several domains at once (see resolve_domains: default
+    SUMMARY_DOMAINS, "all" for every configured domain). Dashboard links for every domain come from one query; the
+    domains then run in parallel over the shared DB and LLM connection pools,
+    so the wall time is roughly that of the slowest domain. A failing domain is
+    reported in "failed" without stopping the others.
+    """
+    domains = resolve_domains(domains)
+
+    with stage(timings, "dashboards", "summary"):
+        links = get_published_addresses(domains)
+
+    def one(domain: str) -> tuple[dict, dict]:
+        domain_timings = {}
+        try:
+            return run_summary(domain, domain_timings, links), domain_timings
+        except Exception as e:
+            log.exception("summary_failed", domain=domain, error=str(e))
+            return {"domain": domain, "error": str(e)}, domain_timings
+
+    results = {}
+    if domains:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(domains))),
+                                thread_name_prefix="summary") as pool:
+            for domain, (result, domain_timings) in zip(domains, pool.map(carry(one), domains)):
+                results[domain] = result
+                _merge_timings(timings, domain, domain_timings)
+    return {"summaries": results, "failed": [d for d, r in results.items() if "error" in r]}
+
+
+def _merge_timings(timings: dict | None, prefix: str, stages: dict) -> None:
+    if timings is not None:
+        for name, secs in stages.items():
+            timings[f"{prefix}.{name}"] = secs
+
+
+def run_monthly(timings: dict | None = None) -> dict:
+    """
+    Recommendations first, then the SUMMARY_DOMAINS summaries — what the
+    scheduler triggers. Fails (so the scheduler retries) only if no summary
+    could be produced.
+    """
+    run_timings, summary_timings = {}, {}
+    try:
+        recommendations = run_recommendations(timings=run_timings)
+    finally:
+        _merge_timings(timings, "run", run_timings)
+    try:
+        summaries = run_summaries(timings=summary_timings)
+    finally:
+        _merge_timings(timings, "summary", summary_timings)
+    if summaries["summaries"] and len(summaries["failed"]) == len(summaries["summaries"]):
+        raise RuntimeError("every summary failed: " + "; ".join(
+            f"{d}: {r['error']}" for d, r in summaries["summaries"].items()))
+    recommendations.pop("recommendations", None)
+    return {"run": recommendations, **summaries}
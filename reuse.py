@@ -0,0 +1,242 @@
+# reuse.py
+"""
+Reuse of earlier recommendations for KRIs that breach again with a similar value.
+
+Stored recommendations from the REUSE_HISTORY_MONTHS before the latest
+ObservedAt are indexed in memory by "metricName | riskType", embedded as
+hashed character trigrams (REUSE_DIM buckets, L2-normalised). A new row only
+reuses an earlier recommendation for the same relatedEntityId (KRI ID); the
+similarity ranks that entity's history and must be at least
+REUSE_MIN_SIMILARITY (so a KRI that was renamed into a different metric does
+not qualify), and the metricValue may have moved by at most
+REUSE_MAX_VALUE_DELTA (relative). Near-identical names of different KRIs
+("... Branch A" / "... Branch B") never share an essay. The old
+value is swapped for the new one in the text where it appears, and the row's
+metadata records where the text came from.
+"""
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import date, datetime, timezone
+from dotenv import load_dotenv
+import numpy as np
+from helper import run_query
+from kri_stage import add_months
+from logs import get_logger
+
+load_dotenv()
+
+REUSE_ENABLED          = os.getenv("REUSE_ENABLED", "1") == "1"
+REUSE_MIN_SIMILARITY   = float(os.getenv("REUSE_MIN_SIMILARITY", "0.98"))
+REUSE_MAX_VALUE_DELTA  = float(os.getenv("REUSE_MAX_VALUE_DELTA", "0.05"))
+REUSE_HISTORY_MONTHS   = int(os.getenv("REUSE_HISTORY_MONTHS", "12"))
+REUSE_REFRESH_SECONDS  = float(os.getenv("REUSE_REFRESH_SECONDS", "300"))
+REUSE_DIM              = int(os.getenv("REUSE_DIM", "1024"))
+
+log = get_logger(__name__)
+
+
+def index_text(metric_name, risk_type) -> str:
+    return f"{metric_name or ''} | {risk_type or ''}".lower().strip()
+
+
+def embed(texts: list[str], dim: int = REUSE_DIM) -> np.ndarray:
+    """Hashed character-trigram vectors, one L2-normalised row per text."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, t in enumerate(texts):
+        padded = f"  {t} "
+        for j in range(len(padded) - 2):
+            out[i, zlib.crc32(padded[j:j + 3].encode()) % dim] += 1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.where(norms > 0, norms, 1.0)
+
+
+def _value_delta(new, old) -> float:
+    try:
+        new, old = float(new), float(old)
+    except (TypeError, ValueError):
+        return float("inf")
+    return abs(new - old) / max(abs(old), 1e-9)
+
+
+# how an essay is likely to quote a value, and how to write the new one the same way
+_VALUE_FORMS = (
+    lambda v: f"{v:,.2f}",
+    lambda v: f"{v:.2f}",
+    lambda v: f"{v:.1f}",
+    lambda v: f"{v:.4g}",
+    lambda v: f"{v:g}",
+)
+
+
+def retemplate(text: str, old, new) -> tuple[str, bool]:
+    """
+    Replaces the first quote of the old metric value with the new one, written
+    in the same format. Only a whole numeric token matches, so a limit such as
+    15.0 is left alone when the old value is 5.0; the most specific format is
+    tried first.
+    """
+    try:
+        old, new = float(old), float(new)
+    except (TypeError, ValueError):
+        return text, False
+    for fmt in sorted(_VALUE_FORMS, key=lambda f: -len(f(old))):
+        form = fmt(old)
+        pattern = r"(?<![\d.,])" + re.escape(form) + r"(?!\.?\d)"
+        replaced, n = re.subn(pattern, lambda _: fmt(new), text, count=1)
+        if n:
+            return replaced, True
+    return text, False
+
+
+class ReuseIndex:
+    """
+    In-memory similarity index over t_insightView_Recommendations.
+    Reloaded when the table's row count or latest ObservedAt changes, probed
+    at most every `refresh_seconds`.
+    """
+
+    def __init__(self, min_similarity: float = REUSE_MIN_SIMILARITY,
+                 max_value_delta: float = REUSE_MAX_VALUE_DELTA,
+                 history_months: int = REUSE_HISTORY_MONTHS, refresh_seconds: float = REUSE_REFRESH_SECONDS):
+        self.min_similarity = min_similarity
+        self.max_value_delta = max_value_delta
+        self.history_months = history_months
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._version = None
+        self._probed_at = 0.0
+        self._texts: list[str] = []
+        self._vectors = np.zeros((0, REUSE_DIM), dtype=np.float32)
+        self._entries: list[list[dict]] = []
+        self._by_entity: dict[str, list[tuple[int, dict]]] = {}
+
+    def refresh(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._version is not None and now - self._probed_at < self.refresh_seconds:
+                return
+            self._probed_at = now
+            probe = run_query("""
+                SELECT COUNT(*) AS n, MAX(ObservedAt) AS latest
+                FROM dbo.t_insightView_Recommendations
+                WHERE ActionType <> 'NoAction';
+            """)[0]
+            version = (probe["n"], str(probe["latest"]))
+            if force or version != self._version:
+                self._load(probe["latest"])
+                self._version = version
+
+    def _load(self, latest) -> None:
+        if not latest:
+            self._texts, self._vectors, self._entries = [], np.zeros((0, REUSE_DIM), dtype=np.float32), []
+            self._by_entity = {}
+            return
+        since = add_months(date.fromisoformat(str(latest)[:10]), -self.history_months)
+        rows = run_query("""
+            SELECT RelatedEntityId, MetricName, RiskType, MetricValue, ObservedAt,
+                   RecommendationText, ActionType, Confidence, Metadata
+            FROM dbo.t_insightView_Recommendations
+            WHERE ObservedAt >= :since AND ActionType <> 'NoAction'
+              AND RecommendationText IS NOT NULL;
+        """, {"since": since.isoformat()})
+
+        groups: dict[str, list[dict]] = {}
+        for r in rows:
+            try:
+                meta = json.loads(r["Metadata"]) if r.get("Metadata") else {}
+            except ValueError:
+                meta = {}
+            groups.setdefault(index_text(r["MetricName"], r["RiskType"]), []).append({
+                "relatedEntityId": str(r["RelatedEntityId"]),
+                "observedAt": str(r["ObservedAt"] or "")[:10],
+                "metricValue": r["MetricValue"],
+                "recommendationText": r["RecommendationText"],
+                "actionType": r["ActionType"],
+                "confidence": r["Confidence"],
+                "severityRank": meta.get("severityRank") if isinstance(meta, dict) else None,
+                # chains of reuse point at the essay that was actually generated
+                "origin": (meta.get("reusedFrom") if isinstance(meta, dict) else None),
+            })
+        for entries in groups.values():
+            entries.sort(key=lambda e: e["observedAt"], reverse=True)
+
+        self._texts = list(groups)
+        self._vectors = embed(self._texts)
+        self._entries = [groups[t] for t in self._texts]
+        by_entity: dict[str, list[tuple[int, dict]]] = {}
+        for t, entries in enumerate(self._entries):
+            for e in entries:
+                by_entity.setdefault(e["relatedEntityId"], []).append((t, e))
+        self._by_entity = by_entity
+        log.info("reuse_index_loaded", recommendations=len(rows), kris=len(self._texts))
+
+    def _candidate(self, row: dict, sims: np.ndarray, severity) -> tuple[dict, float] | None:
+        """Best earlier recommendation of the row's own entity, ranked by similarity then recency."""
+        entity, observed = str(row.get("relatedEntityId")), str(row.get("observedAt") or "")[:10]
+        best = None
+        for t, e in self._by_entity.get(entity, ()):
+            if sims[t] < self.min_similarity:
+                continue
+            if e["observedAt"] == observed:
+                continue  # the row's own earlier answer; regenerating it is the point of full=1
+            if _value_delta(row.get("metricValue"), e["metricValue"]) > self.max_value_delta:
+                continue
+            if severity is not None and e["severityRank"] is not None and e["severityRank"] != severity:
+                continue
+            rank = (float(sims[t]), e["observedAt"])
+            if best is None or rank > best[0]:
+                best = (rank, e)
+        return (best[1], best[0][0]) if best else None
+
+    def match(self, rows: list[dict], scores: dict[tuple, dict] | None = None) -> tuple[list[dict], list[dict]]:
+        """
+        Splits rows into (reused recommendations, rows that still need the LLM).
+        `scores` (from rules.triage) keeps reuse within the same severity rank.
+        """
+        if not REUSE_ENABLED or not rows:
+            return [], rows
+        self.refresh()
+        if not self._texts:
+            return [], rows
+
+        queries = sorted({index_text(r.get("metricName"), r.get("riskType")) for r in rows})
+        sims = embed(queries) @ self._vectors.T
+        row_sims = {q: sims[i] for i, q in enumerate(queries)}
+
+        reused, pending = [], []
+        for row in rows:
+            score = (scores or {}).get((str(row.get("relatedEntityId")), str(row.get("observedAt") or "")[:10]))
+            found = self._candidate(row, row_sims[index_text(row.get("metricName"), row.get("riskType"))],
+                                    score["severityRank"] if score else None)
+            if not found:
+                pending.append(row)
+                continue
+            prior, similarity = found
+            text, templated = retemplate(prior["recommendationText"], prior["metricValue"], row.get("metricValue"))
+            reused.append({
+                "source": "KRI",
+                "relatedEntityId": str(row.get("relatedEntityId")),
+                "metricName": row.get("metricName"),
+                "metricValue": row.get("metricValue"),
+                "recommendationText": text,
+                "actionType": prior["actionType"],
+                "confidence": prior["confidence"] if prior["confidence"] is not None else 0.5,
+                "referenceTimestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "observedAt": row.get("observedAt"),
+                "riskType": row.get("riskType"),
+                "metadata": {"reusedFrom": prior["origin"] or {
+                    "relatedEntityId": prior["relatedEntityId"],
+                    "observedAt": prior["observedAt"],
+                    "metricValue": prior["metricValue"],
+                }, "similarity": round(similarity, 4), "templated": templated},
+                "postMitigationValue": None,
+            })
+        log.info("reuse_matched", reused=len(reused), rows=len(rows))
+        return reused, pending
+
+
+REUSE = ReuseIndex()
@@ -1,13 +1,22 @@
 # routes.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
 from datetime import datetime, timezone
 from pydantic import ValidationError
-from sqlalchemy import text
-from Schema import Recommendation
-from helper import ENGINE, get_published_address, normalize_record, run_query, insert_recommendations, call_gpt, insert_summary, send_summary_email, summary_prompt
+from Schema import Recommendation, RejectedItem, validate_recommendations_json
+from llm_cache import CACHE
+from kri_snapshot import SNAPSHOT, WINDOW_FIELDS
+from compression import compress_stream, negotiate
+from helper import GPT_CHUNK_SIZE, GPT_MAX_WORKERS, insert_recommendations
+from jobs import JOBS
+from journal import JOURNAL
+from outbox import outbox_stats
+from logs import bind_request, clear_request, get_logger
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_SECONDS, REGISTRY
+import pipeline
 
 
-import os, json
+import base64, csv, io, os, json, time, zlib
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -22,65 +31,129 @@ TO_EMAILS = [
     "b.oagyemang@awcghana.com",
 ]
 
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "200"))
+
 bp = Blueprint("api", __name__)
+log = get_logger(__name__)
 
 @bp.get("/health")
 def health():
     return jsonify({"status": "ok", "ts": datetime.now(timezone.utc).isoformat()})
 
+@bp.get("/gpt/cache")
+def gpt_cache():
+    return jsonify(CACHE.stats())
+
+@bp.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+    # correlation ID for every log event of this request (and the jobs it queues)
+    g.request_id = bind_request(request.headers.get("X-Request-ID"))
+
+@bp.after_request
+def _observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        elapsed = time.perf_counter() - started
+        HTTP_SECONDS.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+        log.info("request", method=request.method, endpoint=endpoint, status=response.status_code,
+                 ms=round(elapsed * 1000, 1))
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+@bp.teardown_request
+def _clear_log_context(exc):
+    clear_request()
+
+@bp.get("/metrics")
+def prometheus_metrics():
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+@bp.get("/email/outbox")
+def email_outbox():
+    return jsonify(outbox_stats())
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    if not (isinstance(key, list) and len(key) == 3 and all(isinstance(k, int) for k in key[:2])):
+        raise ValueError("malformed cursor")
+    return tuple(key)
+
+def _csv_line(values) -> str:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerow(values)
+    return buf.getvalue()
+
+DATA_SQL_FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
 @bp.get("/data/sql")
 def data_sql():
-  sql = """
-      ;WITH maxd AS (
-    SELECT MAX(TRY_CONVERT(date, [As of Date])) AS max_date
-    FROM [NPL].[dbo].[t_insightView_KRI]
-)
-SELECT
-    t.[KRI ID]              AS relatedEntityId,
-    t.[KRI_Name]            AS metricName,
-    t.[Adjusted Current Mth] AS metricValue,
-    t.[As of Date]          AS observedAt,
-    t.[KRI Standard]        AS kriStandard,
-    t.[Risk Type]           AS riskType,
-    t.[RiskW]               AS riskW,
-    t.[ImpactBin_Col]       AS impactLevel,
-    t.[LikelihoodBin_Col]   AS likelihoodBin,
-    t.[RiskLevel_Col]       AS probabilityLevel,
-    t.[Warning Limit1]      AS warningLimit,
-    t.[Warning Limit1 Operator] AS warningLimitOperator,
-    t.[Escalaltion Limit 1 Num] AS escalationLimit,
-    t.[Escalation Limit1 Operator] AS escalationLimitOperator,
-    t.[Threshold_Value]     AS thresholdLimit,
-    t.[Threshold_Operator]  AS thresholdOperator,
-    t.[ExposureScoreCol]    AS exposureScore,
-    t.[KRI Status]          AS statusBand,
-    CASE
-        WHEN t.[KRI Status] = 'Breached' THEN 2
-        WHEN t.[KRI Status] = 'Warning'  THEN 1
-        ELSE 0
-    END AS breachLevel
-FROM [NPL].[dbo].[t_insightView_KRI] t
-WHERE
-    t.[TOP_KRIs] = 1
-    AND t.[Breached KRIs] > 0
-    AND TRY_CONVERT(date, t.[As of Date]) 
-        BETWEEN DATEADD(MONTH, -2, (SELECT max_date FROM maxd)) 
-            AND (SELECT max_date FROM maxd)
-ORDER BY
-    breachLevel DESC,
-    TRY_CONVERT(date, t.[As of Date]) DESC;
-
-      """
-  
-  rows = run_query(sql)
-  for r in rows:
-    print(f"{r['relatedEntityId']} — {r['metricName']}: {r['metricValue']} | "
-          f"status={r['statusBand']} | breachLevel={r['breachLevel']} | "
-          f"asOf={r['observedAt']}")
-  return jsonify({
-        "meta": {"rows": len(rows), "window": "last_12_months_from_max_AsOfDate"},
-        "data": {"source": "KRI", "rows": rows}
-    })
+    """
+    The KRI window from the in-memory snapshot (kri_snapshot.SNAPSHOT).
+
+    ?limit=N&after=<cursor> pages through it (meta.nextCursor / Link: rel="next").
+    Pages are cut from the snapshot, which holds the whole KRI_WINDOW_MONTHS
+    window; paging bounds the response, not what the worker keeps in memory.
+    ?format=json|ndjson|csv; bodies are streamed and gzip/br compressed on request.
+
+    If-None-Match is answered after SNAPSHOT.refresh(), which touches the DB
+    only for its watermark probe, at most once per KRI_SNAPSHOT_PROBE_SECONDS;
+    a 304 in between costs no DB round trip.
+    """
+    fmt = request.args.get("format", "json").lower()
+    limit = request.args.get("limit", 0, type=int)
+    if fmt not in DATA_SQL_FORMATS or limit < 0:
+        return jsonify({"error": "format must be json, ndjson or csv and limit >= 0"}), 400
+    after = request.args.get("after")
+    try:
+        after = _decode_cursor(after) if after else None
+    except ValueError:
+        return jsonify({"error": "invalid cursor"}), 400
+
+    SNAPSHOT.refresh()
+    rows, next_key, version = SNAPSHOT.window_page(after, limit)
+    variant = zlib.crc32(f"{fmt}|{limit}|{request.args.get('after', '')}".encode())
+    etag = f'W/"{version}-{variant:08x}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        return Response(status=304, headers=headers)
+
+    next_cursor = _encode_cursor(next_key) if next_key else None
+    if next_cursor:
+        query = {k: v for k, v in request.args.items() if k != "after"}
+        query["after"] = next_cursor
+        headers["Link"] = f'<{request.path}?{urlencode(query)}>; rel="next"'
+
+    def body():
+        if fmt == "csv":
+            fields = (*WINDOW_FIELDS, "breachLevel")
+            yield _csv_line(fields)
+            for r in rows:
+                yield _csv_line(r[f] for f in fields)
+        elif fmt == "ndjson":
+            for r in rows:
+                yield json.dumps(r, ensure_ascii=False, default=str) + "\n"
+        else:
+            meta = {"rows": len(rows), "window": "last_12_months_from_max_AsOfDate", "nextCursor": next_cursor}
+            yield '{"meta": ' + json.dumps(meta) + ', "data": {"source": "KRI", "rows": ['
+            for i, r in enumerate(rows):
+                yield ("," if i else "") + json.dumps(r, ensure_ascii=False, default=str)
+            yield "]}}"
+
+    encoding = negotiate(request.headers.get("Accept-Encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(compress_stream(body(), encoding), headers=headers, content_type=DATA_SQL_FORMATS[fmt])
 
 @bp.post("/recommendations")
 def post_recommendations():
@@ -104,185 +177,158 @@ def post_recommendations():
                 "metadata": r.metadata or {},
                 "postMitigationValue": getattr(r, "postMitigationValue", None)
             }
-            validated.append(normalize_record(rec))
+            validated.append(rec)
 
         except ValidationError as ve:
             return jsonify({"error": "validation_failed", "detail": ve.errors()}), 400
     inserted = insert_recommendations(validated)
     return jsonify({"inserted": inserted}), 201
 
-@bp.post("/gpt/run")
-def gpt_run():
-    sql = """
-        ;WITH maxd AS (
-    SELECT MAX(TRY_CONVERT(date, [As of Date])) AS max_date
-    FROM [NPL].[dbo].[t_insightView_KRI]
-)
-SELECT
-    t.[KRI ID]              AS relatedEntityId,
-    t.[KRI_Name]            AS metricName,
-    t.[Adjusted Current Mth] AS metricValue,
-    t.[As of Date]          AS observedAt,
-    t.[KRI Standard]        AS kriStandard,
-    t.[Risk Type]           AS riskType,
-    t.[RiskW]               AS riskW,
-    t.[ImpactBin_Col]       AS impactLevel,
-    t.[LikelihoodBin_Col]   AS likelihoodBin,
-    t.[RiskLevel_Col]       AS probabilityLevel,
-    t.[Warning Limit1]      AS warningLimit,
-    t.[Warning Limit1 Operator] AS warningLimitOperator,
-    t.[Escalaltion Limit 1 Num] AS escalationLimit,
-    t.[Escalation Limit1 Operator] AS escalationLimitOperator,
-    t.[Threshold_Value]     AS thresholdLimit,
-    t.[Threshold_Operator]  AS thresholdOperator,
-    t.[ExposureScoreCol]    AS exposureScore,
-    t.[KRI Status]          AS statusBand,
-    CASE
-        WHEN t.[KRI Status] = 'Breached' THEN 2
-        WHEN t.[KRI Status] = 'Warning'  THEN 1
-        ELSE 0
-    END AS breachLevel
-FROM [NPL].[dbo].[t_insightView_KRI] t
-WHERE
-    t.[TOP_KRIs] = 1
-    AND t.[Breached KRIs] > 0
-    AND TRY_CONVERT(date, t.[As of Date]) 
-        BETWEEN DATEADD(MONTH, -2, (SELECT max_date FROM maxd)) 
-            AND (SELECT max_date FROM maxd)
-ORDER BY
-    breachLevel DESC,
-    TRY_CONVERT(date, t.[As of Date]) DESC;
-
-        """
-
-    rows = run_query(sql)
-    compact = {"source": "KRI", "window": "year_2025", "rows": rows}
-    recs = call_gpt(compact)
-
-    validated, errors = [], []
-    for it in recs:
+def _validate_batch(body: bytes, positions: list[int]) -> tuple[list[dict], list[dict]]:
+    """
+    Validates a JSON array of recommendations from raw bytes in one call.
+    `positions` maps array index → line number / item index for error reports.
+    """
+    records, errors = [], []
+    for pos, item in zip(positions, validate_recommendations_json(body)):
+        if isinstance(item, RejectedItem):
+            errors.append({"line": pos, "errors": item.errors})
+        else:
+            records.append({**item.model_dump(), "metadata": item.metadata or {}})
+    return records, errors
+
+def _validate_ndjson_lines(lines: list[bytes], numbers: list[int]) -> tuple[list[dict], list[dict]]:
+    try:
+        return _validate_batch(b"[" + b",".join(lines) + b"]", numbers)
+    except ValidationError:
+        # a line is not even JSON: fall back to validating the lines one by one
+        records, errors = [], []
+        for line, n in zip(lines, numbers):
+            try:
+                recs, errs = _validate_batch(b"[" + line + b"]", [n])
+            except ValidationError as ve:
+                recs, errs = [], [{"line": n, "errors": [{"type": e["type"], "msg": e["msg"]} for e in ve.errors()]}]
+            records += recs
+            errors += errs
+        return records, errors
+
+@bp.post("/recommendations/bulk")
+def bulk_recommendations():
+    """
+    High-volume ingestion: accepts NDJSON (one recommendation per line) or a
+    JSON array as a raw byte stream. Lines are validated in batches directly
+    from bytes; valid rows are upserted per batch and invalid ones reported
+    with their line number (1-based) or array index (0-based).
+    """
+    # request.stream is a raw stream: readline() on it would read byte by byte
+    stream = io.BufferedReader(request.stream, buffer_size=1 << 16)
+    first = b""
+    lineno = 0
+    for raw in stream:
+        lineno += 1
+        first = raw.strip()
+        if first:
+            break
+
+    inserted, accepted, errors, rejected = 0, 0, [], 0
+
+    def flush(records, errs):
+        nonlocal inserted, accepted, rejected
+        accepted += len(records)
+        rejected += len(errs)
+        errors.extend(errs[:max(0, BULK_MAX_ERRORS - len(errors))])
+        if records:
+            inserted += insert_recommendations(records)
+
+    if first.startswith(b"["):
+        body = first + b"\n" + stream.read()
         try:
-            r = Recommendation(**it)
-            rec = {
-                "source": r.source,
-                "relatedEntityId": r.relatedEntityId,
-                "metricName": r.metricName,
-                "metricValue": r.metricValue,
-                "recommendationText": r.recommendationText,
-                "actionType": r.actionType,
-                "confidence": r.confidence,
-                "riskType": r.riskType,
-                "referenceTimestamp": r.referenceTimestamp,
-                "observedAt": getattr(r, "observedAt", None) \
-              or next((row["observedAt"] for row in rows if row["relatedEntityId"] == r.relatedEntityId), None),
+            items = validate_recommendations_json(body)
+        except ValidationError as ve:
+            return jsonify({"error": "invalid_json", "detail": [{"type": e["type"], "msg": e["msg"]} for e in ve.errors()[:1]]}), 400
+        for start in range(0, len(items), BULK_BATCH_SIZE):
+            records, errs = [], []
+            for i, item in enumerate(items[start:start + BULK_BATCH_SIZE], start):
+                if isinstance(item, RejectedItem):
+                    errs.append({"index": i, "errors": item.errors})
+                else:
+                    records.append({**item.model_dump(), "metadata": item.metadata or {}})
+            flush(records, errs)
+    elif first:
+        lines, numbers = [first], [lineno]
+        for raw in stream:
+            lineno += 1
+            raw = raw.strip()
+            if not raw:
+                continue
+            lines.append(raw)
+            numbers.append(lineno)
+            if len(lines) >= BULK_BATCH_SIZE:
+                flush(*_validate_ndjson_lines(lines, numbers))
+                lines, numbers = [], []
+        if lines:
+            flush(*_validate_ndjson_lines(lines, numbers))
 
-                "metadata": r.metadata or {},
-                "postMitigationValue": getattr(r, "postMitigationValue", None)
-            }
-            validated.append(normalize_record(rec))
-        except Exception as e:
-            errors.append({"item": it, "error": str(e)})
-    count = insert_recommendations(validated) if validated else 0
-    return jsonify({"generated": len(recs), "inserted":count,  "errors": errors,  "recommendations": validated })
+    status = 201 if accepted or not rejected else 422
+    return jsonify({"accepted": accepted, "inserted": inserted, "rejected": rejected, "errors": errors}), status
+
+@bp.post("/gpt/run")
+def gpt_run():
+    # Only rows without a recommendation for the same (KRI, As of Date, value)
+    # are generated; ?full=1 regenerates the whole window.
+    params = {
+        "full": request.args.get("full", "0").lower() in ("1", "true", "yes"),
+        "chunk_size": request.args.get("chunk_size", GPT_CHUNK_SIZE, type=int),
+        "max_workers": request.args.get("workers", GPT_MAX_WORKERS, type=int),
+    }
+    if _flag("async"):
+        return _submitted(JOBS.submit("gpt_run", params))
+    if _flag("stream"):
+        events = (json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in pipeline.stream_run(**params))
+        return Response(stream_with_context(events), mimetype="application/x-ndjson")
+    return jsonify(pipeline.run_recommendations(**params))
 
 @bp.post("/gpt/summary")
 def gpt_summary():
-    sql = """
-            ;WITH maxd AS (
-            SELECT MAX(TRY_CONVERT(date, [As of Date])) AS max_date
-            FROM [NPL].[dbo].[t_insightView_KRI]
-        )
-        SELECT
-            t.[KRI ID]                AS kriId,
-            t.[KRI_Name]              AS kriName,
-            t.[Adjusted Current Mth]  AS adjustedCurrentMth,
-            t.[Risk Type]             AS riskType,
-            t.[ImpactBin_Col],
-            t.[LikelihoodBin_Col],
-            t.[ExposureScoreCol]      AS exposureScore,
-            t.[KRI Status]            AS kriStatus,
-            TRY_CONVERT(date, t.[As of Date]) AS asOfDate,
-            CASE WHEN t.[KRI Status] = 'Breached' THEN 1 ELSE 0 END AS isBreached,
-            CASE WHEN t.[KRI Status] = 'Warning'  THEN 1 ELSE 0 END AS isWarning,
-            CASE WHEN t.[ImpactBin_Col] = 3 AND t.[LikelihoodBin_Col] = 5 THEN 1 ELSE 0 END AS highImpactHighLikelihood
-        FROM [NPL].[dbo].[t_insightView_KRI] t
-        CROSS JOIN maxd
-        WHERE TRY_CONVERT(date, t.[As of Date]) = maxd.max_date
-        AND t.[TOP_KRIs] = 1
-        ORDER BY t.[Risk Type], t.[KRI_Name];
-    """
-    
-    rows = run_query(sql)
-    compact = {"source": "KRI", "window": "current_month", "rows": rows}
-    summary_payload = {
-        "messages": [
-            {"role": "system", "content": summary_prompt},
-            {"role": "user", "content": json.dumps(compact, ensure_ascii=False)}
-        ]
-    }
+    # ?domain=ESG for one domain, ?domains=KRI,ESG (or all configured ones) for several at once
+    params = {k: request.args[k] for k in ("domain", "domains") if request.args.get(k)}
+    try:
+        # unconfigured domains are refused up front instead of failing inside the run
+        pipeline.resolve_domains(params.get("domains") or [params.get("domain", "KRI")])
+    except ValueError as e:
+        return jsonify({"error": "unknown_domain", "detail": str(e)}), 400
+    if _flag("async"):
+        return _submitted(JOBS.submit("gpt_summary", params))
+    if "domains" in params:
+        return jsonify(pipeline.run_summaries(params["domains"]))
+    return jsonify(pipeline.run_summary(params.get("domain", "KRI")))
 
-    summary_text = call_gpt(summary_payload)
-    as_of_date = rows[0]["asOfDate"]
-    insert_summary(summary_text, "KRI", as_of_date)
-    dashboard_name = None
-    dashboard_link = None
-    link_info = get_published_address("KRI")
-    # print("📊 Dashboard link info:", link_info)
-    
-    email_body = summary_text 
-    if link_info:
-        dashboard_name, dashboard_link = link_info
-        email_body += f"""
-            <br><br>
-            <div style="text-align:center; margin-top:25px;">
-                <a href="{dashboard_link}"
-                style="background-color:#0078D4; color:#fff; padding:12px 24px;
-                        text-decoration:none; border-radius:6px; font-weight:bold;
-                        font-family:Segoe UI, sans-serif;">
-                    🔗 View {dashboard_name}
-                </a>
-            </div>
-            <p style="text-align:center; font-size:12px; color:#555; margin-top:10px;">
-                If the button above doesn’t work, copy and paste this link:<br>
-                <a href="{dashboard_link}" style="color:#0078D4;">{dashboard_link}</a>
-            </p>
-        """
-    else:
-            email_body += """
-            <br><br>
-            <p style="text-align:center; color:#999;">
-                Dashboard link currently unavailable.
-            </p>
-        """
-    recipients = [
-    "g.agyeabour@awcghana.com",
-    "m.williams@awcghana.com",
-    "patrick@awcghana.com",
-    "s.namoafo@awcghana.com",
-    "b.oagyemang@awcghana.com",
-    ]
-    subject = f"DBG KRI Summary – {as_of_date}"
-
-    success = send_summary_email(subject, email_body, recipients, is_html=True)
-
-    if success:
-        # Mark as emailed
-        update_sql = """
-            UPDATE [NPL].[dbo].[t_insightView_Email_Summaries]
-            SET IsEmailed = 1
-            WHERE SummaryType = 'KRI' AND AsOfDate = :asOfDate;
-        """
-        with ENGINE.begin() as conn:
-            conn.execute(text(update_sql), {"asOfDate": as_of_date})
-
-        print(f"✅ Summary for {as_of_date} emailed successfully.")
-    else:
-        print(f"⚠️ Email failed for summary {as_of_date}. Will remain IsEmailed = 0.")
-
-    return jsonify({
-        "summary_saved": True,
-        "emailed": success,
-        "asOfDate": as_of_date,
-        "summary": summary_text
-    })
-   
+def _flag(name: str) -> bool:
+    return request.args.get(name, "0").lower() in ("1", "true", "yes")
+
+def _submitted(job_id: str):
+    return jsonify({"jobId": job_id, "status": "queued", "statusUrl": f"/jobs/{job_id}"}), 202
+
+@bp.post("/jobs/<kind>")
+def submit_job(kind: str):
+    if kind not in JOBS.kinds():
+        return jsonify({"error": "unknown_job_kind", "kinds": sorted(JOBS.kinds())}), 404
+    params = request.get_json(silent=True) or {}
+    return _submitted(JOBS.submit(kind, params))
+
+@bp.get("/jobs")
+def list_jobs():
+    return jsonify({"jobs": JOBS.list(limit=request.args.get("limit", 50, type=int),
+                                      status=request.args.get("status"))})
+
+@bp.get("/runs")
+def list_runs():
+    # run journal: unfinished runs ("running") are resumed by the next trigger
+    return jsonify({"runs": JOURNAL.runs(limit=request.args.get("limit", 50, type=int))})
+
+@bp.get("/jobs/<job_id>")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "not_found"}), 404
+    return jsonify(job)
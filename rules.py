@@ -0,0 +1,186 @@
+# rules.py
+"""
+Deterministic breach scoring for the KRI window, evaluated column-wise with
+NumPy instead of asking the model to read limits and operators row by row.
+
+For every row it computes
+  severityRank     0 within limits, 1 warning, 2 escalation, 3 threshold crossed
+  distanceToLimit  how far metricValue sits past (+) or inside (-) the warning
+                   limit, relative to |limit|
+  postMitigationValue  the nearest value on the safe side of the warning limit
+                   (RULES_SAFE_MARGIN inside it for <= / >=), or the current
+                   value when nothing is crossed
+
+The source's own status band has the last word: only rows it does not flag
+(statusBand other than Breached/Warning) that are also within every known
+limit are answered here with a NoAction recommendation. A flagged row whose
+limits do not reproduce the breach (the operator columns need not state the
+breach condition) still goes to the LLM, with limitsDisagree in its scores and
+no computed postMitigationValue. For the other LLM rows the computed
+postMitigationValue replaces whatever the model suggests.
+"""
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+import numpy as np
+from dotenv import load_dotenv
+from logs import get_logger
+
+load_dotenv()
+
+RULES_ENABLED     = os.getenv("RULES_ENABLED", "1") == "1"
+RULES_SAFE_MARGIN = float(os.getenv("RULES_SAFE_MARGIN", "0.01"))
+
+# statusBand values with which the source flags a breach
+FLAGGED_STATUSES = ("Breached", "Warning")
+
+# (limit field, operator field, severity when crossed), lowest tier first
+LIMITS = (
+    ("warningLimit", "warningLimitOperator", 1),
+    ("escalationLimit", "escalationLimitOperator", 2),
+    ("thresholdLimit", "thresholdOperator", 3),
+)
+
+log = get_logger(__name__)
+
+
+def _floats(rows: list[dict], field: str) -> np.ndarray:
+    values = [row.get(field) for row in rows]
+    return np.array([float(v) if isinstance(v, (int, float, Decimal)) and not isinstance(v, bool) else np.nan
+                     for v in values], dtype=float)
+
+
+def _ops(rows: list[dict], field: str) -> np.ndarray:
+    return np.array([row.get(field) for row in rows], dtype=object)
+
+
+def _op_in(op: np.ndarray, choices: tuple) -> np.ndarray:
+    return np.logical_or.reduce([op == c for c in choices])
+
+
+def _crossed(value: np.ndarray, limit: np.ndarray, op: np.ndarray) -> np.ndarray:
+    """value <op> limit per row; False where either side or the operator is unknown."""
+    with np.errstate(invalid="ignore"):
+        crossed = np.select(
+            [op == ">", op == ">=", op == "<", op == "<=", op == "="],
+            [value > limit, value >= limit, value < limit, value <= limit, value == limit],
+            default=False,
+        )
+    return crossed & ~np.isnan(value) & ~np.isnan(limit)
+
+
+def score_rows(rows: list[dict]) -> dict[str, np.ndarray]:
+    """Column-wise scores for `rows` (see the module docstring), plus `resolvable` and `disagrees`."""
+    value = _floats(rows, "metricValue")
+    severity = np.zeros(len(rows), dtype=np.int8)
+    known = np.zeros(len(rows), dtype=bool)
+    # the lowest tier with a usable limit/operator drives distance and target
+    target_limit = np.full(len(rows), np.nan)
+    target_op = np.full(len(rows), None, dtype=object)
+
+    for limit_field, op_field, rank in LIMITS:
+        limit, op = _floats(rows, limit_field), _ops(rows, op_field)
+        usable = ~np.isnan(limit) & _op_in(op, (">", ">=", "<", "<="))
+        severity = np.where(_crossed(value, limit, op), np.maximum(severity, rank), severity)
+        fill = usable & np.isnan(target_limit)
+        target_limit = np.where(fill, limit, target_limit)
+        target_op = np.where(fill, op, target_op)
+        known |= usable
+
+    upper = _op_in(target_op, (">", ">="))  # breach is above the limit
+    scale = np.where(np.abs(target_limit) > 0, np.abs(target_limit), 1.0)
+    with np.errstate(invalid="ignore"):
+        distance = np.where(upper, value - target_limit, target_limit - value) / scale
+    margin = RULES_SAFE_MARGIN * scale
+    target = np.select(
+        [target_op == ">", target_op == ">=", target_op == "<", target_op == "<="],
+        [target_limit, target_limit - margin, target_limit, target_limit + margin],
+        default=np.nan,
+    )
+    post = np.where(severity == 0, value, target)
+    post = np.where(known & ~np.isnan(value), post, np.nan)
+
+    within = (severity == 0) & known & ~np.isnan(value)
+    flagged = _op_in(_ops(rows, "statusBand"), FLAGGED_STATUSES)
+    return {
+        "severityRank": severity,
+        "distanceToLimit": distance,
+        "postMitigationValue": post,
+        "resolvable": within & ~flagged,
+        # the source flags a breach the limits/operators do not reproduce
+        "disagrees": within & flagged,
+    }
+
+
+def _num(x) -> float | None:
+    return None if np.isnan(x) else round(float(x), 6)
+
+
+def _key(row: dict) -> tuple[str, str]:
+    return str(row.get("relatedEntityId")), str(row.get("observedAt") or "")[:10]
+
+
+def no_action(row: dict, distance: float) -> dict:
+    """Recommendation for a row that is inside all of its limits."""
+    op, limit = row.get("warningLimitOperator"), row.get("warningLimit")
+    where = f"inside its warning limit (breach when {op} {limit}) and" if limit is not None and op else "inside"
+    return {
+        "source": "KRI",
+        "relatedEntityId": str(row.get("relatedEntityId")),
+        "metricName": row.get("metricName"),
+        "metricValue": row.get("metricValue"),
+        "recommendationText": (
+            f"{row.get('metricName')} stands at {row.get('metricValue')}, {where} all escalation limits. "
+            f"No mitigation is required; "
+            f"the {row.get('riskType') or 'responsible'} team should continue routine monitoring."
+        ),
+        "actionType": "NoAction",
+        "confidence": 1.0,
+        "referenceTimestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "observedAt": row.get("observedAt"),
+        "riskType": row.get("riskType"),
+        "metadata": {"rule": "within_limits", "severityRank": 0, "distanceToLimit": _num(distance)},
+        "postMitigationValue": row.get("metricValue"),
+    }
+
+
+def triage(rows: list[dict]) -> tuple[list[dict], list[dict], dict[tuple, dict]]:
+    """
+    Splits the window into (resolved recommendations, rows for the LLM, scores)
+    where scores maps (relatedEntityId, observedAt date) to the computed
+    severityRank/distanceToLimit/postMitigationValue of each LLM row.
+    """
+    if not RULES_ENABLED or not rows:
+        return [], rows, {}
+    s = score_rows(rows)
+    resolved, pending, scores = [], [], {}
+    for i, row in enumerate(rows):
+        if s["resolvable"][i]:
+            resolved.append(no_action(row, s["distanceToLimit"][i]))
+            continue
+        pending.append(row)
+        disagrees = bool(s["disagrees"][i])
+        scores[_key(row)] = {
+            "severityRank": int(s["severityRank"][i]),
+            "distanceToLimit": _num(s["distanceToLimit"][i]),
+            # the current value is no mitigation target for a row the source calls breached
+            "postMitigationValue": None if disagrees else _num(s["postMitigationValue"][i]),
+            "limitsDisagree": disagrees,
+        }
+    log.info("rules_triaged", resolved=len(resolved), rows=len(rows))
+    return resolved, pending, scores
+
+
+def apply_scores(rec: dict, scores: dict[tuple, dict]) -> dict:
+    """Overrides the model's postMitigationValue with the computed one and records the scores."""
+    score = scores.get(_key(rec)) if isinstance(rec, dict) else None
+    if not score:
+        return rec
+    out = dict(rec)
+    if score["postMitigationValue"] is not None:
+        out["postMitigationValue"] = score["postMitigationValue"]
+    out["metadata"] = {**(rec.get("metadata") or {}), "severityRank": score["severityRank"],
+                       "distanceToLimit": score["distanceToLimit"]}
+    if score.get("limitsDisagree"):
+        out["metadata"]["limitsDisagree"] = True
+    return out
@@ -0,0 +1,241 @@
+# scheduler.py
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from logs import get_logger
+load_dotenv()
+
+SCHEDULER_POLL_SECONDS        = float(os.getenv("SCHEDULER_POLL_SECONDS", "120"))
+SCHEDULER_MAX_BACKOFF_SECONDS = float(os.getenv("SCHEDULER_MAX_BACKOFF_SECONDS", "1800"))
+SCHEDULER_WINDOW              = os.getenv("SCHEDULER_WINDOW", "* * * * *")
+SCHEDULER_MAX_RETRIES         = int(os.getenv("SCHEDULER_MAX_RETRIES", "5"))
+SCHEDULER_STATE_PATH          = os.getenv("SCHEDULER_STATE_PATH", os.path.join(".cache", "scheduler_state.json"))
+
+_CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+log = get_logger(__name__)
+
+
+def _cron_field(spec: str, lo: int, hi: int) -> set[int]:
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step_s = part.split("/", 1)
+            step = int(step_s)
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            start_s, end_s = part.split("-", 1)
+            start, end = int(start_s), int(end_s)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end or step < 1:
+            raise ValueError(f"cron field out of range: {spec!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronWindow:
+    """
+    Standard 5-field cron expression (minute hour day-of-month month day-of-week)
+    used as a window: matches(now) is True for every minute the expression covers.
+    "* 12-23 * * 1" means "Mondays from 12:00", "*/15 * * * *" every quarter hour.
+    Day-of-week is 0-6 from Sunday (7 is Sunday as well).
+    """
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, dows = (
+            _cron_field(f, lo, hi) for f, (lo, hi) in zip(fields, _CRON_RANGES)
+        )
+        self.dows = {d % 7 for d in dows}
+        self._any_day = fields[2] == "*"
+        self._any_dow = fields[4] == "*"
+
+    def matches(self, now: datetime) -> bool:
+        if now.minute not in self.minutes or now.hour not in self.hours or now.month not in self.months:
+            return False
+        dom = now.day in self.days
+        dow = (now.weekday() + 1) % 7 in self.dows
+        # cron semantics: when both day fields are restricted, either may match
+        if not self._any_day and not self._any_dow:
+            return dom or dow
+        return dom and dow
+
+
+class WatermarkScheduler:
+    """
+    Triggers generation when new KRI data lands.
+
+    Every poll reads only the source fingerprint (KriStage.source_fingerprint).
+    While it is unchanged the poll interval doubles up to `max_backoff`; any
+    change (or error recovery) drops it back to `poll_seconds`. When the
+    fingerprint moves, the staging table is synced and:
+
+      - a new As of Date that has no recommendations yet → the "monthly" job
+        (recommendations, then the executive summary);
+      - the same As of Date with corrected rows → a "gpt_run" job, which only
+        generates for rows whose value changed;
+      - a job that failed last time → the same kind again, after a delay that
+        doubles from `poll_seconds` up to `max_backoff`. After `max_retries`
+        failed attempts the data is given up on until the source changes again.
+
+    Jobs are only submitted while the cron `window` matches; a change seen
+    outside the window stays pending until it opens. The last fingerprint,
+    the last processed As of Date, the in-flight job and the retry count are
+    persisted to `state_path`, so a restart neither skips nor repeats a run.
+    """
+
+    def __init__(self, poll_seconds: float = SCHEDULER_POLL_SECONDS,
+                 max_backoff: float = SCHEDULER_MAX_BACKOFF_SECONDS,
+                 window: str = SCHEDULER_WINDOW, state_path: str = SCHEDULER_STATE_PATH,
+                 max_retries: int = SCHEDULER_MAX_RETRIES):
+        self.poll_seconds = poll_seconds
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.window = CronWindow(window)
+        self.state_path = state_path
+        self.state = self._load_state()
+        self._interval = poll_seconds
+        self._stop = threading.Event()
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("scheduler_state_unreadable", path=self.state_path, error=str(e))
+            return {}
+
+    def _save_state(self) -> None:
+        folder = os.path.dirname(self.state_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2, default=str)
+        os.replace(tmp, self.state_path)
+
+    def _check_job(self, now: datetime) -> bool:
+        """Settles the in-flight job, if any. Returns True while it is still running."""
+        from jobs import JOBS
+
+        job_id = self.state.get("jobId")
+        if not job_id:
+            return False
+        job = JOBS.get(job_id)
+        status = job["status"] if job else "interrupted"
+        if status in ("queued", "running"):
+            return True
+        if status == "succeeded":
+            self.state["processedAsOf"] = self.state.get("jobAsOf")
+            self.state["processedFingerprint"] = self.state.get("jobFingerprint")
+            self._clear_retry()
+            log.info("scheduled_job_finished", kind=self.state.get("jobKind"), as_of=self.state.get("jobAsOf"))
+        else:
+            attempts = self.state.get("retryAttempts", 0) + 1
+            if attempts >= self.max_retries:
+                self._clear_retry()
+                self.state["abandonedFingerprint"] = self.state.get("jobFingerprint")
+                log.error("scheduled_job_abandoned", kind=self.state.get("jobKind"), status=status,
+                          as_of=self.state.get("jobAsOf"), attempts=attempts)
+            else:
+                # leave processedFingerprint behind the source so a later tick retries
+                delay = min(self.poll_seconds * 2 ** (attempts - 1), self.max_backoff)
+                self.state.update(retryKind=self.state.get("jobKind"), retryAttempts=attempts,
+                                  retryAt=(now + timedelta(seconds=delay)).isoformat(timespec="seconds"))
+                log.warning("scheduled_job_retry", kind=self.state.get("jobKind"), status=status,
+                            attempts=attempts, retry_in=round(delay))
+        for key in ("jobId", "jobKind", "jobAsOf", "jobFingerprint"):
+            self.state.pop(key, None)
+        self._save_state()
+        return False
+
+    def _clear_retry(self) -> None:
+        for key in ("retryKind", "retryAttempts", "retryAt"):
+            self.state.pop(key, None)
+
+    def poll(self, now: datetime | None = None) -> str | None:
+        """
+        One scheduler tick. Returns the kind of job submitted, if any.
+        Raises on database errors; run() turns those into backoff.
+        """
+        from helper import is_latest_kri_processed
+        from jobs import JOBS
+        from kri_snapshot import SNAPSHOT
+        from kri_stage import STAGE
+
+        now = now or datetime.now()
+        if self._check_job(now):
+            return None
+
+        fingerprint = STAGE.source_fingerprint()
+        changed = fingerprint != self.state.get("fingerprint")
+        if changed:
+            # new data gets a fresh set of attempts
+            self._clear_retry()
+            self.state.pop("abandonedFingerprint", None)
+            self.state["fingerprint"] = fingerprint
+            self.state["changedAt"] = now.isoformat(timespec="seconds")
+            self._save_state()
+            log.info("kri_source_changed", fingerprint=fingerprint)
+        self._interval = self.poll_seconds if changed else min(self._interval * 2, self.max_backoff)
+
+        if fingerprint == self.state.get("processedFingerprint") or not fingerprint["maxDate"]:
+            return None
+        if fingerprint == self.state.get("abandonedFingerprint"):
+            return None
+        if self.state.get("retryAt") and now < datetime.fromisoformat(self.state["retryAt"]):
+            return None
+        if not self.window.matches(now):
+            return None
+
+        STAGE.sync(force=True)
+        SNAPSHOT.refresh(force=True)
+        as_of = fingerprint["maxDate"]
+        if self.state.get("retryKind"):
+            kind = self.state["retryKind"]
+        elif not is_latest_kri_processed():
+            kind = "monthly"
+        elif as_of == self.state.get("processedAsOf"):
+            kind = "gpt_run"
+        else:
+            # recommendations for this date were produced outside the scheduler
+            self.state["processedAsOf"] = as_of
+            self.state["processedFingerprint"] = fingerprint
+            self._save_state()
+            return None
+
+        job_id = JOBS.submit(kind)
+        self.state.update(jobId=job_id, jobKind=kind, jobAsOf=as_of, jobFingerprint=fingerprint)
+        self._save_state()
+        self._interval = self.poll_seconds
+        log.info("scheduled_job_queued", as_of=as_of, kind=kind, job_id=job_id)
+        return kind
+
+    def run(self) -> None:
+        # another worker may have led (and moved the watermark) since this one started
+        self.state = self._load_state()
+        log.info("scheduler_started", window=self.window.expr, poll_seconds=self.poll_seconds)
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self._interval = min(max(self._interval, self.poll_seconds) * 2, self.max_backoff)
+                log.exception("scheduler_failed", error=str(e), retry_in=round(self._interval))
+            self._stop.wait(self._interval)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+SCHEDULER = WatermarkScheduler()
@@ -0,0 +1,63 @@
+# serve.py
+"""
+Production entry point: gunicorn with several worker processes, each with a
+thread pool, serving create_app().
+
+    python serve.py
+    WEB_WORKERS=8 WEB_THREADS=16 WEB_BIND=0.0.0.0:8080 python serve.py
+    gunicorn -c serve.py "app:create_app()"
+
+Every worker campaigns for leadership (leader.py); only the leader runs the
+scheduler and the email dispatcher, so adding workers scales the API without
+duplicating GPT runs or emails.
+"""
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8080")
+workers = int(os.getenv("WEB_WORKERS", str(min(multiprocessing.cpu_count() * 2 + 1, 9))))
+threads = int(os.getenv("WEB_THREADS", "8"))
+worker_class = "gthread"
+# /gpt/run?full=1 and /gpt/summary hold the request open for the whole LLM round trip
+timeout = int(os.getenv("WEB_TIMEOUT", "900"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+# recycle workers now and then; a new leader is elected if it was the one
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+accesslog = os.getenv("WEB_ACCESS_LOG") or None
+# engines, pools and threads are created per worker, after the fork
+preload_app = False
+
+
+def post_worker_init(worker):
+    from leader import LEADER
+    LEADER.start()
+
+
+def worker_exit(server, worker):
+    from leader import LEADER
+    LEADER.stop()
+
+
+if __name__ == "__main__":
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in globals().items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            from app import create_app
+            return create_app()
+
+    from logs import get_logger, shutdown
+    get_logger(__name__).info("server_starting", bind=bind, workers=workers, threads=threads)
+    # the log writer thread does not survive the fork; every worker starts its own
+    shutdown()
+    Server().run()
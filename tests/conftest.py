@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# the service modules live at the repository root; helper needs an engine URL at import,
+# and a file, since an in-memory SQLite database cannot be attached as `dbo`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SQL_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'tests.db')}")
+os.environ.setdefault("LLM_CACHE_ENABLED", "0")
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+
+from scheduler import CronWindow
+
+MONDAY = datetime(2025, 6, 2, 12, 30)  # Monday 2 June 2025
+
+
+def test_every_minute():
+    assert CronWindow("* * * * *").matches(MONDAY)
+
+
+def test_hour_range_and_weekday():
+    window = CronWindow("* 12-23 * * 1")
+    assert window.matches(MONDAY)
+    assert not window.matches(MONDAY.replace(hour=11))
+    assert not window.matches(datetime(2025, 6, 3, 12, 30))  # Tuesday
+
+
+def test_steps_and_lists():
+    window = CronWindow("*/15 9,17 * * *")
+    assert window.matches(datetime(2025, 6, 2, 9, 45))
+    assert window.matches(datetime(2025, 6, 2, 17, 0))
+    assert not window.matches(datetime(2025, 6, 2, 9, 20))
+    assert not window.matches(datetime(2025, 6, 2, 10, 0))
+
+
+def test_seven_is_sunday():
+    sunday = datetime(2025, 6, 1, 8, 0)
+    assert CronWindow("* * * * 7").matches(sunday)
+    assert CronWindow("* * * * 0").matches(sunday)
+    assert not CronWindow("* * * * 7").matches(MONDAY)
+
+
+def test_restricted_day_fields_match_either():
+    window = CronWindow("* * 1 * 1")  # the 1st of the month or any Monday
+    assert window.matches(MONDAY)
+    assert window.matches(datetime(2025, 6, 1, 0, 0))
+    assert not window.matches(datetime(2025, 6, 3, 0, 0))
+
+
+def test_month_field():
+    assert not CronWindow("* * * 1-3 *").matches(MONDAY)
+
+
+@pytest.mark.parametrize("expr", ["* * * *", "60 * * * *", "* 5-2 * * *", "*/0 * * * *", "* * 0 * *"])
+def test_invalid_expressions_are_rejected(expr):
+    with pytest.raises(ValueError):
+        CronWindow(expr)
@@ -0,0 +1,65 @@
+import base64
+import json
+
+import pytest
+
+import kri_snapshot
+from routes import _decode_cursor, _encode_cursor
+
+
+def test_cursor_round_trip():
+    key = (-2, -739037, "KRI-00042")
+    cursor = _encode_cursor(key)
+    assert "=" not in cursor
+    assert _decode_cursor(cursor) == key
+
+
+@pytest.mark.parametrize("cursor", [
+    "zzz",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(json.dumps([1, 2]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(["a", 2, "x"]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"k": 1}).encode()).decode(),
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        _decode_cursor(cursor)
+
+
+def _raw(entity, as_of, status):
+    return {**dict.fromkeys(kri_snapshot.WINDOW_FIELDS), "relatedEntityId": entity, "metricName": f"KRI {entity}",
+            "metricValue": 1.0, "observedAt": as_of, "asOfDate": as_of, "statusBand": status, "breachedKris": 1}
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    raw = [_raw(f"KRI-{i:03d}", as_of, status)
+           for i in range(7)
+           for as_of, status in (("2025-04-30", "Warning"), ("2025-05-31", "Breached" if i % 2 else "Warning"))]
+    monkeypatch.setattr(kri_snapshot.STAGE, "window_rows", lambda watermark, months: raw)
+    snap = kri_snapshot.KriSnapshot()
+    snap._load("2025-05-31")
+    return snap
+
+
+def test_pages_cover_the_window_once_in_order(snapshot):
+    seen, after = [], None
+    while True:
+        rows, after, version = snapshot.window_page(after, limit=3)
+        seen.extend(rows)
+        if after is None:
+            break
+    assert seen == snapshot.window_page()[0]
+    assert len({(r["relatedEntityId"], r["observedAt"]) for r in seen}) == 14
+    assert [kri_snapshot.window_key(r) for r in seen] == sorted(kri_snapshot.window_key(r) for r in seen)
+    assert version == snapshot.version
+
+
+def test_unlimited_page_has_no_next_key(snapshot):
+    rows, after, _ = snapshot.window_page()
+    assert len(rows) == 14 and after is None
+
+
+def test_cursor_past_the_end_is_an_empty_page(snapshot):
+    rows, after, _ = snapshot.window_page((99, 0, ""), limit=3)
+    assert rows == [] and after is None
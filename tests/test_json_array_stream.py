@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from helper import JsonArrayStream
+
+
+OBJECTS = [{"relatedEntityId": "KRI-1", "recommendationText": "Say \"hi\" [now] {later}"},
+           {"relatedEntityId": "KRI-2", "metadata": {"nested": [1, {"x": "}"}]}}]
+
+
+def feed_in_pieces(text: str, size: int) -> list[dict]:
+    stream = JsonArrayStream()
+    out = []
+    for i in range(0, len(text), size):
+        out.extend(stream.feed(text[i:i + size]))
+    return out
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, 10_000])
+def test_objects_are_emitted_whatever_the_piece_size(size):
+    assert feed_in_pieces(json.dumps({"recommendations": OBJECTS}), size) == OBJECTS
+
+
+def test_bare_array_inside_prose_and_fences():
+    text = 'Here you go:\n```json\n' + json.dumps(OBJECTS) + '\n```\nLet me know "if" needed.'
+    assert JsonArrayStream().feed(text) == OBJECTS
+
+
+def test_objects_complete_before_a_cut_off_are_kept():
+    text = json.dumps(OBJECTS)
+    assert JsonArrayStream().feed(text[:len(text) - 10]) == OBJECTS[:1]
+
+
+def test_only_direct_children_of_the_first_array_are_emitted():
+    text = json.dumps([{"a": [{"inner": 1}]}, 5, "x", {"b": 2}])
+    assert JsonArrayStream().feed(text) == [{"a": [{"inner": 1}]}, {"b": 2}]
+
+
+def test_a_garbled_object_is_skipped_without_losing_the_next():
+    text = '[{"a": 1}, {"b": 2,, }, {"c": 3}]'
+    assert JsonArrayStream().feed(text) == [{"a": 1}, {"c": 3}]
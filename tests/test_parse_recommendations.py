@@ -0,0 +1,45 @@
+import json
+
+from helper import parse_recommendations, reconcile_recommendations
+
+
+def row(entity, observed="2025-05-31"):
+    return {"relatedEntityId": entity, "metricName": f"KRI {entity}", "metricValue": 1.0,
+            "observedAt": observed, "riskType": "Credit"}
+
+
+def rec(entity, observed="2025-05-31", **overrides):
+    return {"source": "KRI", "relatedEntityId": entity, "metricName": f"KRI {entity}", "metricValue": 1.0,
+            "recommendationText": "Review exposure.", "actionType": "Investigate", "confidence": 0.7,
+            "observedAt": observed, "riskType": "Credit", **overrides}
+
+
+def test_valid_json_is_read_as_is():
+    assert parse_recommendations(json.dumps([rec("A")])) == [rec("A")]
+    assert parse_recommendations(json.dumps({"recommendations": [rec("A")]})) == [rec("A")]
+
+
+def test_code_fence_is_stripped():
+    assert parse_recommendations("```json\n" + json.dumps([rec("A")]) + "\n```") == [rec("A")]
+
+
+def test_broken_completion_is_salvaged_object_by_object():
+    text = '{"recommendations": [' + json.dumps(rec("A")) + ', {"relatedEntityId": "B",, }, ' \
+           + json.dumps(rec("C")) + ', {"relatedEntityId": "D", "recommendationText": "cut'
+    assert [r["relatedEntityId"] for r in parse_recommendations(text)] == ["A", "C"]
+
+
+def test_reconcile_splits_valid_missing_and_invalid():
+    rows = [row("A"), row("B"), row("C")]
+    recs = [rec("A"), rec("B", actionType="Panic"), rec("Z"), "not an object"]
+    valid, missing, invalid = reconcile_recommendations(rows, recs)
+    assert [r["relatedEntityId"] for r in valid] == ["A"]
+    assert [r["relatedEntityId"] for r in missing] == ["B", "C"]
+    assert [r["relatedEntityId"] for r in invalid] == ["B"]
+
+
+def test_reconcile_pairs_same_entity_by_date():
+    rows = [row("A", "2025-04-30"), row("A", "2025-05-31")]
+    valid, missing, _ = reconcile_recommendations(rows, [rec("A", "2025-05-31")])
+    assert missing == [rows[0]]
+    assert valid[0]["observedAt"] == "2025-05-31"
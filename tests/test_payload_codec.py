@@ -0,0 +1,54 @@
+from payload_codec import decode_rows, encode_rows, expand_recommendation
+
+
+ROWS = [
+    {"relatedEntityId": "KRI-1", "metricName": "Liquidity gap", "metricValue": 12.3456789, "observedAt": "2025-05-31",
+     "riskType": "Liquidity", "warningLimit": 10.0, "thresholdLimit": None},
+    {"relatedEntityId": "KRI-2", "metricName": "Loan loss ratio", "metricValue": 3.0, "observedAt": "2025-05-31",
+     "riskType": "Credit", "warningLimit": 10.0, "thresholdLimit": None},
+]
+
+
+def test_constant_columns_move_out_and_null_columns_are_dropped():
+    payload = encode_rows("KRI", "year_2025", ROWS)
+    assert payload["constants"] == {"observedAt": "2025-05-31", "warningLimit": 10.0}
+    assert "thresholdLimit" not in payload["columns"]
+    assert payload["columns"][0] == "row"
+    assert [r[0] for r in payload["rows"]] == [0, 1]
+
+
+def test_floats_are_trimmed_to_six_significant_digits():
+    payload = encode_rows("KRI", "year_2025", ROWS)
+    assert payload["rows"][0][payload["columns"].index("metricValue")] == 12.3457
+
+
+def test_decode_restores_the_rows_except_dropped_columns():
+    decoded = decode_rows(encode_rows("KRI", "year_2025", ROWS))
+    for original, row in zip(ROWS, decoded):
+        expected = {k: v for k, v in original.items() if v is not None}
+        expected["metricValue"] = float(f"{original['metricValue']:.6g}")
+        assert row == expected
+
+
+def test_single_row_keeps_every_column_in_the_row():
+    payload = encode_rows("KRI", "year_2025", ROWS[:1])
+    assert payload["constants"] == {}
+
+
+def test_values_equal_but_of_another_type_are_not_constant():
+    rows = [{"a": 1}, {"a": 1.0}]
+    assert encode_rows("KRI", "w", rows)["constants"] == {}
+
+
+def test_expand_copies_carried_fields_from_the_indexed_row():
+    rec = expand_recommendation({"row": "1", "recommendationText": "Tighten", "metricValue": 999}, ROWS, "KRI")
+    assert rec["relatedEntityId"] == "KRI-2"
+    assert rec["metricValue"] == 3.0  # exact value from the row, not the model's
+    assert rec["source"] == "KRI"
+    assert "row" not in rec
+
+
+def test_expand_leaves_answers_without_a_usable_row_alone():
+    for bad in ({"row": 5}, {"row": True}, {"row": -1}, {"relatedEntityId": "KRI-1"}):
+        assert expand_recommendation(bad, ROWS, "KRI") == bad
+    assert expand_recommendation("garbage", ROWS, "KRI") == "garbage"
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+import reuse
+
+
+HISTORY = [
+    {"RelatedEntityId": "KRI-A", "MetricName": "Loan loss ratio - Branch A", "RiskType": "Credit",
+     "MetricValue": 12.5, "ObservedAt": "2025-04-30", "RecommendationText": "Ratio at 12.50 exceeds the limit.",
+     "ActionType": "Investigate", "Confidence": 0.8, "Metadata": json.dumps({"severityRank": 1})},
+]
+
+
+@pytest.fixture
+def index(monkeypatch):
+    def run_query(sql, params=None):
+        if "COUNT(*)" in sql:
+            return [{"n": len(HISTORY), "latest": "2025-04-30"}]
+        return HISTORY
+    monkeypatch.setattr(reuse, "run_query", run_query)
+    monkeypatch.setattr(reuse, "REUSE_ENABLED", True)
+    # low enough that "Branch A" and "Branch B" count as the same metric name
+    return reuse.ReuseIndex(min_similarity=0.5)
+
+
+def row(entity, name, value, observed="2025-05-31"):
+    return {"relatedEntityId": entity, "metricName": name, "riskType": "Credit",
+            "metricValue": value, "observedAt": observed}
+
+
+def test_same_entity_reuses_with_the_new_value(index):
+    reused, pending = index.match([row("KRI-A", "Loan loss ratio - Branch A", 12.6)])
+    assert pending == []
+    assert reused[0]["recommendationText"] == "Ratio at 12.60 exceeds the limit."
+    assert reused[0]["metadata"]["reusedFrom"]["relatedEntityId"] == "KRI-A"
+
+
+def test_other_entity_with_a_near_identical_name_is_not_reused(index):
+    names = reuse.embed([reuse.index_text("Loan loss ratio - Branch A", "Credit"),
+                         reuse.index_text("Loan loss ratio - Branch B", "Credit")])
+    assert names[0] @ names[1] >= index.min_similarity
+    reused, pending = index.match([row("KRI-B", "Loan loss ratio - Branch B", 12.5)])
+    assert reused == [] and len(pending) == 1
+
+
+def test_value_moved_too_far_is_not_reused(index):
+    reused, _ = index.match([row("KRI-A", "Loan loss ratio - Branch A", 20.0)])
+    assert reused == []
+
+
+def test_severity_must_match(index):
+    scores = {("KRI-A", "2025-05-31"): {"severityRank": 2}}
+    reused, _ = index.match([row("KRI-A", "Loan loss ratio - Branch A", 12.6)], scores)
+    assert reused == []
+
+
+def test_retemplate_keeps_the_quoted_format():
+    assert reuse.retemplate("value 1,234.50 today", 1234.5, 1300) == ("value 1,300.00 today", True)
+    assert reuse.retemplate("no number here", 12.5, 13) == ("no number here", False)
+    assert reuse.retemplate("Ratio at 12.5.", 12.5, 12.63) == ("Ratio at 12.6.", True)
+
+
+def test_retemplate_leaves_numbers_sharing_digits_alone():
+    assert reuse.retemplate("NPL 5.0% vs 15.0% cap", 5.0, 5.2) == ("NPL 5.2% vs 15.0% cap", True)
+    assert reuse.retemplate("Ratio at 12.50 exceeds", 12.5, 12.63) == ("Ratio at 12.63 exceeds", True)
+    assert reuse.retemplate("Limit 112.5", 12.5, 12.9) == ("Limit 112.5", False)
+    assert reuse.retemplate("Limit 12.55, now 12.5", 12.5, 12.9) == ("Limit 12.55, now 12.9", True)
+
+
+def test_reused_recommendation_is_valid(index):
+    from Schema import Recommendation
+    reused, _ = index.match([row("KRI-A", "Loan loss ratio - Branch A", 12.6)])
+    Recommendation(**reused[0])
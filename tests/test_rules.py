@@ -0,0 +1,60 @@
+import math
+
+import rules
+
+
+def kri(value, status="Breached", warning=10.0, op=">", escalation=15.0, esc_op=">", **extra):
+    return {"relatedEntityId": "KRI-1", "metricName": "Liquidity gap", "metricValue": value,
+            "observedAt": "2025-05-31", "riskType": "Liquidity", "statusBand": status,
+            "warningLimit": warning, "warningLimitOperator": op,
+            "escalationLimit": escalation, "escalationLimitOperator": esc_op,
+            "thresholdLimit": None, "thresholdOperator": None, **extra}
+
+
+def test_severity_follows_the_highest_crossed_tier():
+    s = rules.score_rows([kri(5.0, "Safe"), kri(12.0, "Warning"), kri(16.0)])
+    assert list(s["severityRank"]) == [0, 1, 2]
+
+
+def test_lower_is_worse_operators():
+    s = rules.score_rows([kri(3.0, warning=5.0, op="<", escalation=2.0, esc_op="<")])
+    assert s["severityRank"][0] == 1
+    assert math.isclose(s["distanceToLimit"][0], 0.4)
+    assert s["postMitigationValue"][0] == 5.0
+
+
+def test_post_mitigation_value_sits_inside_inclusive_limits():
+    s = rules.score_rows([kri(12.0, op=">=")])
+    assert math.isclose(s["postMitigationValue"][0], 10.0 - rules.RULES_SAFE_MARGIN * 10.0)
+
+
+def test_unknown_operator_or_value_is_never_resolvable():
+    s = rules.score_rows([kri(5.0, "Safe", op="??", esc_op=None), kri(None, "Safe")])
+    assert not s["resolvable"].any()
+
+
+def test_only_rows_the_source_does_not_flag_are_resolved():
+    rows = [kri(5.0, "Safe"), kri(5.0, "Breached"), kri(5.0, "Warning"), kri(16.0)]
+    resolved, pending, scores = rules.triage(rows)
+    assert [r["actionType"] for r in resolved] == ["NoAction"]
+    assert [r["statusBand"] for r in pending] == ["Breached", "Warning", "Breached"]
+
+
+def test_disagreeing_rows_keep_the_models_target():
+    rows = [dict(kri(5.0, "Breached"), relatedEntityId="KRI-2")]
+    _, pending, scores = rules.triage(rows)
+    score = scores[("KRI-2", "2025-05-31")]
+    assert score["limitsDisagree"] and score["postMitigationValue"] is None
+
+    rec = {"relatedEntityId": "KRI-2", "observedAt": "2025-05-31", "postMitigationValue": 4.0, "metadata": {}}
+    out = rules.apply_scores(rec, scores)
+    assert out["postMitigationValue"] == 4.0
+    assert out["metadata"]["limitsDisagree"] is True
+
+
+def test_apply_scores_overrides_the_model_target():
+    _, _, scores = rules.triage([kri(16.0)])
+    out = rules.apply_scores({"relatedEntityId": "KRI-1", "observedAt": "2025-05-31",
+                              "postMitigationValue": 99.0}, scores)
+    assert out["postMitigationValue"] == 10.0
+    assert out["metadata"]["severityRank"] == 2
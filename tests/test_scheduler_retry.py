@@ -0,0 +1,89 @@
+import sys
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+import helper
+import kri_snapshot
+import kri_stage
+from scheduler import WatermarkScheduler
+
+FINGERPRINT = {"maxDate": "2025-05-31", "rows": 10, "checksum": 1.0}
+
+
+class FakeJobs:
+    def __init__(self):
+        self.submitted = []
+        self.status = "failed"
+
+    def submit(self, kind):
+        self.submitted.append(kind)
+        return f"job-{len(self.submitted)}"
+
+    def get(self, job_id):
+        return {"status": self.status}
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    fake = FakeJobs()
+    monkeypatch.setitem(sys.modules, "jobs", types.SimpleNamespace(JOBS=fake))
+    stage = types.SimpleNamespace(source_fingerprint=lambda: dict(FINGERPRINT), sync=lambda force=False: None)
+    monkeypatch.setattr(kri_stage, "STAGE", stage)
+    monkeypatch.setattr(kri_snapshot, "SNAPSHOT", types.SimpleNamespace(refresh=lambda force=False: None))
+    monkeypatch.setattr(helper, "is_latest_kri_processed", lambda: False)
+    return fake
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return WatermarkScheduler(poll_seconds=60, max_backoff=300, window="* * * * *",
+                              state_path=str(tmp_path / "state.json"), max_retries=4)
+
+
+def test_failing_job_backs_off_then_gives_up(jobs, scheduler):
+    now = datetime(2025, 6, 2, 12, 0)
+    assert scheduler.poll(now) == "monthly"
+    waits = []
+    for _ in range(3):
+        assert scheduler.poll(now) is None  # settles the failure
+        retry_at = datetime.fromisoformat(scheduler.state["retryAt"])
+        waits.append((retry_at - now).total_seconds())
+        assert scheduler.poll(retry_at - timedelta(seconds=1)) is None
+        now = retry_at
+        assert scheduler.poll(now) == "monthly"
+    assert waits == [60, 120, 240]
+
+    assert scheduler.poll(now) is None  # fourth failure: abandoned
+    assert "retryKind" not in scheduler.state
+    assert scheduler.poll(now + timedelta(days=1)) is None
+    assert len(jobs.submitted) == 4
+
+    # the state survives a restart
+    assert WatermarkScheduler(state_path=scheduler.state_path).state == scheduler.state
+
+
+def test_new_source_data_gets_fresh_attempts(jobs, scheduler, monkeypatch):
+    now = datetime(2025, 6, 2, 12, 0)
+    scheduler.max_retries = 1
+    scheduler.poll(now)
+    scheduler.poll(now)
+    assert scheduler.poll(now) is None
+
+    corrected = dict(FINGERPRINT, checksum=2.0)
+    monkeypatch.setattr(kri_stage, "STAGE", types.SimpleNamespace(
+        source_fingerprint=lambda: dict(corrected), sync=lambda force=False: None))
+    assert scheduler.poll(now) == "monthly"
+
+
+def test_success_clears_the_retry_count(jobs, scheduler):
+    now = datetime(2025, 6, 2, 12, 0)
+    scheduler.poll(now)
+    scheduler.poll(now)
+    assert scheduler.state["retryAttempts"] == 1
+    scheduler.poll(datetime.fromisoformat(scheduler.state["retryAt"]))
+    jobs.status = "succeeded"
+    scheduler.poll(now)
+    assert not {"retryKind", "retryAttempts", "retryAt"} & scheduler.state.keys()
+    assert scheduler.state["processedFingerprint"] == FINGERPRINT
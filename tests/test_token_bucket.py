@@ -0,0 +1,114 @@
+import types
+
+import pytest
+
+import llm_client
+from llm_client import TokenBucket
+
+
+class FakeClock:
+    """Stands in for time.monotonic and the bucket's Condition: wait() advances the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def wait(self, seconds):
+        self.now += seconds
+
+    def notify_all(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(llm_client, "time", types.SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+def bucket(clock, per_minute):
+    b = TokenBucket(per_minute)
+    b._cond = clock
+    return b
+
+
+def test_full_bucket_does_not_wait(clock):
+    b = bucket(clock, 60)
+    assert b.acquire(60) == 0
+
+
+def test_empty_bucket_waits_for_refill(clock):
+    b = bucket(clock, 60)  # one unit per second
+    b.acquire(60)
+    assert b.acquire(3) == pytest.approx(3)
+
+
+def test_refill_is_capped_at_capacity(clock):
+    b = bucket(clock, 60)
+    clock.now += 3600
+    b.acquire(60)
+    assert b.acquire(1) == pytest.approx(1)
+
+
+def test_oversized_request_is_clamped(clock):
+    b = bucket(clock, 10)
+    assert b.acquire(1000) == 0
+    assert b._tokens == pytest.approx(0)
+
+
+def test_settle_corrects_the_reservation(clock):
+    b = bucket(clock, 60)
+    b.acquire(50)
+    b.settle(-40)  # used 10 instead of 50
+    assert b.acquire(50) == 0
+    b.settle(30)  # used 80 instead of 50: goes into debt
+    assert b.acquire(1) == pytest.approx(31)
+
+
+def test_zero_rate_is_unlimited_but_honours_pause(clock):
+    b = bucket(clock, 0)
+    assert b.acquire(1e9) == 0
+    b.pause(5)
+    assert b.acquire() == pytest.approx(5)
+
+
+def test_pause_holds_callers_back(clock):
+    b = bucket(clock, 60)
+    b.pause(10)
+    b.pause(2)  # a shorter pause never shortens the current one
+    assert b.acquire() == pytest.approx(10)
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status_code = status
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_retries_reserve_the_prompt_only_once(monkeypatch):
+    client = llm_client.LLMClient(rpm=0, tpm=60000, max_retries=3, backoff_max=0)
+    responses = iter([FakeResponse(503), FakeResponse(502), FakeResponse(200)])
+    monkeypatch.setattr(client.session, "post", lambda *a, **kw: next(responses))
+    monkeypatch.setattr(llm_client.time, "sleep", lambda s: None)
+    reserved = []
+    acquire = client.tokens_bucket.acquire
+    monkeypatch.setattr(client.tokens_bucket, "acquire", lambda amount=1.0: reserved.append(amount) or acquire(amount))
+
+    body = {"model": "m", "messages": [{"role": "user", "content": "hello " * 200}]}
+    assert client.post("/chat/completions", body).status_code == 200
+    assert reserved == [llm_client.estimate_tokens(body), 0, 0]